@@ -0,0 +1,124 @@
+import os
+import re
+import time
+from typing import List, Tuple
+
+import pandas as pd
+
+from database_manager.schema import (
+    DATETIME_FORMAT,
+    HOURLY_SCHEMA,
+    MEASURES,
+    MONTHLY_SCHEMA,
+)
+
+KEYS = ["PULocationID", "DOLocationID"]
+
+
+class Aggregator:
+    def __init__(self, chunk_size: int = 500_000, merge_every: int = 10) -> None:
+        """
+        Computes the hourly and monthly trip summaries by pick-up and drop-off zone in a single pass over the csv file of a month, so the dashboards do not have to scan the main table.
+
+        :param chunk_size int: the number of rows read and grouped at a time.
+        :param merge_every int: the number of partial results kept before they are merged, which bounds the memory used.
+        """
+        self.chunk_size = chunk_size
+        self.merge_every = merge_every
+
+    @staticmethod
+    def _merge(partials: List[pd.DataFrame]) -> pd.DataFrame:
+        return (
+            pd.concat(partials)
+            .groupby(["pickup_hour"] + KEYS, sort=False, dropna=False)
+            .sum()
+        )
+
+    @staticmethod
+    def month_of(file_name: str) -> str:
+        """
+        Returns the first day of the month of the file, taken from its name (e.g. '2021-07.csv').
+
+        :param file_name str: the csv file of the month.
+        :returns: the first day of the month, e.g. '2021-07-01'
+        :rtype: str
+        """
+        found = re.search(r"(\d{4})-(\d{2})", os.path.basename(file_name))
+        if found is None:
+            raise ValueError(f"Cannot tell the month of {file_name}")
+        return f"{found.group(1)}-{found.group(2)}-01"
+
+    def aggregate(
+        self, file_name: str = "2021-07.csv", month: str = None
+    ) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Groups every chunk of the file by the hour of the pick-up and the pick-up and drop-off zones, and merges the partial results. The trips without a zone (e.g. in the files from before July 2016) are grouped under an empty zone. The monthly summary is derived from the hourly one, so the file is only read once. Every row of both summaries is labelled with the month of the file, which lets a month be replaced without touching the others.
+
+        :param file_name str: the csv file of the month. Its columns have to match the table created by Database.create_table.
+        :param month str: the first day of the month (e.g. '2021-07-01'). Taken from the file name if not given.
+        :returns: the hourly and the monthly summary, with the columns of HOURLY_SCHEMA and MONTHLY_SCHEMA
+        :rtype: Tuple[pd.DataFrame, pd.DataFrame]
+        """
+        start = time.perf_counter()
+        month = month or self.month_of(file_name)
+        partials, rows = [], 0
+        for chunk in pd.read_csv(
+            file_name,
+            usecols=["tpep_pickup_datetime"] + KEYS + MEASURES,
+            dtype={measure: "float64" for measure in MEASURES},
+            chunksize=self.chunk_size,
+        ):
+            rows += len(chunk)
+            chunk["pickup_hour"] = pd.to_datetime(
+                chunk.pop("tpep_pickup_datetime"),
+                format=DATETIME_FORMAT,
+                errors="coerce",
+            ).dt.floor("h")
+            chunk["trip_count"] = 1
+            partials.append(
+                chunk.groupby(["pickup_hour"] + KEYS, sort=False, dropna=False)[
+                    ["trip_count"] + MEASURES
+                ].sum()
+            )
+            if len(partials) >= self.merge_every:
+                partials = [self._merge(partials)]
+
+        if partials:
+            hourly = self._merge(partials).reset_index()
+        else:
+            hourly = pd.DataFrame(columns=[name for name, _ in HOURLY_SCHEMA[1:]])
+        hourly.insert(0, "month", pd.Timestamp(month))
+        monthly = (
+            hourly.drop(columns="pickup_hour")
+            .groupby(["month"] + KEYS, sort=False, dropna=False)
+            .sum()
+            .reset_index()
+        )
+        duration = time.perf_counter() - start
+        print(
+            f"{file_name}: {rows} rows aggregated into {len(hourly)} hourly and {len(monthly)} monthly rows ({rows / max(duration, 1e-9):.0f} rows/s)"
+        )
+        return (
+            hourly[[name for name, _ in HOURLY_SCHEMA]],
+            monthly[[name for name, _ in MONTHLY_SCHEMA]],
+        )
+
+
+def to_rows(frame: pd.DataFrame) -> List[tuple]:
+    """
+    Converts a summary into rows of plain Python values which any DB-API driver accepts, with None in place of the missing values.
+
+    :param frame pd.DataFrame: the summary.
+    :returns: the rows of the summary
+    :rtype: List[tuple]
+    """
+    columns = []
+    for column in frame.columns:
+        values = frame[column]
+        if pd.api.types.is_datetime64_any_dtype(values):
+            columns.append(
+                [value.to_pydatetime() if pd.notna(value) else None for value in values]
+            )
+        else:
+            columns.append(values.astype(object).where(values.notna(), None).tolist())
+    return list(zip(*columns))
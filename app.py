@@ -1,70 +1,659 @@
 import os
 from datetime import datetime
+from typing import Iterator, Sequence
 
-from dotenv import load_dotenv
-from tqdm import tqdm
+from collector.collector import Collector, ContentDigest
+from file_manager.splitter import split_csv
+from manifest.manifest import Manifest, file_checksum
+from metrics.metrics import get_metrics
+from normalizer.normalizer import Normalizer
+from pipeline.pipeline import Pipeline, Stage
+from provisioner.provisioner import Provisioner
+from retry.retry import endpoint_stats
+from spool.spool import Spool
 
-from collector.collector import Collector
-from database_manager.database_manager import Database
-from file_manager.file_manager import FileManager
+# the stages of a full run; the Azure SDKs, the ODBC driver, pandas and pyarrow are only imported by the stages
+# which use them, so a run which only downloads starts quickly and does not need them installed
+STAGES = ("download", "upload", "load")
 
-load_dotenv()
 
-AZURE_SUBSCRIPTION_ID = os.getenv("AZURE_SUBSCRIPTION_ID")
-AZURE_CLIENT_ID = os.getenv("AZURE_CLIENT_ID")
-AZURE_CLIENT_SECRET = os.getenv("AZURE_CLIENT_SECRET")
-AZURE_TENANT_ID = os.getenv("AZURE_TENANT_ID")
+def check_stream(
+    stream: bool,
+    shards: int = 1,
+    validate: bool = False,
+    parquet: bool = False,
+    aggregate: bool = False,
+) -> None:
+    """
+    Checks that the options of a run can be honoured when the months are streamed. The months are split into shards, validated, exported to Parquet and summarized from their local files, which a stream never writes.
 
+    :param stream bool: whether the months are streamed.
+    :param shards int: the number of shards every month is split into.
+    :param validate bool: whether the months are validated.
+    :param parquet bool: whether the months are exported to Parquet.
+    :param aggregate bool: whether the months are summarized.
+    :returns: None
+    :rtype: NoneType
+    """
+    if not stream:
+        return
+    options = [
+        option
+        for option, used in (
+            ("shards", shards > 1),
+            ("validate", validate),
+            ("parquet", parquet),
+            ("aggregate", aggregate),
+        )
+        if used
+    ]
+    if options:
+        raise ValueError(
+            f"A streamed month is never saved, so it cannot be used with {', '.join(options)}"
+        )
+
+
+def table_layout(url: str, chunks: Iterator[bytes]) -> Iterator[bytes]:
+    """
+    Passes the chunks of a streamed month on if the month has the layout of the table. The older layouts are only normalized from a local file, so a streamed month in one of them is refused before anything is uploaded or loaded.
+
+    :param url str: the url of the month.
+    :param chunks Iterator[bytes]: the chunks of the month, e.g. from Collector.stream_data.
+    :returns: the same chunks
+    :rtype: Iterator[bytes]
+    """
+    first = next(chunks, b"")
+    version = Normalizer.detect_header_version(first.split(b"\n", 1)[0], url)
+    if version is not None:
+        raise ValueError(
+            f"{url} has the {version} layout, which is only normalized from a downloaded file; run it without stream"
+        )
+    yield first
+    yield from chunks
+
+
+def check_trip_type(
+    trip_type: str,
+    stages: Sequence[str],
+    validate: bool = False,
+    parquet: bool = False,
+    aggregate: bool = False,
+) -> None:
+    """
+    Checks that the months of the kind of trips can go through the stages. The table, the normalizer, the validator, the Parquet schema and the summaries all have the layout of the yellow taxi files, so the months of the other kinds can only be planned and downloaded.
+
+    :param trip_type str: the kind of trips, one of TRIP_TYPES.
+    :param stages Sequence[str]: the stages of the run.
+    :param validate bool: whether the months are validated.
+    :param parquet bool: whether the months are exported to Parquet.
+    :param aggregate bool: whether the months are summarized.
+    :returns: None
+    :rtype: NoneType
+    """
+    if trip_type == "yellow":
+        return
+    if "upload" in stages or "load" in stages or validate or parquet or aggregate:
+        raise ValueError(
+            f"Only the yellow trips have the layout of the table; the {trip_type} months can only be planned and downloaded"
+        )
+
+
+def main(
+    stream: bool = False,
+    manifest_path: str = "manifest.db",
+    download_workers: int = 2,
+    upload_workers: int = 2,
+    load_workers: int = 1,
+    shards: int = 1,
+    validate: bool = False,
+    parquet: bool = False,
+    aggregate: bool = False,
+    spool_dir: str = "downloads",
+    spool_quota: int = 20 * 1024**3,
+    keep_files: bool = False,
+    worker=None,
+    partitioned: bool = False,
+    trip_type: str = "yellow",
+    metrics_path: str = "metrics.jsonl",
+    prometheus_path: str = "metrics.prom",
+    start_year: int = 2021,
+    end_year: int = 2021,
+    months: Sequence[int] = (2,),
+    stages: Sequence[str] = STAGES,
+    source_url: str = "https://s3.amazonaws.com/nyc-tlc/trip+data/",
+    direct_load: bool = False,
+    segments: int = 1,
+    segment_threshold: int = 256 * 1024**2,
+):
+    from dotenv import find_dotenv, load_dotenv
 
-def main():
     start_time = datetime.now()
+    check_trip_type(trip_type, stages, validate, parquet, aggregate)
+    check_stream(stream, shards, validate, parquet, aggregate)
+    load_dotenv(find_dotenv())
+    if worker is not None and not partitioned and "load" in stages:
+        # a worker can crash after the load of a month has committed but before the month is completed; the month is
+        # then loaded again by another worker, which replaces its partition but adds its rows to a heap a second time
+        print(
+            "Warning: the months are loaded into a heap, so a month taken over by another worker may be loaded twice"
+        )
+    only_download = "upload" not in stages and "load" not in stages
+    uses_database = "load" in stages
+    # with direct_load the months are inserted from this machine and the storage is left out
+    uses_storage = not only_download and not direct_load
+    # the summaries are replaced in the database, next to the months
+    aggregate = aggregate and uses_database
+    # whether the months have to be on the local disk: a run which only loads reads them from the storage
+    uses_files = not stream and (
+        "download" in stages
+        or "upload" in stages
+        or shards > 1
+        or aggregate
+        or parquet
+        or (direct_load and uses_database)
+    )
 
     # # collect the urls
-    collector = Collector(2021, 2021)
-    urls = collector.generate_urls()
+    collector = Collector(start_year, end_year, base_url=source_url)
+    # probe the candidate months at once; the months which do not exist are left out and the largest go first
+    catalog = collector.discover(collector.generate_urls(trip_type, months))
+    urls = Collector.plan(catalog)
+    month_of = {entry.url: f"{entry.month}-01" for entry in catalog}
 
-    # create a container inside the storage which has already been created
-    fmanager = FileManager()
-    fmanager.create_container("tlc-datax")
+    # keep the local copies of the months in a directory with a limit on its size; when the months are only
+    # downloaded, they are kept for the run which uploads them
+    spool = Spool(spool_dir, spool_quota, keep=keep_files or only_download)
 
-    # create a server, a database, connect the database to the storage and create a table to store the data
-    dbmanager = Database(
-        AZURE_SUBSCRIPTION_ID, AZURE_CLIENT_ID, AZURE_CLIENT_SECRET, AZURE_TENANT_ID
-    )
-    dbmanager.create_server(server_name="tlc-data-serverx", group_name="tlc-data-rg")
-    dbmanager.create_database(
-        server_name="tlc-data-serverx", database_name="tlc-data-dbx"
-    )
-    dbmanager.whitelist_ip(server_name="tlc-data-serverx")
-    dbmanager.encrypt_database(
-        server_name="tlc-data-serverx", database_name="tlc-data-dbx"
-    )
-    dbmanager.create_credentials(
-        server_name="tlc-data-serverx", database_name="tlc-data-dbx"
-    )
-    dbmanager.create_external_data_source(
-        server_name="tlc-data-serverx",
-        database_name="tlc-data-dbx",
-        container_name="tlc-datax",
-    )
-    dbmanager.create_table(
-        server_name="tlc-data-serverx",
-        database_name="tlc-data-dbx",
-        table_name="tlc_datax",
-    )
+    # record the progress of every month so that a rerun only does the missing work
+    manifest = Manifest(manifest_path, directory=spool.directory)
+    manifest.register(urls)
+    if worker is not None:
+        # the months are split with the other workers through the shared store
+        worker.store.register(urls)
+
+    def check_sources() -> None:
+        for entry in catalog:
+            manifest.update_source(entry.url, entry.etag, entry.size)
+
+    fmanager = dbmanager = None
+    if uses_storage:
+        from file_manager.file_manager import FileManager
+
+        fmanager = FileManager()
+    if uses_database:
+        from database_manager.database_manager import Database
+
+        dbmanager = Database(
+            os.getenv("AZURE_SUBSCRIPTION_ID"),
+            os.getenv("AZURE_CLIENT_ID"),
+            os.getenv("AZURE_CLIENT_SECRET"),
+            os.getenv("AZURE_TENANT_ID"),
+            pool_size=max(4, shards),
+        )
+
+    # create a container inside the storage which has already been created, a server, a database, connect the database
+    # to the storage and create a table to store the data; whatever already exists is skipped and independent steps run at the same time
+    provisioner = Provisioner()
+    provisioner.add("sources", check_sources)
+    if uses_storage:
+        provisioner.add("container", lambda: fmanager.create_container("tlc-datax"))
+    if uses_database:
+        provisioner.add(
+            "server",
+            lambda: dbmanager.create_server(
+                server_name="tlc-data-serverx", group_name="tlc-data-rg"
+            ),
+        )
+        provisioner.add(
+            "database",
+            lambda: dbmanager.create_database(
+                server_name="tlc-data-serverx", database_name="tlc-data-dbx"
+            ),
+            depends_on=["server"],
+        )
+        provisioner.add(
+            "firewall",
+            lambda: dbmanager.whitelist_ip(server_name="tlc-data-serverx"),
+            depends_on=["server"],
+        )
+        provisioner.add(
+            "ready",
+            lambda: dbmanager.wait_for_database(
+                server_name="tlc-data-serverx", database_name="tlc-data-dbx"
+            ),
+            depends_on=["database", "firewall"],
+        )
+        provisioner.add(
+            "encryption",
+            lambda: dbmanager.encrypt_database(
+                server_name="tlc-data-serverx", database_name="tlc-data-dbx"
+            ),
+            depends_on=["ready"],
+        )
+        if uses_storage:
+            provisioner.add(
+                "credentials",
+                lambda: dbmanager.create_credentials(
+                    server_name="tlc-data-serverx", database_name="tlc-data-dbx"
+                ),
+                depends_on=["encryption"],
+            )
+            provisioner.add(
+                "data_source",
+                lambda: dbmanager.create_external_data_source(
+                    server_name="tlc-data-serverx",
+                    database_name="tlc-data-dbx",
+                    container_name="tlc-datax",
+                ),
+                depends_on=["credentials", "container"],
+            )
+        provisioner.add(
+            "table",
+            lambda: dbmanager.create_table(
+                server_name="tlc-data-serverx",
+                database_name="tlc-data-dbx",
+                table_name="tlc_datax",
+                # a worker cannot tell from its own manifest whether the other workers have loaded anything
+                drop_existing=worker is None and not manifest.any_loaded(),
+                partitioned=partitioned,
+            ),
+            depends_on=["ready"],
+        )
+        if aggregate:
+            provisioner.add(
+                "summary_tables",
+                lambda: dbmanager.create_summary_tables(
+                    server_name="tlc-data-serverx",
+                    database_name="tlc-data-dbx",
+                    table_name="tlc_datax",
+                ),
+                depends_on=["ready"],
+            )
+    provisioner.run()
+
+    if parquet:
+        from exporter.parquet_exporter import ParquetExporter
+
+        exporter = ParquetExporter()
+
+    normalizer = Normalizer()
+    # the rows left out of the months are kept for inspection in a directory of the spool which it never evicts from
+    rejected_dir = os.path.join(spool.directory, "rejected")
+
+    def rejected_path(file_name: str) -> str:
+        os.makedirs(rejected_dir, exist_ok=True)
+        return os.path.join(
+            rejected_dir, f"{os.path.splitext(file_name)[0]}.rejected.csv"
+        )
+
+    # a month is loaded from its local copy when it is inserted from this machine, and a sharded month is split
+    # again for the names of its shards; otherwise it is loaded from the storage
+    load_reads_file = uses_database and (direct_load or shards > 1)
+
+    def needs_file(url: str) -> bool:
+        # whether any of the stages after the download still has to read the local copy of the month; when the
+        # months are only downloaded, the local copy is what the run is for
+        if only_download:
+            return True
+        return (
+            (uses_storage and not manifest.is_done(url, "upload"))
+            or (load_reads_file and not manifest.is_done(url, "load"))
+            or (aggregate and not manifest.is_done(url, "aggregate"))
+            or (parquet and not manifest.is_done(url, "parquet"))
+        )
+
+    def download(url: str) -> str:
+        row = manifest.get(url)
+        file_name = row["file_name"]
+        if not needs_file(url):
+            return url
+        if manifest.is_done(url, "download") and spool.acquire(file_name):
+            return url
+        # wait for space in the spool; twice the size of the source is reserved, as the normalizer and the validator
+        # write a second copy of the file before replacing it, and the normalizer one chunk more while it merges
+        path = spool.reserve(
+            file_name, 2 * (row["content_length"] or 0) + normalizer.chunk_size
+        )
+        if segments > 1 and (row["content_length"] or 0) > segment_threshold:
+            # a large month is fetched as several ranges at once; for the smaller ones the extra requests do not pay off
+            result = collector.extract_data_segmented(url, path, segments)
+        else:
+            # the hash and the number of rows are computed while the file is written
+            result = collector.extract_data(url, path)
+        checksum, rows = result.md5, result.rows
+        # map the layouts of the older files to the layout of the table; the other kinds of trips are kept as published
+        normalized = None
+        if trip_type == "yellow":
+            normalized = normalizer.normalize(path)
+        if normalized is not None:
+            rows = normalized
+        if validate:
+            from validator.validator import Validator
+
+            # drop the rows which do not fit the table before they are uploaded
+            stem = os.path.splitext(file_name)[0]
+            validation = Validator().validate(
+                path, spool.path(f"{stem}.clean.csv"), rejected_path(file_name)
+            )
+            os.replace(spool.path(f"{stem}.clean.csv"), path)
+            rows = validation.rows - validation.bad_rows
+        if normalized is not None or validate:
+            # the file has been rewritten, so its hash has to be computed again
+            checksum = file_checksum(path)
+        spool.commit(file_name)
+        manifest.mark(
+            url,
+            "download",
+            checksum=checksum,
+            local_size=os.path.getsize(path),
+            rows=rows,
+        )
+        return url
+
+    def export(url: str) -> str:
+        # keep a typed, compressed copy of the month next to the csv files for the other consumers
+        if not manifest.is_done(url, "parquet"):
+            file_name = manifest.get(url)["file_name"]
+            if fmanager is None:
+                # the Parquet files are what the run is for, so they are kept in their partitions
+                exporter.export(spool.path(file_name))
+            else:
+                # the Parquet file only waits in the spool for its upload; a month takes far less space in it than as csv
+                parquet_name = f"{os.path.splitext(file_name)[0]}.parquet"
+                spool.reserve(parquet_name, os.path.getsize(spool.path(file_name)))
+                try:
+                    exporter.export(
+                        spool.path(file_name),
+                        fmanager=fmanager,
+                        container_name="tlc-datax",
+                        output_file=spool.path(parquet_name),
+                    )
+                finally:
+                    spool.release(parquet_name)
+            manifest.mark(url, "parquet")
+        return url
+
+    if aggregate:
+        from aggregator.aggregator import Aggregator, to_rows
+
+        aggregator = Aggregator()
+
+    def summarize(url: str) -> str:
+        # only the summaries of this month are replaced, the other months are never recomputed
+        if not manifest.is_done(url, "aggregate"):
+            file_name = manifest.get(url)["file_name"]
+            for table_name, frame in zip(
+                ("tlc_datax_hourly", "tlc_datax_monthly"),
+                aggregator.aggregate(spool.path(file_name)),
+            ):
+                dbmanager.replace_month(
+                    server_name="tlc-data-serverx",
+                    database_name="tlc-data-dbx",
+                    table_name=table_name,
+                    month=Aggregator.month_of(file_name),
+                    columns=list(frame.columns),
+                    rows=to_rows(frame),
+                )
+            manifest.mark(url, "aggregate")
+        return url
+
+    shard_files = {}
+
+    def split(url: str) -> None:
+        # split the month at row boundaries so that the shards can be loaded in parallel; the split is deterministic,
+        # so a month uploaded by an earlier run gives the same shards
+        file_name = manifest.get(url)["file_name"]
+        scratch = f"{os.path.splitext(file_name)[0]}.shards"
+        spool.reserve(scratch, os.path.getsize(spool.path(file_name)))
+        try:
+            shard_files[url] = split_csv(spool.path(file_name), shards)
+        except Exception:
+            spool.release(scratch)
+            raise
+
+    def remove_shards(url: str) -> None:
+        for shard_name, _ in shard_files[url]:
+            os.remove(shard_name)
+        spool.release(f"{os.path.splitext(manifest.get(url)['file_name'])[0]}.shards")
+
+    def upload(url: str) -> str:
+        if not manifest.is_done(url, "upload"):
+            if shards > 1:
+                split(url)
+                try:
+                    results = fmanager.upload_files(
+                        [shard_name for shard_name, _ in shard_files[url]],
+                        "tlc-datax",
+                        overwrite=True,
+                    )
+                finally:
+                    remove_shards(url)
+                for result in results:
+                    if result.error is not None:
+                        raise RuntimeError(result.error)
+                    # every shard starts with the header, so the shards are checked one by one instead of the month
+                    blob_name = os.path.basename(result.file_name)
+                    blob_size = fmanager.get_blob_size("tlc-datax", blob_name)
+                    if blob_size != result.bytes:
+                        raise RuntimeError(
+                            f"{blob_name} has {blob_size} bytes in the storage instead of {result.bytes}"
+                        )
+                manifest.mark(url, "upload", blob_size=None)
+            else:
+                row = manifest.get(url)
+                fmanager.upload_file(
+                    "tlc-datax",
+                    spool.path(row["file_name"]),
+                    overwrite=True,
+                    blob_name=row["file_name"],
+                    content_md5=row["checksum"],
+                )
+                manifest.mark(
+                    url,
+                    "upload",
+                    blob_size=fmanager.get_blob_size("tlc-datax", row["file_name"]),
+                )
+        return url
+
+    def stream_upload(url: str) -> str:
+        # stream the month straight into the storage without saving it locally
+        if not manifest.is_done(url, "upload"):
+            file_name = manifest.get(url)["file_name"]
+            digest = ContentDigest()
+            fmanager.upload_stream(
+                "tlc-datax",
+                file_name,
+                table_layout(url, collector.stream_data(url, digest=digest)),
+            )
+            manifest.mark(
+                url,
+                "upload",
+                checksum=digest.md5,
+                rows=digest.rows,
+                blob_size=fmanager.get_blob_size("tlc-datax", file_name),
+            )
+        return url
+
+    def load(url: str) -> str:
+        if manifest.is_done(url, "load"):
+            return url
+        if worker is not None:
+            # make sure the month has not been taken over by another worker before it is loaded
+            worker.fence(url)
+        file_name = manifest.get(url)["file_name"]
+        if uses_storage and not manifest.is_done(url, "upload"):
+            raise RuntimeError(f"{file_name} has not been uploaded yet")
+        # a partitioned table is never loaded directly: the month goes into its own staging table and is switched in
+        table_name = "tlc_datax"
+        if partitioned:
+            table_name = dbmanager.prepare_month(
+                server_name="tlc-data-serverx",
+                database_name="tlc-data-dbx",
+                table_name="tlc_datax",
+                month=month_of[url],
+            )
+        # only a direct insert leaves rows out; any other load clears the count of an earlier one
+        fields = {"rejected_rows": None}
+        if direct_load:
+            # the month is sent from this machine in batches of parameters; a stream goes from the source straight
+            # into the table without touching the disk. The rows which do not fit the table are kept next to the
+            # ones rejected by the validator
+            rejected_file = rejected_path(file_name)
+            if stream:
+                digest = ContentDigest()
+                loaded_rows, rejected_rows = dbmanager.insert_csv(
+                    server_name="tlc-data-serverx",
+                    database_name="tlc-data-dbx",
+                    table_name=table_name,
+                    chunks=table_layout(url, collector.stream_data(url, digest=digest)),
+                    rejected_file=rejected_file,
+                )
+                fields.update(checksum=digest.md5, rows=digest.rows)
+            else:
+                loaded_rows, rejected_rows = dbmanager.insert_csv(
+                    server_name="tlc-data-serverx",
+                    database_name="tlc-data-dbx",
+                    table_name=table_name,
+                    file_name=spool.path(file_name),
+                    # the validator has already taken them out and saved them
+                    rejected_file=None if validate else rejected_file,
+                )
+            fields["rejected_rows"] = rejected_rows
+        elif shards > 1 and not stream:
+            if url not in shard_files:
+                # uploaded by an earlier run; only the names and the row counts of the shards are needed
+                split(url)
+                remove_shards(url)
+            month_shards = [
+                (os.path.basename(shard_name), rows)
+                for shard_name, rows in shard_files[url]
+            ]
+            # every shard is committed on its own, so after a partial failure the shards already in the heap are
+            # skipped instead of being loaded twice; a staging table starts empty, so all of its shards are loaded
+            loaded = (
+                {}
+                if partitioned
+                else {row["shard"]: row for row in manifest.loaded_shards(url)}
+            )
+            if any(row["shards"] != len(month_shards) for row in loaded.values()):
+                raise RuntimeError(
+                    f"{file_name} has been partly loaded in a different number of shards"
+                )
+            results = dbmanager.load_shards_to_db(
+                server_name="tlc-data-serverx",
+                database_name="tlc-data-dbx",
+                table_name=table_name,
+                shards=[shard for shard in month_shards if shard[0] not in loaded],
+                max_workers=shards,
+            )
+            if not partitioned:
+                for result in results:
+                    if result.error is None:
+                        manifest.mark_shard(
+                            url, result.file_name, len(month_shards), result.loaded_rows
+                        )
+            for result in results:
+                if result.error is not None:
+                    raise RuntimeError(result.error)
+            counts = [row["loaded_rows"] for row in loaded.values()] + [
+                result.loaded_rows for result in results
+            ]
+            loaded_rows = None if None in counts else sum(counts)
+        else:
+            loaded_rows = dbmanager.load_csv_to_db(
+                server_name="tlc-data-serverx",
+                database_name="tlc-data-dbx",
+                table_name=table_name,
+                file_name=file_name,
+                tablock=partitioned,
+            )
+        if partitioned:
+            if worker is not None:
+                worker.fence(url)
+            # the rows of the file whose pick-up is in another month are left out of the partition
+            fields["switched_rows"] = dbmanager.switch_month(
+                server_name="tlc-data-serverx",
+                database_name="tlc-data-dbx",
+                table_name="tlc_datax",
+                month=month_of[url],
+            )
+        manifest.mark(url, "load", loaded_rows=loaded_rows, **fields)
+        return url
 
     # get the data and load it to the container and transfer it the database
-    for url in tqdm(urls[1:2]):
-        file_name = url.split("_")[-1]
-        collector.extract_data(url, file_name)
-        fmanager.upload_file("tlc-datax", file_name)
-        dbmanager.load_csv_to_db(
-            server_name="tlc-data-serverx",
-            database_name="tlc-data-dbx",
-            table_name="tlc_datax",
-            file_name=file_name,
+    # while one month downloads, the previous one uploads and the one before it loads
+    # only the stages asked for are run, e.g. the months are downloaded on one machine and uploaded from another
+    pipeline_stages = []
+    if stream and "upload" in stages and uses_storage:
+        pipeline_stages.append(Stage("upload", stream_upload, upload_workers))
+    if uses_files:
+        pipeline_stages.append(Stage("download", download, download_workers))
+        if parquet:
+            pipeline_stages.append(Stage("parquet", export, upload_workers))
+        if aggregate:
+            pipeline_stages.append(Stage("aggregate", summarize, load_workers))
+        if "upload" in stages and uses_storage:
+            pipeline_stages.append(Stage("upload", upload, upload_workers))
+    if uses_database:
+        pipeline_stages.append(Stage("load", load, load_workers))
+
+    def finished(result) -> None:
+        # the local copy of a month is no longer needed once the month has left the pipeline, whether it failed or not
+        if uses_files:
+            spool.release(manifest.get(result.item)["file_name"])
+        if worker is not None:
+            worker.finish(result.item, result.error)
+        progress.update()
+
+    from tqdm import tqdm
+
+    try:
+        with tqdm(total=len(urls) if worker is None else None) as progress:
+            results = Pipeline(pipeline_stages).run(
+                urls if worker is None else worker.items(), callback=finished
+            )
+    finally:
+        if worker is not None:
+            worker.stop()
+    if worker is not None:
+        print(worker.store.summary())
+    for result in results:
+        if result.error is not None:
+            manifest.mark(result.item, result.failed_stage, "failed", result.error)
+        durations = ", ".join(f"{k}: {v:.1f}s" for k, v in result.durations.items())
+        file_name = manifest.get(result.item)["file_name"]
+        print(f"{file_name}: {result.error or 'ok'} ({durations})")
+
+    if dbmanager is not None:
+        dbmanager.close()
+    print(manifest.summary())
+
+    # flag the months whose sizes or row counts disagree between the source, the storage and the database
+    mismatches = manifest.reconcile()
+    for mismatch in mismatches:
+        print(f"{mismatch['file_name']}: {'; '.join(mismatch['problems'])}")
+    print(f"Reconciliation: {len(mismatches)} month(s) disagree")
+    for dropped in manifest.dropped_rows():
+        if dropped["rows"]:
+            print(
+                f"{dropped['file_name']}: {dropped['rows']} rows with a pick-up in another month left out of the table"
+            )
+        if dropped["rejected_rows"]:
+            print(
+                f"{dropped['file_name']}: {dropped['rejected_rows']} rows which do not fit the table left out, see {rejected_path(dropped['file_name'])}"
+            )
+
+    # how often every endpoint had to be retried and how far its concurrency limit settled
+    for name, stats in endpoint_stats().items():
+        print(
+            f"{name}: {stats['calls']} calls, {stats['retries']} retries, {stats['throttles']} throttled, {stats['failures']} failed, latency {stats['latency_avg']:.1f}s avg / {stats['latency_max']:.1f}s max, limit {stats['limit']}"
         )
 
+    # the spans of this run for tracing it, and the totals for a Prometheus textfile collector
+    metrics = get_metrics()
+    written = metrics.export_jsonl(metrics_path)
+    metrics.export_prometheus(prometheus_path)
+    print(f"{written} spans written to {metrics_path}, totals to {prometheus_path}")
     end_time = datetime.now()
     print("Duration: {}".format(end_time - start_time))
 
@@ -0,0 +1,247 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+from benchmark.fakes import FakeBlobServiceClient, SQLiteSink, serve
+from benchmark.synthetic import generate_csv
+from collector.collector import Collector
+from database_manager.database_manager import Database
+from database_manager.schema import TLC_COLUMNS
+from file_manager.file_manager import FileManager
+
+
+def _stage(name: str, runs: List[Dict[str, float]]) -> Dict[str, float]:
+    # the totals of a stage over all the files; the rates are computed from the time spent in the stage
+    seconds = sum(run["seconds"] for run in runs)
+    total_bytes = sum(run["bytes"] for run in runs)
+    rows = sum(run["rows"] for run in runs)
+    return {
+        "stage": name,
+        "files": len(runs),
+        "bytes": total_bytes,
+        "rows": rows,
+        "seconds": seconds,
+        "mb_per_second": total_bytes / 1e6 / seconds if seconds else 0.0,
+        "rows_per_second": rows / seconds if seconds else 0.0,
+        "runs": runs,
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def run_benchmark(
+    files: int = 2,
+    rows: int = 200_000,
+    seed: int = 0,
+    work_dir: str = None,
+    batch_size: int = 10_000,
+) -> dict:
+    """
+    Runs Collector.extract_data, FileManager.upload_file, Database.load_csv_to_db and Database.insert_csv over synthetic files, against a local HTTP server, a fake blob store and a SQLite sink instead of S3, Azure Storage and SQL Server, and measures every stage. Nothing leaves the machine, so two runs on the same machine with the same arguments can be compared to spot a regression.
+
+    :param files int: the number of monthly files.
+    :param rows int: the number of rows in every file.
+    :param seed int: the seed of the synthetic data.
+    :param work_dir str: the directory to work in. A temporary directory, removed at the end, if None.
+    :param batch_size int: the number of rows sent in a single round trip by Database.insert_csv.
+    :returns: the parameters of the run and, for every stage, the bytes, rows, seconds, MB/s and rows/s in total and per file
+    :rtype: dict
+    """
+    temporary = None
+    if work_dir is None:
+        temporary = tempfile.TemporaryDirectory()
+        work_dir = temporary.name
+    source_dir, download_dir, blob_dir = (
+        os.path.join(work_dir, name) for name in ("source", "downloads", "blobs")
+    )
+    for directory in (source_dir, download_dir):
+        os.makedirs(directory, exist_ok=True)
+    # Database.connection builds a connection string from the administrator login, which the sink ignores
+    os.environ.setdefault("ADMINISTRATOR_LOGIN", "benchmark")
+    os.environ.setdefault("ADMINISTRATOR_LOGIN_PASSWORD", "benchmark")
+
+    server = serve(source_dir)
+    try:
+        names = [f"2021-{month:02d}.csv" for month in range(1, files + 1)]
+        for index, name in enumerate(names):
+            generate_csv(
+                os.path.join(source_dir, f"yellow_tripdata_{name}"), rows, seed + index
+            )
+
+        collector = Collector()
+        fmanager = FileManager(blob_service_client=FakeBlobServiceClient(blob_dir))
+        fmanager.create_container("benchmark")
+        sink = SQLiteSink(
+            os.path.join(work_dir, "sink.db"), os.path.join(blob_dir, "benchmark")
+        )
+        sink.create_table("tlc_data", TLC_COLUMNS)
+        sink.create_table("tlc_data_insert", TLC_COLUMNS)
+        dbmanager = Database("", "", "", "", connection_factory=sink.connect)
+
+        downloads, uploads, loads, inserts = [], [], [], []
+        for name in names:
+            path = os.path.join(download_dir, name)
+            result = collector.extract_data(
+                f"http://127.0.0.1:{server.server_port}/yellow_tripdata_{name}", path
+            )
+            downloads.append(
+                {
+                    "file": name,
+                    "bytes": result.bytes,
+                    "rows": result.rows,
+                    "seconds": result.duration,
+                }
+            )
+
+            start = time.perf_counter()
+            fmanager.upload_file(
+                "benchmark",
+                path,
+                overwrite=True,
+                blob_name=name,
+                content_md5=result.md5,
+            )
+            uploads.append(
+                {
+                    "file": name,
+                    "bytes": result.bytes,
+                    "rows": result.rows,
+                    "seconds": time.perf_counter() - start,
+                }
+            )
+
+            start = time.perf_counter()
+            loaded = dbmanager.load_csv_to_db(
+                server_name="benchmark",
+                database_name="benchmark",
+                table_name="tlc_data",
+                file_name=name,
+            )
+            loads.append(
+                {
+                    "file": name,
+                    "bytes": result.bytes,
+                    "rows": loaded,
+                    "seconds": time.perf_counter() - start,
+                }
+            )
+
+            # the same file sent from the local disk in batches of parameters, without the storage
+            start = time.perf_counter()
+            inserted, _ = dbmanager.insert_csv(
+                server_name="benchmark",
+                database_name="benchmark",
+                table_name="tlc_data_insert",
+                file_name=path,
+                batch_size=batch_size,
+            )
+            inserts.append(
+                {
+                    "file": name,
+                    "bytes": result.bytes,
+                    "rows": inserted,
+                    "seconds": time.perf_counter() - start,
+                }
+            )
+        dbmanager.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+        if temporary is not None:
+            temporary.cleanup()
+
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "files": files,
+        "rows": rows,
+        "seed": seed,
+        "batch_size": batch_size,
+        "stages": [
+            _stage("download", downloads),
+            _stage("upload", uploads),
+            _stage("load", loads),
+            _stage("insert", inserts),
+        ],
+    }
+
+
+def compare(results: dict, baseline: dict) -> Dict[str, float]:
+    """
+    Compares the throughput of every stage with an earlier run.
+
+    :param results dict: the results of this run, as returned by run_benchmark.
+    :param baseline dict: the results of the earlier run.
+    :returns: the change of the MB/s of every stage in percent; negative is slower
+    :rtype: Dict[str, float]
+    """
+    before = {stage["stage"]: stage["mb_per_second"] for stage in baseline["stages"]}
+    return {
+        stage["stage"]: (stage["mb_per_second"] / before[stage["stage"]] - 1) * 100
+        for stage in results["stages"]
+        if before.get(stage["stage"])
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the download, upload and load stages against local stand-ins of S3, Azure Storage and SQL Server."
+    )
+    parser.add_argument("--files", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10_000,
+        help="the rows per round trip of the insert stage (default: 10000)",
+    )
+    parser.add_argument("--work-dir", help="keep the files in this directory")
+    parser.add_argument(
+        "--output",
+        default="benchmark_results.json",
+        help="the file to write the results to (default: benchmark_results.json)",
+    )
+    parser.add_argument(
+        "--baseline", help="the results of an earlier run to compare with"
+    )
+    args = parser.parse_args()
+
+    results = run_benchmark(
+        args.files, args.rows, args.seed, args.work_dir, args.batch_size
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    print(f"\n{'stage':<10}{'MB/s':>10}{'rows/s':>14}{'seconds':>10}")
+    for stage in results["stages"]:
+        print(
+            f"{stage['stage']:<10}{stage['mb_per_second']:>10.1f}{stage['rows_per_second']:>14.0f}{stage['seconds']:>10.2f}"
+        )
+    if args.baseline:
+        with open(args.baseline) as f:
+            for stage, change in compare(results, json.load(f)).items():
+                print(f"{stage}: {change:+.1f}% MB/s against {args.baseline}")
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+import csv
+import os
+import re
+import sqlite3
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from typing import Iterable, List
+
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the files of a directory like S3 does for the TLC files: with an ETag and an Accept-Ranges header, and the 206 responses to the range requests of Collector.extract_data_segmented.
+    """
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        found = re.match(r"bytes=(\d+)-(\d*)$", self.headers.get("Range", ""))
+        if found:
+            start = int(found.group(1))
+            end = min(int(found.group(2) or end), size - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        stat = os.stat(path)
+        self.send_header("Content-Type", "text/csv")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", f'"{stat.st_size:x}-{int(stat.st_mtime):x}"')
+        self.end_headers()
+        f = open(path, "rb")
+        f.seek(start)
+        self.remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile) -> None:
+        while self.remaining > 0:
+            chunk = source.read(min(self.remaining, 1024 * 1024))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            self.remaining -= len(chunk)
+
+
+def serve(directory: str, port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serves the directory over HTTP on localhost from a background thread, as a stand-in for the S3 bucket of the TLC files.
+
+    :param directory str: the directory to serve.
+    :param port int: the port to listen on. A free port is picked if 0.
+    :returns: the running server; its url is f"http://127.0.0.1:{server.server_port}/"
+    :rtype: ThreadingHTTPServer
+    """
+
+    class Handler(RangeRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=directory, **kwargs)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class FakeBlobClient:
+    def __init__(self, root: str, container_name: str, blob_name: str) -> None:
+        """
+        A stand-in of azure.storage.blob.BlobClient which keeps the blob as a file under root, with the methods used by FileManager.
+        """
+        self.path = os.path.join(root, container_name, blob_name)
+        self.url = f"http://fake-blob/{container_name}/{blob_name}"
+        self.__blocks = {}
+        self.__lock = threading.Lock()
+        self.__content_md5 = None
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def _store(
+        self, chunks: Iterable[bytes], overwrite: bool, content_settings
+    ) -> None:
+        if not overwrite and self.exists():
+            raise ResourceExistsError(f"The blob {self.path} already exists.")
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(f"{self.path}.tmp", "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(f"{self.path}.tmp", self.path)
+        self.__content_md5 = getattr(content_settings, "content_md5", None)
+
+    def upload_blob(
+        self, data, overwrite: bool = False, content_settings=None, **kwargs
+    ) -> None:
+        if isinstance(data, bytes):
+            chunks = [data]
+        else:
+            chunks = iter(lambda: data.read(4 * 1024 * 1024), b"")
+        self._store(chunks, overwrite, content_settings)
+
+    def stage_block(
+        self, block_id: str, data: bytes, length: int = None, **kwargs
+    ) -> None:
+        with self.__lock:
+            self.__blocks[block_id] = bytes(data)
+
+    def commit_block_list(self, block_list: List, content_settings=None) -> None:
+        with self.__lock:
+            blocks = [self.__blocks.pop(block.id) for block in block_list]
+        self._store(blocks, True, content_settings)
+
+    def get_blob_properties(self) -> SimpleNamespace:
+        if not self.exists():
+            raise ResourceNotFoundError(f"The blob {self.path} does not exist.")
+        return SimpleNamespace(
+            size=os.path.getsize(self.path),
+            content_settings=SimpleNamespace(content_md5=self.__content_md5),
+        )
+
+
+class FakeContainerClient:
+    def __init__(self, root: str, container_name: str) -> None:
+        """
+        A stand-in of azure.storage.blob.ContainerClient, see FakeBlobServiceClient.
+        """
+        self.root = root
+        self.container_name = container_name
+        self.__blobs = {}
+        self.__lock = threading.Lock()
+
+    def create_container(self) -> None:
+        path = os.path.join(self.root, self.container_name)
+        if os.path.isdir(path):
+            raise ResourceExistsError(
+                f"The container {self.container_name} already exists."
+            )
+        os.makedirs(path)
+
+    def get_blob_client(self, blob_name: str) -> FakeBlobClient:
+        # the same client is returned for the same blob, so the staged blocks are kept until they are committed
+        with self.__lock:
+            if blob_name not in self.__blobs:
+                self.__blobs[blob_name] = FakeBlobClient(
+                    self.root, self.container_name, blob_name
+                )
+            return self.__blobs[blob_name]
+
+
+class FakeBlobServiceClient:
+    def __init__(self, root: str) -> None:
+        """
+        A stand-in of azure.storage.blob.BlobServiceClient which keeps the blobs as files under root (root/<container>/<blob>), to be passed to FileManager(blob_service_client=...). It goes as fast as the local disk, so the upload stage measures the overhead of the code rather than the network.
+
+        :param root str: the directory to keep the blobs in.
+        """
+        self.root = root
+        self.__containers = {}
+        self.__lock = threading.Lock()
+
+    def get_container_client(self, container_name: str) -> FakeContainerClient:
+        with self.__lock:
+            if container_name not in self.__containers:
+                self.__containers[container_name] = FakeContainerClient(
+                    self.root, container_name
+                )
+            return self.__containers[container_name]
+
+
+class SQLiteSinkCursor:
+    def __init__(self, sink: "SQLiteSink", conn: sqlite3.Connection) -> None:
+        self.sink = sink
+        self.conn = conn
+        self.rowcount = -1
+        self.fast_executemany = False
+        self.__cursor = conn.cursor()
+
+    def execute(self, query: str, *parameters):
+        found = re.search(
+            r"BULK INSERT \[dbo\]\.\[(\w+)\]\s+FROM '([^']+)'(.*)", query, re.S
+        )
+        if found is None:
+            self.__cursor.execute(query, *parameters)
+            self.rowcount = self.__cursor.rowcount
+            return self
+        table_name, blob_name, options = found.groups()
+        first_row = re.search(r"FIRSTROW\s*=\s*(\d+)", options)
+        skip = int(first_row.group(1)) - 1 if first_row else 0
+        self.rowcount = 0
+        with open(os.path.join(self.sink.blob_directory, blob_name), newline="") as f:
+            rows = csv.reader(f)
+            for _ in range(skip):
+                next(rows, None)
+            batch = []
+            for row in rows:
+                batch.append(row)
+                if len(batch) == 10_000:
+                    self.rowcount += self._insert(table_name, batch)
+                    batch = []
+            self.rowcount += self._insert(table_name, batch)
+        return self
+
+    def _insert(self, table_name: str, rows: List[list]) -> int:
+        if rows:
+            self.__cursor.executemany(
+                f"INSERT INTO [{table_name}] VALUES ({', '.join('?' * len(rows[0]))})",
+                rows,
+            )
+        return len(rows)
+
+    def executemany(self, query: str, rows) -> None:
+        self.__cursor.executemany(query, rows)
+        self.rowcount = self.__cursor.rowcount
+
+    def fetchone(self):
+        return self.__cursor.fetchone()
+
+    def fetchall(self):
+        return self.__cursor.fetchall()
+
+    def close(self) -> None:
+        self.__cursor.close()
+
+
+class SQLiteSinkConnection:
+    def __init__(self, sink: "SQLiteSink") -> None:
+        self.sink = sink
+        self.__conn = sqlite3.connect(sink.path, timeout=60, check_same_thread=False)
+
+    def cursor(self) -> SQLiteSinkCursor:
+        return SQLiteSinkCursor(self.sink, self.__conn)
+
+    def commit(self) -> None:
+        self.__conn.commit()
+
+    def rollback(self) -> None:
+        self.__conn.rollback()
+
+    def close(self) -> None:
+        self.__conn.close()
+
+
+class SQLiteSink:
+    def __init__(self, path: str, blob_directory: str) -> None:
+        """
+        A local stand-in of the database: a SQLite file whose DB-API connections understand the BULK INSERT of Database.load_csv_to_db by reading the blob from the directory of a FakeBlobServiceClient container. Its connect method is passed to Database(connection_factory=...). SQLite writes one transaction at a time, so the load stage measures the path through the code and a local insert rather than SQL Server.
+
+        :param path str: the SQLite file.
+        :param blob_directory str: the directory of the container the blobs are loaded from.
+        """
+        self.path = path
+        self.blob_directory = blob_directory
+
+    def create_table(self, table_name: str, columns: List[str]) -> None:
+        """
+        Creates the table, replacing it if it exists.
+
+        :param table_name str: the name of the table.
+        :param columns List[str]: the names of the columns.
+        :returns: None
+        :rtype: NoneType
+        """
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(f"DROP TABLE IF EXISTS [{table_name}]")
+            conn.execute(
+                f"CREATE TABLE [{table_name}] ({', '.join(f'[{c}]' for c in columns)})"
+            )
+
+    def connect(self, connection_string: str = "") -> SQLiteSinkConnection:
+        """
+        Opens a connection to the SQLite file. The connection string is ignored.
+
+        :param connection_string str: the ODBC connection string built by Database.connection.
+        :returns: the connection
+        :rtype: SQLiteSinkConnection
+        """
+        return SQLiteSinkConnection(self)
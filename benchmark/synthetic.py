@@ -0,0 +1,51 @@
+import csv
+import random
+from datetime import datetime, timedelta
+
+from database_manager.schema import DATETIME_FORMAT, TLC_COLUMNS
+
+
+def generate_csv(file_name: str, rows: int = 100_000, seed: int = 0) -> int:
+    """
+    Writes a csv file with the columns of the yellow taxi files and random but plausible values, so the benchmarks can be run without the real files. The same seed always gives the same file.
+
+    :param file_name str: the csv file to write.
+    :param rows int: the number of data rows.
+    :param seed int: the seed of the random values.
+    :returns: the size of the file in bytes
+    :rtype: int
+    """
+    rng = random.Random(seed)
+    start = datetime(2021, 7, 1)
+    with open(file_name, "w", newline="") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(TLC_COLUMNS)
+        for _ in range(rows):
+            pickup = start + timedelta(seconds=rng.randrange(31 * 24 * 3600))
+            dropoff = pickup + timedelta(seconds=rng.randrange(60, 3600))
+            distance = round(rng.expovariate(1 / 3), 2)
+            fare = round(2.5 + distance * 2.5, 2)
+            tip = round(fare * rng.choice((0, 0, 0.15, 0.2, 0.25)), 2)
+            writer.writerow(
+                [
+                    rng.choice((1, 2)),
+                    pickup.strftime(DATETIME_FORMAT),
+                    dropoff.strftime(DATETIME_FORMAT),
+                    rng.choice((1, 1, 1, 2, 3, 5)),
+                    distance,
+                    1,
+                    rng.choice(("N", "N", "N", "Y")),
+                    rng.randrange(1, 266),
+                    rng.randrange(1, 266),
+                    rng.choice((1, 2)),
+                    fare,
+                    0.5,
+                    0.5,
+                    tip,
+                    0,
+                    0.3,
+                    round(fare + tip + 3.8, 2),
+                    2.5,
+                ]
+            )
+        return f.tell()
@@ -0,0 +1,244 @@
+import argparse
+import json
+from dataclasses import asdict
+from typing import List
+
+# the Azure SDKs, the ODBC driver, pandas and pyarrow are only imported by the commands which use them, so that
+# e.g. `python cli.py plan` starts quickly and does not need them installed
+from collector.collector import TRIP_TYPES, Collector
+
+
+def add_month_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Adds the arguments which pick the months: the years, the months of every year and the kind of trips.
+
+    :param parser argparse.ArgumentParser: the parser of a command.
+    :returns: None
+    :rtype: NoneType
+    """
+    parser.add_argument(
+        "--year",
+        type=int,
+        nargs="+",
+        default=[2021],
+        metavar="YEAR",
+        help="a year, or the first and the last year (default: 2021)",
+    )
+    parser.add_argument(
+        "--month",
+        type=int,
+        nargs="+",
+        default=list(range(1, 13)),
+        choices=range(1, 13),
+        metavar="MONTH",
+        help="the months of every year, 1 to 12 (default: all of them)",
+    )
+    parser.add_argument("--trip-type", choices=TRIP_TYPES, default="yellow")
+
+
+def month_arguments(args: argparse.Namespace) -> dict:
+    """
+    Converts the arguments added by add_month_arguments into the keyword arguments of app.main.
+
+    :param args argparse.Namespace: the parsed arguments.
+    :returns: start_year, end_year, months and trip_type
+    :rtype: dict
+    """
+    if len(args.year) > 2:
+        raise SystemExit("--year takes a year, or the first and the last year")
+    return {
+        "start_year": args.year[0],
+        "end_year": args.year[-1],
+        "months": sorted(set(args.month)),
+        "trip_type": args.trip_type,
+    }
+
+
+def plan(args: argparse.Namespace) -> None:
+    selection = month_arguments(args)
+    collector = Collector(
+        selection["start_year"], selection["end_year"], base_url=args.source_url
+    )
+    catalog = collector.discover(
+        collector.generate_urls(selection["trip_type"], selection["months"]),
+        max_workers=args.probes,
+    )
+    entries = {entry.url: entry for entry in catalog}
+    print(f"{'month':<10}{'trips':<8}{'size':>12}  last modified")
+    for url in Collector.plan(catalog):
+        entry = entries[url]
+        size = "?" if entry.size is None else f"{entry.size / 1e6:.1f} MB"
+        print(
+            f"{entry.month:<10}{entry.trip_type:<8}{size:>12}  {entry.last_modified or ''}"
+        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                [asdict(entries[url]) for url in Collector.plan(catalog)], f, indent=2
+            )
+        print(f"Catalog written to {args.output}")
+
+
+def run_stages(args: argparse.Namespace, stages: List[str], **options) -> None:
+    import app
+
+    # refuse the combinations which cannot be honoured before anything is downloaded
+    used = {
+        option: options.get(option, False)
+        for option in ("validate", "parquet", "aggregate")
+    }
+    try:
+        app.check_trip_type(args.trip_type, stages, **used)
+        app.check_stream(options.get("stream", False), options.get("shards", 1), **used)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    app.main(
+        manifest_path=args.manifest,
+        spool_dir=args.spool_dir,
+        stages=stages,
+        source_url=args.source_url,
+        **month_arguments(args),
+        **options,
+    )
+
+
+def download(args: argparse.Namespace) -> None:
+    run_stages(
+        args,
+        ["download"],
+        download_workers=args.download_workers,
+        segments=args.segments,
+    )
+
+
+def upload(args: argparse.Namespace) -> None:
+    # the months downloaded by an earlier run are taken from the spool; the others are downloaded first
+    run_stages(
+        args,
+        ["download", "upload"],
+        download_workers=args.download_workers,
+        segments=args.segments,
+        upload_workers=args.upload_workers,
+        shards=args.shards,
+    )
+
+
+def load(args: argparse.Namespace) -> None:
+    run_stages(
+        args,
+        ["load"],
+        load_workers=args.load_workers,
+        shards=args.shards,
+        partitioned=args.partitioned,
+        direct_load=args.direct,
+    )
+
+
+def run(args: argparse.Namespace) -> None:
+    run_stages(
+        args,
+        ["download", "upload", "load"],
+        stream=args.stream,
+        download_workers=args.download_workers,
+        segments=args.segments,
+        upload_workers=args.upload_workers,
+        load_workers=args.load_workers,
+        shards=args.shards,
+        validate=args.validate,
+        parquet=args.parquet,
+        aggregate=args.aggregate,
+        keep_files=args.keep_files,
+        partitioned=args.partitioned,
+        direct_load=args.direct,
+    )
+
+
+def main(argv: List[str] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Downloads the monthly TLC trip files, uploads them to Azure Storage and loads them into Azure SQL."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name: str, function, help: str) -> argparse.ArgumentParser:
+        subparser = commands.add_parser(name, help=help)
+        subparser.set_defaults(function=function)
+        add_month_arguments(subparser)
+        subparser.add_argument(
+            "--source-url",
+            default="https://s3.amazonaws.com/nyc-tlc/trip+data/",
+            help="where the monthly files are published, e.g. a local mirror",
+        )
+        if name != "plan":
+            subparser.add_argument("--manifest", default="manifest.db")
+            subparser.add_argument("--spool-dir", default="downloads")
+        return subparser
+
+    subparser = command(
+        "plan",
+        plan,
+        "list the months which exist, largest first, without downloading them",
+    )
+    subparser.add_argument(
+        "--probes", type=int, default=8, help="the number of HEAD requests at once"
+    )
+    subparser.add_argument("--output", help="write the catalog to this JSON file")
+
+    subparser = command("download", download, "download the months into the spool")
+    subparser.add_argument("--download-workers", type=int, default=2)
+    subparser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="download the months larger than 256 MB as this many ranges at once",
+    )
+
+    subparser = command("upload", upload, "upload the months to the storage")
+    subparser.add_argument("--download-workers", type=int, default=2)
+    subparser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="download the months larger than 256 MB as this many ranges at once",
+    )
+    subparser.add_argument("--upload-workers", type=int, default=2)
+    subparser.add_argument("--shards", type=int, default=1)
+
+    subparser = command("load", load, "load the uploaded months into the database")
+    subparser.add_argument("--load-workers", type=int, default=1)
+    subparser.add_argument("--shards", type=int, default=1)
+    subparser.add_argument("--partitioned", action="store_true")
+    subparser.add_argument(
+        "--direct",
+        action="store_true",
+        help="insert the months from this machine instead of through the storage",
+    )
+
+    subparser = command("run", run, "download, upload and load the months")
+    subparser.add_argument("--download-workers", type=int, default=2)
+    subparser.add_argument(
+        "--segments",
+        type=int,
+        default=1,
+        help="download the months larger than 256 MB as this many ranges at once",
+    )
+    subparser.add_argument("--upload-workers", type=int, default=2)
+    subparser.add_argument("--load-workers", type=int, default=1)
+    subparser.add_argument("--shards", type=int, default=1)
+    subparser.add_argument("--stream", action="store_true")
+    subparser.add_argument("--validate", action="store_true")
+    subparser.add_argument("--parquet", action="store_true")
+    subparser.add_argument("--aggregate", action="store_true")
+    subparser.add_argument("--keep-files", action="store_true")
+    subparser.add_argument("--partitioned", action="store_true")
+    subparser.add_argument(
+        "--direct",
+        action="store_true",
+        help="insert the months from this machine instead of through the storage",
+    )
+
+    args = parser.parse_args(argv)
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
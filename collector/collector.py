@@ -1,59 +1,476 @@
+import hashlib
+import json
 import os
-import shutil
-from typing import List
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlparse
 
 import humanize
 import requests
+from requests.adapters import HTTPAdapter
+
+from metrics.metrics import count, span
+from retry.retry import endpoint
+
+
+@dataclass
+class DownloadResult:
+    url: str
+    file_name: str
+    bytes: int = 0
+    duration: float = 0.0
+    error: Optional[str] = None
+    md5: Optional[str] = None
+    rows: Optional[int] = None
+
+
+@dataclass
+class CatalogEntry:
+    url: str
+    trip_type: str
+    month: str
+    size: Optional[int] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+# the kinds of trips the TLC publishes a file per month for
+TRIP_TYPES: Tuple[str, ...] = ("yellow", "green", "fhv", "fhvhv")
+
+
+class ContentDigest:
+    def __init__(self) -> None:
+        """
+        Computes the MD5 hash and counts the data rows of a csv file as its chunks go by, so that neither needs a second pass over the file. Every line break ends a row, as the TLC files do not quote their values; a last line without a line break still counts.
+        """
+        self.__md5 = hashlib.md5()
+        self.__lines = 0
+        self.__last = b"\n"
+        self.bytes = 0
+
+    def update(self, chunk: bytes) -> None:
+        """
+        Adds the next chunk of the file.
+
+        :param chunk bytes: the chunk, in order.
+        :returns: None
+        :rtype: NoneType
+        """
+        if not chunk:
+            return
+        self.__md5.update(chunk)
+        self.__lines += chunk.count(b"\n")
+        self.__last = chunk[-1:]
+        self.bytes += len(chunk)
+
+    @property
+    def md5(self) -> str:
+        """
+        The MD5 hash of the chunks seen so far, as a hex string.
+        """
+        return self.__md5.hexdigest()
+
+    @property
+    def rows(self) -> int:
+        """
+        The number of rows seen so far, not counting the header.
+        """
+        lines = self.__lines + (self.__last != b"\n")
+        return max(lines - 1, 0)
 
 
 class Collector:
-    def __init__(self, start_year: int = 2009, end_year: int = 2021) -> None:
+    def __init__(
+        self,
+        start_year: int = 2009,
+        end_year: int = 2021,
+        pool_size: int = 8,
+        base_url: str = "https://s3.amazonaws.com/nyc-tlc/trip+data/",
+    ) -> None:
         self.start_year = start_year
         self.end_year = end_year
+        self.base_url = base_url
+        self.session = self.create_session(pool_size)
 
-    def generate_urls(self) -> List[str]:
+    @staticmethod
+    def create_session(pool_size: int = 8) -> requests.Session:
         """
-        Generate a list of urls to collect the data from by iterating over the range of years that the Collector object has been inicialized with. If the number for the month consists in a single digit, it is appended with 0.
+        Creates a session with a pool of keep-alive connections which is shared by all the downloads of the Collector object so that consecutive and concurrent requests to the same host do not pay for a new TCP and TLS handshake each time.
 
+        :param pool_size int: the maximum number of connections kept open per host. Should be at least the number of concurrent downloads.
+        :return: session to send the requests with
+        :rtype: requests.Session
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def generate_urls(
+        self, trip_type: str = "yellow", months: Iterable[int] = range(1, 13)
+    ) -> List[str]:
+        """
+        Generate a list of urls to collect the data from by iterating over the range of years that the Collector object has been inicialized with. If the number for the month consists in a single digit, it is appended with 0. Every month of every year is generated, whether it has been published or not; discover tells which of them exist.
+
+        :param trip_type str: the kind of trips, one of TRIP_TYPES.
+        :param months Iterable[int]: the months of every year, 1 to 12.
         :return: list that contains urls for each month's data in csv format
         :rtype: List[str]
         """
+        if trip_type not in TRIP_TYPES:
+            raise ValueError(
+                f"Unknown trip type {trip_type}, expected one of {', '.join(TRIP_TYPES)}"
+            )
         urls = []
         for i in range(self.start_year, self.end_year + 1, 1):
-            base_url = (
-                f"https://s3.amazonaws.com/nyc-tlc/trip+data/yellow_tripdata_{i}-"
-            )
-            if i == 2021:
-                year_urls = [f"{base_url}0{month}.csv" for month in range(1, 8)]
-            else:
-                year_urls = [
-                    f"{base_url}0{month}.csv"
-                    if month in range(1, 10)
-                    else f"{base_url}{month}.csv"
-                    for month in range(1, 13)
-                ]
-            urls.extend(year_urls)
+            base_url = f"{self.base_url}{trip_type}_tripdata_{i}-"
+            urls.extend(f"{base_url}{month:02d}.csv" for month in months)
         return urls
 
+    @staticmethod
+    def file_name_of(url: str) -> str:
+        """
+        Returns the name the file of a month is saved and uploaded under: e.g. '2021-07.csv' for the yellow taxis and 'green_2021-07.csv' for the other kinds of trips, so that the months of different kinds do not overwrite each other.
+
+        :param url str: the url of the month.
+        :return: the name of the file
+        :rtype: str
+        """
+        name = url.split("/")[-1]
+        trip_type, _, month = name.partition("_tripdata_")
+        if not month:
+            return url.split("_")[-1]
+        return month if trip_type == "yellow" else f"{trip_type}_{month}"
+
+    def discover(
+        self,
+        urls: List[str] = None,
+        trip_types: List[str] = ("yellow",),
+        max_workers: int = 8,
+    ) -> List[CatalogEntry]:
+        """
+        Sends a HEAD request for every candidate month at the same time to find out which files exist and how big they are, without downloading any of them. The months which have not been published (404, or 403 as S3 answers when listing is not allowed) are left out of the catalog, so they never turn into failed downloads. Throttled and transient responses are retried, see retry.Endpoint.
+
+        :param urls List[str]: the candidate urls. Every month of every trip type between start_year and end_year if None.
+        :param trip_types List[str]: the kinds of trips to generate the candidates for when urls is None.
+        :param max_workers int: the number of requests sent at the same time. Should not be more than the pool size of the session.
+        :return: the size, ETag and Last-Modified of every file which exists, in the order of the urls
+        :rtype: List[CatalogEntry]
+        """
+        if urls is None:
+            urls = [url for kind in trip_types for url in self.generate_urls(kind)]
+
+        def probe(url: str) -> Optional[CatalogEntry]:
+            def head() -> requests.Response:
+                r = self.session.head(url, allow_redirects=True)
+                if r.status_code not in (403, 404):
+                    r.raise_for_status()
+                return r
+
+            r = endpoint(urlparse(url).netloc).call(head)
+            if r.status_code in (403, 404):
+                return None
+            found = re.search(r"(\w+?)_tripdata_(\d{4}-\d{2})", url)
+            content_length = r.headers.get("Content-Length")
+            return CatalogEntry(
+                url,
+                found.group(1) if found else "",
+                found.group(2) if found else "",
+                int(content_length) if content_length else None,
+                r.headers.get("ETag"),
+                r.headers.get("Last-Modified"),
+            )
+
+        with span("discover", candidates=len(urls)):
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                catalog = [entry for entry in executor.map(probe, urls) if entry]
+        total = sum(entry.size or 0 for entry in catalog)
+        print(
+            f"{len(catalog)} of {len(urls)} months exist, {humanize.naturalsize(total)} in total"
+        )
+        return catalog
+
+    @staticmethod
+    def plan(catalog: List[CatalogEntry]) -> List[str]:
+        """
+        Orders the months of a catalog largest first. Workers taking the months in this order finish at about the same time, as the small months left at the end fill the gaps; the months of unknown size go last.
+
+        :param catalog List[CatalogEntry]: the catalog returned by discover.
+        :return: the urls of the months, largest first
+        :rtype: List[str]
+        """
+        ordered = sorted(
+            catalog,
+            key=lambda entry: -1 if entry.size is None else entry.size,
+            reverse=True,
+        )
+        return [entry.url for entry in ordered]
+
+    def get_metadata(self, url: str) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Sends a HEAD request to get the ETag and the size of the file without downloading it.
+
+        :param url str: the url of the file.
+        :return: the ETag and the Content-Length of the file
+        :rtype: Tuple[Optional[str], Optional[int]]
+        """
+        r = self.session.head(url, allow_redirects=True)
+        r.raise_for_status()
+        content_length = r.headers.get("Content-Length")
+        return r.headers.get("ETag"), int(content_length) if content_length else None
+
     def extract_data(
         self,
         url: str = "https://s3.amazonaws.com/nyc-tlc/trip+data/yellow_tripdata_2021-07.csv",
         file_name: str = "2021-07.csv",
-    ) -> None:
+        chunk_size: int = 1024 * 1024,
+    ) -> DownloadResult:
         """
-        Iterates over the generated urls to get the content of each page which are then written into a csv file.
+        Iterates over the generated urls to get the content of each page which are then written into a csv file. Transient errors and throttling (e.g. a dropped connection or a 503 SlowDown) are retried with a backoff, see retry.Endpoint.
 
-        :return: None
-        :rtype: NoneType
+        :param url str: the url to retrieve the content from.
+        :param file_name str: the name which is to be used to save the file with.
+        :param chunk_size int: the number of bytes read from the response and written to the file at a time.
+        :return: the url, the file name, the number of bytes saved, the time it took, and the MD5 hash and the number of data rows of the file, computed while it was written
+        :rtype: DownloadResult
         """
+        start = time.perf_counter()
 
-        print(f"\nSending a request for {file_name}")
-        with requests.get(url, stream=True) as r:
-            with open(file_name, "wb") as f:
-                print(f"Saving the contents as {file_name}")
-                shutil.copyfileobj(r.raw, f)
+        def download() -> ContentDigest:
+            # a dropped stream or a throttled request is retried from the start, so the file and the hash are reset
+            digest = ContentDigest()
+            print(f"\nSending a request for {file_name}")
+            with self.session.get(url, stream=True) as r:
+                r.raise_for_status()
+                with open(file_name, "wb") as f:
+                    print(f"Saving the contents as {file_name}")
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        digest.update(chunk)
+            return digest
 
+        with span("download", file=os.path.basename(file_name)):
+            digest = endpoint(urlparse(url).netloc).call(download)
         file_size = os.path.getsize(file_name)
+        count("bytes", file_size, stage="download")
+        count("rows", digest.rows, stage="download")
         print(
-            f"{file_name} has been successfully saved. File size: {humanize.naturalsize(file_size)}"
+            f"{file_name} has been successfully saved. File size: {humanize.naturalsize(file_size)}, {humanize.intcomma(digest.rows)} rows"
+        )
+        return DownloadResult(
+            url,
+            file_name,
+            file_size,
+            time.perf_counter() - start,
+            md5=digest.md5,
+            rows=digest.rows,
         )
+
+    def stream_data(
+        self,
+        url: str = "https://s3.amazonaws.com/nyc-tlc/trip+data/yellow_tripdata_2021-07.csv",
+        chunk_size: int = 4 * 1024 * 1024,
+        digest: ContentDigest = None,
+    ) -> Iterator[bytes]:
+        """
+        Streams the content of the page in chunks without writing anything to disk. Only one chunk is held in memory at a time, so the chunks can be handed straight to FileManager.upload_stream. The chunks which have been handed out cannot be taken back, so a request which is throttled or fails with a transient error is retried with a backoff (see retry.Endpoint), and a stream which breaks off is resumed with a range request for the rest of the file.
+
+        :param url str: the url to retrieve the content from.
+        :param chunk_size int: the maximum number of bytes in a single chunk.
+        :param digest ContentDigest: if given, every chunk is added to it, so the hash and the number of rows are known once the stream has been consumed.
+        :return: the chunks of the response body, in order
+        :rtype: Iterator[bytes]
+        """
+        print(f"\nStreaming {url}")
+        calls = endpoint(urlparse(url).netloc)
+        total = 0
+
+        def request(offset: int) -> requests.Response:
+            headers = {"Range": f"bytes={offset}-"} if offset else None
+            r = self.session.get(url, headers=headers, stream=True)
+            try:
+                r.raise_for_status()
+                if offset and r.status_code != 206:
+                    raise requests.HTTPError(
+                        f"Expected a partial response from byte {offset}, got {r.status_code}"
+                    )
+            except Exception:
+                r.close()
+                raise
+            return r
+
+        try:
+            breaks = 0
+            while True:
+                with calls.call(request, total) as r:
+                    try:
+                        for chunk in r.iter_content(chunk_size=chunk_size):
+                            if chunk:
+                                if digest is not None:
+                                    digest.update(chunk)
+                                total += len(chunk)
+                                yield chunk
+                        return
+                    except Exception as e:
+                        breaks += 1
+                        if calls.classifier(e) is None or breaks >= calls.attempts:
+                            raise
+                        print(
+                            f"{url}: the stream broke off after {total} bytes ({e}), resuming"
+                        )
+        finally:
+            # counted once at the end rather than for every chunk
+            count("bytes", total, stage="stream")
+
+    def extract_data_segmented(
+        self,
+        url: str = "https://s3.amazonaws.com/nyc-tlc/trip+data/yellow_tripdata_2021-07.csv",
+        file_name: str = "2021-07.csv",
+        segments: int = 4,
+        part_size: int = 64 * 1024 * 1024,
+        chunk_size: int = 1024 * 1024,
+    ) -> DownloadResult:
+        """
+        Downloads a single file as several byte ranges at once. The file is preallocated to its full size and every range is written at its own offset. The ranges that have been completed are recorded in a '<file_name>.parts' file next to the download, so an interrupted download resumes by fetching only the missing ranges. Every request goes through the endpoint of the host, so a range which is throttled, fails with a transient error or is cut short is fetched again with a backoff (see retry.Endpoint). If the server does not report the size of the file or does not accept range requests, the file is downloaded as a single stream with extract_data.
+
+        :param url str: the url to retrieve the content from.
+        :param file_name str: the name which is to be used to save the file with.
+        :param segments int: the number of ranges fetched at the same time.
+        :param part_size int: the size of a single range in bytes. Smaller parts lose less work when a download is interrupted.
+        :param chunk_size int: the number of bytes read from the response and written to the file at a time.
+        :return: the url, the file name, the number of bytes saved, the time it took, and the MD5 hash and the number of data rows of the file, computed once it has been put together
+        :rtype: DownloadResult
+        """
+        start = time.perf_counter()
+        calls = endpoint(urlparse(url).netloc)
+
+        def request_head() -> requests.Response:
+            r = self.session.head(url, allow_redirects=True)
+            r.raise_for_status()
+            return r
+
+        head = calls.call(request_head)
+        size = int(head.headers.get("Content-Length", 0))
+        accepts_ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+        if segments <= 1 or not size or not accepts_ranges:
+            return self.extract_data(url, file_name, chunk_size)
+
+        etag = head.headers.get("ETag", "")
+        progress_file = f"{file_name}.parts"
+        done = set()
+        if os.path.exists(progress_file) and os.path.exists(file_name):
+            with open(progress_file) as f:
+                progress = json.load(f)
+            if (
+                progress["size"] == size
+                and progress["etag"] == etag
+                and progress["part_size"] == part_size
+                and os.path.getsize(file_name) == size
+            ):
+                done = set(progress["done"])
+        if not done:
+            with open(file_name, "wb") as f:
+                f.truncate(size)
+
+        parts = [
+            (i, offset, min(offset + part_size, size) - 1)
+            for i, offset in enumerate(range(0, size, part_size))
+        ]
+        missing = [part for part in parts if part[0] not in done]
+        print(
+            f"\nDownloading {file_name} ({humanize.naturalsize(size)}) in {len(missing)} of {len(parts)} ranges"
+        )
+        lock = threading.Lock()
+
+        def save_progress() -> None:
+            with open(f"{progress_file}.tmp", "w") as f:
+                json.dump(
+                    {
+                        "size": size,
+                        "etag": etag,
+                        "part_size": part_size,
+                        "done": sorted(done),
+                    },
+                    f,
+                )
+            os.replace(f"{progress_file}.tmp", progress_file)
+
+        def fetch(part) -> None:
+            # a range which fails or is cut short is fetched again from its start and written over itself
+            i, first, last = part
+            headers = {"Range": f"bytes={first}-{last}"}
+            with self.session.get(url, headers=headers, stream=True) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise requests.HTTPError(
+                        f"Expected a partial response for {headers['Range']}, got {r.status_code}"
+                    )
+                with open(file_name, "r+b") as f:
+                    f.seek(first)
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                    if f.tell() != last + 1:
+                        raise requests.ConnectionError(
+                            f"Range {first}-{last} of {file_name} ended at {f.tell()}"
+                        )
+            with lock:
+                done.add(i)
+                save_progress()
+
+        with span("download", file=os.path.basename(file_name)):
+            with ThreadPoolExecutor(max_workers=segments) as executor:
+                list(executor.map(lambda part: calls.call(fetch, part), missing))
+
+        os.remove(progress_file)
+        # the ranges arrive out of order, so the hash and the rows are computed from the assembled file
+        digest = ContentDigest()
+        with open(file_name, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+        count("bytes", size, stage="download")
+        count("rows", digest.rows, stage="download")
+        print(
+            f"{file_name} has been successfully saved. File size: {humanize.naturalsize(size)}, {humanize.intcomma(digest.rows)} rows"
+        )
+        return DownloadResult(
+            url,
+            file_name,
+            size,
+            time.perf_counter() - start,
+            md5=digest.md5,
+            rows=digest.rows,
+        )
+
+    def extract_many(
+        self, urls: List[str], max_workers: int = 4, segments: int = 1
+    ) -> List[DownloadResult]:
+        """
+        Downloads several months at once through the shared session. Each file is saved under the name taken from the last part of its url (e.g. '2021-07.csv'). A failed download does not stop the others; the error is recorded in its result instead.
+
+        :param urls List[str]: the urls to download, as returned by generate_urls.
+        :param max_workers int: the number of files downloaded at the same time.
+        :param segments int: the number of ranges each file is split into, see extract_data_segmented. With 1, every file is downloaded as a single stream.
+        :return: one result per url, in the same order as the urls
+        :rtype: List[DownloadResult]
+        """
+
+        def download(url: str) -> DownloadResult:
+            file_name = self.file_name_of(url)
+            start = time.perf_counter()
+            try:
+                if segments > 1:
+                    return self.extract_data_segmented(url, file_name, segments)
+                return self.extract_data(url, file_name)
+            except Exception as e:
+                print(f"Failed to download {file_name}: {e}")
+                return DownloadResult(
+                    url, file_name, duration=time.perf_counter() - start, error=repr(e)
+                )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(download, urls))
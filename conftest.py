@@ -0,0 +1 @@
+# makes the packages of the repository importable from the tests, e.g. `from provisioner.provisioner import Provisioner`
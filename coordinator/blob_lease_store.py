@@ -0,0 +1,188 @@
+import threading
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import quote, unquote
+
+from azure.core.exceptions import HttpResponseError, ResourceExistsError
+from azure.storage.blob import BlobLeaseClient, ContainerClient
+
+from coordinator.lease_store import Lease
+
+
+class BlobLeaseStore:
+    def __init__(
+        self,
+        container_client: ContainerClient,
+        prefix: str = "leases/",
+        max_attempts: int = 3,
+    ) -> None:
+        """
+        The same coordination store as SQLiteLeaseStore for workers which do not share a directory, built on the leases of Azure Storage: every month is an empty blob whose metadata holds its state, and a worker claims the month by acquiring the lease of its blob. The lease id is the fencing token; the service rejects a change of the metadata made with a lease that has expired and been taken over. Azure leases last between 15 and 60 seconds, so the durations are clamped to that range.
+
+        :param container_client ContainerClient: the container to keep the blobs in, e.g. from FileManager.get_container_client. It has to exist.
+        :param prefix str: the prefix of the names of the blobs.
+        :param max_attempts int: the number of times a month is given up (see release) before it is marked as failed and no longer claimed.
+        """
+        self.container_client = container_client
+        self.prefix = prefix
+        self.max_attempts = max_attempts
+        self.__leases: Dict[str, BlobLeaseClient] = {}
+        self.__lock = threading.Lock()
+
+    def _blob_name(self, item: str) -> str:
+        return self.prefix + quote(item, safe="")
+
+    @staticmethod
+    def _duration(duration: float) -> int:
+        return max(15, min(60, int(duration)))
+
+    def register(self, items: Iterable[str]) -> None:
+        """
+        Adds the months that are not in the store yet. The ones that are already there keep their state.
+
+        :param items Iterable[str]: the months, e.g. the urls returned by Collector.generate_urls.
+        :returns: None
+        :rtype: NoneType
+        """
+        for item in items:
+            try:
+                self.container_client.upload_blob(
+                    self._blob_name(item),
+                    b"",
+                    metadata={"status": "pending", "attempts": "0"},
+                )
+            except ResourceExistsError:
+                pass
+
+    def claim(self, owner: str, duration: float = 60.0) -> Optional[Lease]:
+        """
+        Claims a month which is neither done nor leased by a live worker.
+
+        :param owner str: the id of the worker.
+        :param duration float: the number of seconds the lease lasts unless it is renewed.
+        :returns: the lease, or None if there is no month to claim right now
+        :rtype: Optional[Lease]
+        """
+        candidates = sorted(
+            (
+                blob
+                for blob in self.container_client.list_blobs(
+                    name_starts_with=self.prefix, include=["metadata"]
+                )
+                if blob.metadata.get("status") == "pending"
+                and blob.lease.status != "locked"
+            ),
+            key=lambda blob: (int(blob.metadata.get("attempts", 0)), blob.name),
+        )
+        for blob in candidates:
+            blob_client = self.container_client.get_blob_client(blob.name)
+            try:
+                lease_client = blob_client.acquire_lease(
+                    lease_duration=self._duration(duration)
+                )
+            except HttpResponseError:
+                # claimed by another worker since the listing
+                continue
+            # the month may have been completed between the listing and the claim
+            if blob_client.get_blob_properties().metadata.get("status") != "pending":
+                lease_client.release()
+                continue
+            item = unquote(blob.name[len(self.prefix) :])
+            with self.__lock:
+                self.__leases[item] = lease_client
+            return Lease(
+                item, owner, lease_client.id, time.time() + self._duration(duration)
+            )
+        return None
+
+    def _lease_client(self, lease: Lease) -> Optional[BlobLeaseClient]:
+        with self.__lock:
+            lease_client = self.__leases.get(lease.item)
+        if lease_client is None or lease_client.id != lease.token:
+            return None
+        return lease_client
+
+    def renew(self, lease: Lease, duration: float = 60.0) -> bool:
+        """
+        Extends the lease by the duration it has been acquired with.
+
+        :param lease Lease: the lease returned by claim.
+        :param duration float: not used, the service renews a lease for the duration it has been acquired with.
+        :returns: False if the lease has expired and the month has been claimed by another worker since
+        :rtype: bool
+        """
+        lease_client = self._lease_client(lease)
+        if lease_client is None:
+            return False
+        try:
+            lease_client.renew()
+        except HttpResponseError:
+            return False
+        lease.expires_at = time.time() + self._duration(duration)
+        return True
+
+    def _finish(self, lease: Lease, metadata: Dict[str, str]) -> bool:
+        lease_client = self._lease_client(lease)
+        if lease_client is None:
+            return False
+        blob_client = self.container_client.get_blob_client(self._blob_name(lease.item))
+        try:
+            blob_client.set_blob_metadata(metadata, lease=lease_client)
+        except HttpResponseError:
+            return False
+        finally:
+            with self.__lock:
+                self.__leases.pop(lease.item, None)
+        try:
+            lease_client.release()
+        except HttpResponseError:
+            pass
+        return True
+
+    def complete(self, lease: Lease) -> bool:
+        """
+        Marks the month as done, as long as the lease is still the current one.
+
+        :param lease Lease: the lease returned by claim.
+        :returns: False if the month has been claimed by another worker in the meantime
+        :rtype: bool
+        """
+        return self._finish(lease, {"status": "done"})
+
+    def release(self, lease: Lease, error: str = None) -> bool:
+        """
+        Gives up the month so that any worker can claim it again straight away, e.g. after it has failed. A month given up max_attempts times is marked as failed.
+
+        :param lease Lease: the lease returned by claim.
+        :param error str: the error the month has failed with. Only its first line is kept, as the metadata is limited in size.
+        :returns: False if the month has been claimed by another worker in the meantime
+        :rtype: bool
+        """
+        properties = self.container_client.get_blob_client(
+            self._blob_name(lease.item)
+        ).get_blob_properties()
+        attempts = int(properties.metadata.get("attempts", 0)) + 1
+        metadata = {
+            "status": "failed" if attempts >= self.max_attempts else "pending",
+            "attempts": str(attempts),
+        }
+        if error:
+            metadata["error"] = quote(error.splitlines()[0][:1024])
+        return self._finish(lease, metadata)
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Counts the months by their state.
+
+        :returns: the number of pending, leased, done and failed months
+        :rtype: Dict[str, int]
+        """
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        for blob in self.container_client.list_blobs(
+            name_starts_with=self.prefix, include=["metadata"]
+        ):
+            status = blob.metadata.get("status", "pending")
+            if status == "pending" and blob.lease.status == "locked":
+                status = "leased"
+            counts[status] += 1
+        return counts
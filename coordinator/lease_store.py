@@ -0,0 +1,193 @@
+import sqlite3
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional
+
+
+@dataclass
+class Lease:
+    item: str
+    owner: str
+    token: str
+    expires_at: float = 0.0
+
+
+class SQLiteLeaseStore:
+    def __init__(self, path: str = "leases.db", max_attempts: int = 3) -> None:
+        """
+        A coordination store for several workers (processes or machines sharing a directory) which split the months between them. A worker claims a month with a lease which expires unless it is renewed, so the month of a worker that crashed is claimed by another one once its lease runs out. Every claim gets a new fencing token, and a month is only renewed, completed or given up with the token of the current lease, so a worker whose lease has been taken over can no longer mark the month as done.
+
+        :param path str: the path of the SQLite file, e.g. on a directory shared by the workers. It is created if it does not exist.
+        :param max_attempts int: the number of times a month is given up (see release) before it is marked as failed and no longer claimed.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS leases (
+                    item TEXT PRIMARY KEY,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    owner TEXT,
+                    token INTEGER NOT NULL DEFAULT 0,
+                    expires_at REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT
+                )
+                """
+            )
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # a connection per call, so the store can be shared by threads and the file is not held open between calls;
+        # the transactions are started by hand with BEGIN IMMEDIATE, which takes the write lock before reading
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, query: str, parameters: tuple) -> bool:
+        conn = self._connect()
+        try:
+            return conn.execute(query, parameters).rowcount == 1
+        finally:
+            conn.close()
+
+    def register(self, items: Iterable[str]) -> None:
+        """
+        Adds the months that are not in the store yet. Every worker can register the same months; the ones that are already there keep their state.
+
+        :param items Iterable[str]: the months, e.g. the urls returned by Collector.generate_urls.
+        :returns: None
+        :rtype: NoneType
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(
+                "INSERT OR IGNORE INTO leases (item) VALUES (?)",
+                [(item,) for item in items],
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def claim(self, owner: str, duration: float = 60.0) -> Optional[Lease]:
+        """
+        Claims a month which is neither done nor leased by a live worker.
+
+        :param owner str: the id of the worker.
+        :param duration float: the number of seconds the lease lasts unless it is renewed.
+        :returns: the lease, or None if there is no month to claim right now
+        :rtype: Optional[Lease]
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # the months are claimed in the order they were registered, e.g. largest first (see Collector.plan)
+            row = conn.execute(
+                """
+                SELECT item, token FROM leases
+                WHERE status = 'pending' AND expires_at < ?
+                ORDER BY attempts, rowid LIMIT 1
+                """,
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            token = row["token"] + 1
+            conn.execute(
+                "UPDATE leases SET owner = ?, token = ?, expires_at = ? WHERE item = ?",
+                (owner, token, now + duration, row["item"]),
+            )
+            conn.execute("COMMIT")
+            return Lease(row["item"], owner, str(token), now + duration)
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def renew(self, lease: Lease, duration: float = 60.0) -> bool:
+        """
+        Extends the lease.
+
+        :param lease Lease: the lease returned by claim.
+        :param duration float: the number of seconds the lease lasts from now.
+        :returns: False if the lease has expired and the month has been claimed by another worker since
+        :rtype: bool
+        """
+        expires_at = time.time() + duration
+        renewed = self._update(
+            """
+            UPDATE leases SET expires_at = ?
+            WHERE item = ? AND token = ? AND status = 'pending'
+            """,
+            (expires_at, lease.item, int(lease.token)),
+        )
+        if renewed:
+            lease.expires_at = expires_at
+        return renewed
+
+    def complete(self, lease: Lease) -> bool:
+        """
+        Marks the month as done, as long as the lease is still the current one.
+
+        :param lease Lease: the lease returned by claim.
+        :returns: False if the month has been claimed by another worker in the meantime
+        :rtype: bool
+        """
+        return self._update(
+            """
+            UPDATE leases SET status = 'done', expires_at = 0, error = NULL
+            WHERE item = ? AND token = ? AND status = 'pending'
+            """,
+            (lease.item, int(lease.token)),
+        )
+
+    def release(self, lease: Lease, error: str = None) -> bool:
+        """
+        Gives up the month so that any worker can claim it again straight away, e.g. after it has failed. A month given up max_attempts times is marked as failed.
+
+        :param lease Lease: the lease returned by claim.
+        :param error str: the error the month has failed with.
+        :returns: False if the month has been claimed by another worker in the meantime
+        :rtype: bool
+        """
+        return self._update(
+            """
+            UPDATE leases SET expires_at = 0, error = ?, attempts = attempts + 1,
+            status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+            WHERE item = ? AND token = ? AND status = 'pending'
+            """,
+            (error, self.max_attempts, lease.item, int(lease.token)),
+        )
+
+    def summary(self) -> Dict[str, int]:
+        """
+        Counts the months by their state.
+
+        :returns: the number of pending, leased, done and failed months
+        :rtype: Dict[str, int]
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                """
+                SELECT SUM(status = 'pending' AND expires_at < ?),
+                SUM(status = 'pending' AND expires_at >= ?),
+                SUM(status = 'done'),
+                SUM(status = 'failed')
+                FROM leases
+                """,
+                (time.time(), time.time()),
+            ).fetchone()
+        finally:
+            conn.close()
+        return dict(
+            zip(("pending", "leased", "done", "failed"), (value or 0 for value in row))
+        )
@@ -0,0 +1,188 @@
+import argparse
+import os
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterator
+
+from cli import add_month_arguments, month_arguments
+from coordinator.lease_store import Lease, SQLiteLeaseStore
+
+
+class Worker:
+    def __init__(
+        self,
+        store,
+        worker_id: str = None,
+        lease_duration: float = 60.0,
+        poll_interval: float = 5.0,
+    ) -> None:
+        """
+        Takes part in a backfill split between several workers. The months are claimed one by one from the shared store as the worker has room for them, the leases of the months in progress are renewed in the background, and every month is completed or given up once it has left the pipeline. A worker keeps polling while other workers hold leases, so it claims the months of a worker that crashed once their leases expire.
+
+        :param store SQLiteLeaseStore: the coordination store, a SQLiteLeaseStore or a BlobLeaseStore.
+        :param worker_id str: the id of the worker. Defaults to the host name and the process id.
+        :param lease_duration float: the number of seconds a lease lasts unless it is renewed. The leases are renewed every third of it.
+        :param poll_interval float: the number of seconds to wait before looking for a month again while all of them are leased.
+        """
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.lease_duration = lease_duration
+        self.poll_interval = poll_interval
+        self.__leases: Dict[str, Lease] = {}
+        self.__lock = threading.Lock()
+        self.__stopped = threading.Event()
+        self.__heartbeat = None
+
+    def _renew(self) -> None:
+        while not self.__stopped.wait(self.lease_duration / 3):
+            with self.__lock:
+                leases = list(self.__leases.values())
+            for lease in leases:
+                if not self.store.renew(lease, self.lease_duration):
+                    print(f"{self.worker_id}: the lease of {lease.item} has been lost")
+                    with self.__lock:
+                        self.__leases.pop(lease.item, None)
+
+    def items(self) -> Iterator[str]:
+        """
+        Claims the months one at a time. The next month is only claimed when the previous one has been taken, e.g. by the first stage of a Pipeline, so a worker never holds more months than it has room for.
+
+        :returns: the claimed months, until there is none left to claim
+        :rtype: Iterator[str]
+        """
+        if self.__heartbeat is None:
+            self.__heartbeat = threading.Thread(target=self._renew, daemon=True)
+            self.__heartbeat.start()
+        while not self.__stopped.is_set():
+            lease = self.store.claim(self.worker_id, self.lease_duration)
+            if lease is not None:
+                print(f"{self.worker_id}: claimed {lease.item}")
+                with self.__lock:
+                    self.__leases[lease.item] = lease
+                yield lease.item
+                continue
+            summary = self.store.summary()
+            with self.__lock:
+                held = len(self.__leases)
+            if summary["pending"] == 0 and summary["leased"] <= held:
+                return
+            # the other months are leased by other workers; one of them may have crashed
+            time.sleep(self.poll_interval)
+
+    def fence(self, item: str) -> None:
+        """
+        Renews the lease of the month right before a step which must not run twice (e.g. the load), and raises if the month has been claimed by another worker in the meantime.
+
+        :param item str: the month.
+        :returns: None
+        :rtype: NoneType
+        """
+        with self.__lock:
+            lease = self.__leases.get(item)
+        if lease is None or not self.store.renew(lease, self.lease_duration):
+            raise RuntimeError(f"The lease of {item} has been lost to another worker")
+
+    def finish(self, item: str, error: str = None) -> bool:
+        """
+        Completes the month, or gives it up so that it is claimed again if it has failed.
+
+        :param item str: the month.
+        :param error str: the error the month has failed with, if any.
+        :returns: False if the lease has been lost and the month belongs to another worker
+        :rtype: bool
+        """
+        with self.__lock:
+            lease = self.__leases.pop(item, None)
+        if lease is None:
+            return False
+        if error is None:
+            return self.store.complete(lease)
+        return self.store.release(lease, error)
+
+    def run(self, function: Callable[[str], None]) -> None:
+        """
+        Processes the claimed months one at a time with the function, e.g. to try the coordination out with several local processes.
+
+        :param function Callable[[str], None]: processes a month.
+        :returns: None
+        :rtype: NoneType
+        """
+        try:
+            for item in self.items():
+                try:
+                    function(item)
+                except Exception as e:
+                    print(f"{self.worker_id}: {item} failed: {e}")
+                    self.finish(item, repr(e))
+                else:
+                    self.finish(item)
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """
+        Stops claiming and renewing. The months still held are left to expire.
+
+        :returns: None
+        :rtype: NoneType
+        """
+        self.__stopped.set()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Runs a worker of a backfill split between several processes or machines."
+    )
+    parser.add_argument(
+        "--store",
+        default="leases.db",
+        help="the SQLite file shared by the workers (default: leases.db)",
+    )
+    parser.add_argument(
+        "--blob-container",
+        help="keep the leases in this storage container instead of a SQLite file",
+    )
+    parser.add_argument("--worker-id", help="defaults to the host name and process id")
+    parser.add_argument("--lease-seconds", type=float, default=60.0)
+    parser.add_argument("--manifest", default="manifest.db")
+    parser.add_argument("--spool-dir", default="downloads")
+    parser.add_argument("--download-workers", type=int, default=2)
+    parser.add_argument("--upload-workers", type=int, default=2)
+    parser.add_argument("--load-workers", type=int, default=1)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument(
+        "--partitioned",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="switch every month into its own partition, so a month loaded again by another worker replaces itself "
+        "(default); with --no-partitioned a month whose lease expires after its load has committed is loaded twice",
+    )
+    add_month_arguments(parser)
+    args = parser.parse_args()
+
+    if args.blob_container:
+        from coordinator.blob_lease_store import BlobLeaseStore
+        from file_manager.file_manager import FileManager
+
+        store = BlobLeaseStore(FileManager().get_container_client(args.blob_container))
+    else:
+        store = SQLiteLeaseStore(args.store)
+
+    import app
+
+    app.main(
+        manifest_path=args.manifest,
+        download_workers=args.download_workers,
+        upload_workers=args.upload_workers,
+        load_workers=args.load_workers,
+        shards=args.shards,
+        spool_dir=args.spool_dir,
+        partitioned=args.partitioned,
+        worker=Worker(store, args.worker_id, args.lease_seconds),
+        **month_arguments(args),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Tuple
+
+from metrics.metrics import gauge, span
+
+
+class ConnectionPool:
+    def __init__(
+        self,
+        factory: Callable[[str], Any],
+        max_size: int = 4,
+        health_check_interval: float = 30.0,
+    ) -> None:
+        """
+        A small pool of reusable DB-API connections. The connections are kept open between calls and handed out by key (e.g. server and database), so only the first call for each key pays for the TLS handshake and the login.
+
+        :param factory Callable[[str], Any]: creates a new connection from a connection string, e.g. pyodbc.connect. Any DB-API compatible factory can be used, e.g. a local stand-in for testing.
+        :param max_size int: the maximum number of connections open at the same time for a single key.
+        :param health_check_interval float: the number of seconds a connection may stay idle before it is checked with 'SELECT 1' on the next checkout.
+        """
+        self.factory = factory
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.__idle: Dict[Hashable, List[Tuple[Any, float]]] = {}
+        self.__open: Dict[Hashable, int] = {}
+        self.__condition = threading.Condition()
+
+    def _is_healthy(self, conn: Any) -> bool:
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT 1")
+                cursor.fetchall()
+            finally:
+                cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, key: Hashable, conn: Any) -> None:
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.__condition:
+            self.__open[key] -= 1
+            self.__condition.notify()
+
+    def _acquire(self, key: Hashable, connection_string: str) -> Any:
+        while True:
+            with self.__condition:
+                while (
+                    not self.__idle.get(key)
+                    and self.__open.get(key, 0) >= self.max_size
+                ):
+                    self.__condition.wait()
+                if self.__idle.get(key):
+                    conn, released_at = self.__idle[key].pop()
+                else:
+                    self.__open[key] = self.__open.get(key, 0) + 1
+                    conn = None
+            if conn is None:
+                try:
+                    # the login is timed on its own, as it can take seconds on a database which is waking up
+                    with span("sql_connect"):
+                        conn = self.factory(connection_string)
+                    with self.__condition:
+                        gauge("sql_connections", sum(self.__open.values()))
+                    return conn
+                except Exception:
+                    with self.__condition:
+                        self.__open[key] -= 1
+                        self.__condition.notify()
+                    raise
+            if (
+                time.monotonic() - released_at < self.health_check_interval
+                or self._is_healthy(conn)
+            ):
+                return conn
+            print("Discarding a broken connection, reconnecting...")
+            self._discard(key, conn)
+
+    @contextmanager
+    def connection(self, key: Hashable, connection_string: str) -> Iterator[Any]:
+        """
+        Checks out a connection for the key, opening a new one if there is no idle connection and the pool is not full. The changes are committed when the block exits. If the block raises, the changes are rolled back, and a connection that cannot be rolled back is closed so that the next checkout reconnects.
+
+        :param key Hashable: the key the connection belongs to, e.g. (server_name, database_name).
+        :param connection_string str: the connection string passed to the factory when a new connection is needed.
+        :returns: an open connection
+        :rtype: Iterator[Any]
+        """
+        conn = self._acquire(key, connection_string)
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                self._discard(key, conn)
+                raise
+            self._release(key, conn)
+            raise
+        self._release(key, conn)
+
+    def _release(self, key: Hashable, conn: Any) -> None:
+        with self.__condition:
+            self.__idle.setdefault(key, []).append((conn, time.monotonic()))
+            self.__condition.notify()
+
+    def close(self) -> None:
+        """
+        Closes all the idle connections.
+
+        :returns: None
+        :rtype: NoneType
+        """
+        with self.__condition:
+            idle, self.__idle = self.__idle, {}
+            for key, connections in idle.items():
+                self.__open[key] -= len(connections)
+        for connections in idle.values():
+            for conn, _ in connections:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
@@ -1,40 +1,242 @@
+import csv
+import itertools
 import os
+import shutil
+import subprocess
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
 
 import pyodbc
 from azure.common.credentials import ServicePrincipalCredentials
 from azure.mgmt.resource import ResourceManagementClient
 from azure.mgmt.sql import SqlManagementClient
 from dotenv import find_dotenv, load_dotenv
-
-load_dotenv(find_dotenv())
+from msrestazure.azure_exceptions import CloudError
+
+from database_manager.connection_pool import ConnectionPool
+from database_manager.schema import (
+    HOURLY_SCHEMA,
+    MONTHLY_SCHEMA,
+    PARSERS,
+    PARTITION_COLUMN,
+    TLC_COLUMNS,
+    TLC_SCHEMA,
+    column_definitions,
+)
+from metrics.metrics import count, span
+from provisioner.provisioner import wait_until
+from retry.retry import endpoint
+
+
+def _parses(parse: Callable[[str], Any], value: str) -> bool:
+    try:
+        parse(value)
+    except (ValueError, OverflowError):
+        return False
+    return True
+
+
+def _lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    # the lines of a csv file which arrives in chunks cut anywhere, e.g. from Collector.stream_data
+    rest = b""
+    for chunk in chunks:
+        lines = (rest + chunk).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            yield line.decode()
+    if rest:
+        yield rest.decode()
+
+
+def _next_month(month: str) -> str:
+    # the first day of the month after the given one, e.g. '2021-08-01' for '2021-07-01'
+    year, month = int(month[:4]), int(month[5:7])
+    return f"{year + month // 12}-{month % 12 + 1:02d}-01"
+
+
+@dataclass
+class ShardResult:
+    file_name: str
+    rows: int = 0
+    duration: float = 0.0
+    error: Optional[str] = None
+    loaded_rows: Optional[int] = None
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        The average load speed in rows per second.
+        """
+        return self.rows / self.duration if self.duration else 0.0
 
 
 class Database:
     def __init__(
-        self, subscription_id: str, client_id: str, client_secret: str, tenant_id: str
+        self,
+        subscription_id: str,
+        client_id: str,
+        client_secret: str,
+        tenant_id: str,
+        connection_factory: Callable[[str], Any] = pyodbc.connect,
+        pool_size: int = 4,
     ) -> None:
+        # the .env file is read when the object is created rather than when the module is imported
+        load_dotenv(find_dotenv())
         self.subscription_id = subscription_id
         self.client_id = client_id
         self.client_secret = client_secret
         self.tenant_id = tenant_id
+        self.pool = ConnectionPool(connection_factory, max_size=pool_size)
+        self.__clients = None
+        self.__lock = threading.Lock()
+
+    def get_clients(self) -> Tuple[ResourceManagementClient, SqlManagementClient]:
+        """
+        Authenticates the service principal to get the clients required to create server and database. The clients are created on the first call and reused afterwards.
+
+        :returns: the resource management client and the SQL management client
+        :rtype: Tuple[ResourceManagementClient, SqlManagementClient]
+        """
+        with self.__lock:
+            if self.__clients is None:
+                credentials = ServicePrincipalCredentials(
+                    client_id=self.client_id,
+                    secret=self.client_secret,
+                    tenant=self.tenant_id,
+                )
+
+                resource_client = ResourceManagementClient(
+                    credentials, self.subscription_id
+                )
+                sql_client = SqlManagementClient(credentials, self.subscription_id)
+                self.__clients = resource_client, sql_client
+            return self.__clients
+
+    def connection(
+        self,
+        server_name: str,
+        database_name: str,
+        driver: int = 17,
+        login_username: str = None,
+        login_password: str = None,
+    ):
+        """
+        Checks out a pooled connection to the database. The connection is kept open after the block exits and reused by the next call for the same server, database and login. If no login is given, the administrator login from the environment is used.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database.
+        :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
+        :param login_username str: the login username for the database.
+        :param login_password str: the password for the database.
+        :returns: a context manager which yields an open connection
+        """
+        login_username = login_username or os.getenv("ADMINISTRATOR_LOGIN")
+        login_password = login_password or os.getenv("ADMINISTRATOR_LOGIN_PASSWORD")
+        connection_string = (
+            "DRIVER="
+            + f"{{ODBC Driver {driver} for SQL Server}}"
+            + ";SERVER=tcp:"
+            + f"{server_name}.database.windows.net"
+            + ";PORT=1433;DATABASE="
+            + database_name
+            + ";UID="
+            + login_username
+            + ";PWD="
+            + login_password
+        )
+        return self.pool.connection(
+            (server_name, database_name, login_username), connection_string
+        )
 
-    def get_clients(self) -> None:
+    def close(self) -> None:
         """
-        Authenticates the service principal to get the clients required to create server and database.
+        Closes the pooled connections which are not in use.
 
         :returns: None
         :rtype: NoneType
         """
+        self.pool.close()
+
+    def _exists(self, get: Callable[[], Any]) -> bool:
+        try:
+            get()
+            return True
+        except CloudError as e:
+            if e.status_code == 404:
+                return False
+            raise
+
+    def server_exists(self, server_name: str, group_name: str = "tlc-data-rg") -> bool:
+        """
+        Checks whether the server already exists.
+
+        :param server_name str: the name of the server.
+        :param group_name str: the name of the resource group the server belongs to.
+        :returns: True if the server exists
+        :rtype: bool
+        """
+        _, sql_client = self.get_clients()
+        return self._exists(lambda: sql_client.servers.get(group_name, server_name))
+
+    def database_exists(
+        self, server_name: str, database_name: str, group_name: str = "tlc-data-rg"
+    ) -> bool:
+        """
+        Checks whether the database already exists.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database.
+        :param group_name str: the name of the resource group the database belongs to.
+        :returns: True if the database exists
+        :rtype: bool
+        """
+        _, sql_client = self.get_clients()
+        return self._exists(
+            lambda: sql_client.databases.get(group_name, server_name, database_name)
+        )
+
+    def firewall_rule_exists(
+        self, server_name: str, rule_name: str, group_name: str = "tlc-data-rg"
+    ) -> bool:
+        """
+        Checks whether the firewall rule already exists.
 
-        credentials = ServicePrincipalCredentials(
-            client_id=self.client_id, secret=self.client_secret, tenant=self.tenant_id
+        :param server_name str: the name of the server.
+        :param rule_name str: the name of the firewall rule.
+        :param group_name str: the name of the resource group the server belongs to.
+        :returns: True if the firewall rule exists
+        :rtype: bool
+        """
+        _, sql_client = self.get_clients()
+        return self._exists(
+            lambda: sql_client.firewall_rules.get(group_name, server_name, rule_name)
         )
 
-        resource_client = ResourceManagementClient(credentials, self.subscription_id)
-        sql_client = SqlManagementClient(credentials, self.subscription_id)
+    def wait_for_database(
+        self, server_name: str, database_name: str, timeout: float = 300.0
+    ) -> None:
+        """
+        Waits until the database accepts connections, e.g. after the server, the database or the firewall rule have just been created. The connection is retried with a growing delay instead of waiting for a fixed amount of time, so a database which is already reachable costs a single query.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database.
+        :param timeout float: the number of seconds after which a TimeoutError is raised.
+        :returns: None
+        :rtype: NoneType
+        """
+
+        def ping() -> bool:
+            with self.connection(server_name, database_name) as conn:
+                with closing(conn.cursor()) as cursor:
+                    cursor.execute("SELECT 1")
+                    cursor.fetchall()
+            return True
 
-        return resource_client, sql_client
+        wait_until(ping, f"database '{database_name}'", timeout=timeout)
 
     def create_resource_group(
         self, group_name: str = "sample-rg", region: str = "northeurope"
@@ -73,6 +275,9 @@ class Database:
         :rtype: NoneType
         """
         _, sql_client = self.get_clients()
+        if self.server_exists(server_name, group_name):
+            print(f"Server '{server_name}' already exists.\n")
+            return
         print(f"Creating a new server '{server_name}' ({region})...\n")
 
         server = sql_client.servers.create_or_update(
@@ -89,6 +294,10 @@ class Database:
                 ),  # Required for create
             },
         )
+        wait_until(
+            lambda: self.server_exists(server_name, group_name),
+            f"server '{server_name}'",
+        )
         print(f"Server '{server_name}' created successfully.\n")
 
     def create_database(
@@ -113,6 +322,9 @@ class Database:
         :rtype: NoneType
         """
         _, sql_client = self.get_clients()
+        if self.database_exists(server_name, database_name, group_name):
+            print(f"Database '{database_name}' already exists.\n")
+            return
         print(f"Creating a new database '{database_name}' ({region})...\n")
         database = sql_client.databases.create_or_update(
             group_name,
@@ -125,6 +337,10 @@ class Database:
                 "requested_service_objective_name": pricing_tier,
             },
         )
+        wait_until(
+            lambda: self.database_exists(server_name, database_name, group_name),
+            f"database '{database_name}'",
+        )
         print(f"Database '{database_name}' created successfully.\n")
 
     def whitelist_ip(
@@ -143,12 +359,30 @@ class Database:
         :returns: None
         :rtype: NoneType
         """
+        if self.firewall_rule_exists(server_name, rule_name, resource_group):
+            print(f"Firewall rule '{rule_name}' already exists.")
+            return
         print(f"Creating a new firewall rule '{rule_name}'...")
-        os.system(
-            f"az sql server firewall-rule create --name {rule_name} --resource-group {resource_group} --server {server_name} --start-ip-address {ip_address} --end-ip-address {ip_address}"
+        subprocess.run(
+            [
+                shutil.which("az") or "az",
+                "sql",
+                "server",
+                "firewall-rule",
+                "create",
+                "--name",
+                rule_name,
+                "--resource-group",
+                resource_group,
+                "--server",
+                server_name,
+                "--start-ip-address",
+                ip_address,
+                "--end-ip-address",
+                ip_address,
+            ],
+            check=True,
         )
-        print("\nWaiting for whitelisting of IP to take effect...")
-        time.sleep(60)
 
     def encrypt_database(
         self,
@@ -171,20 +405,12 @@ class Database:
         :returns: None
         :rtype: NoneType
         """
-        query = f"CREATE MASTER KEY ENCRYPTION BY PASSWORD = '{encryption_password}'"
-        with pyodbc.connect(
-            "DRIVER="
-            + f"{{ODBC Driver {driver} for SQL Server}}"
-            + ";SERVER=tcp:"
-            + f"{server_name}.database.windows.net"
-            + ";PORT=1433;DATABASE="
-            + database_name
-            + ";UID="
-            + os.getenv("ADMINISTRATOR_LOGIN")
-            + ";PWD="
-            + os.getenv("ADMINISTRATOR_LOGIN_PASSWORD")
-        ) as conn:
-            with conn.cursor() as cursor:
+        query = f"""
+            IF NOT EXISTS (SELECT * FROM sys.symmetric_keys WHERE name = '##MS_DatabaseMasterKey##')
+            CREATE MASTER KEY ENCRYPTION BY PASSWORD = '{encryption_password}'
+            """
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
                 cursor.execute(query)
 
     def create_credentials(
@@ -209,23 +435,13 @@ class Database:
         :rtype: NoneType
         """
         query = f"""
+            IF NOT EXISTS (SELECT * FROM sys.database_scoped_credentials WHERE name = 'BlobCredential')
             CREATE DATABASE SCOPED CREDENTIAL BlobCredential
             WITH IDENTITY = 'SHARED ACCESS SIGNATURE',
             SECRET = {sas_token};
             """
-        with pyodbc.connect(
-            "DRIVER="
-            + f"{{ODBC Driver {driver} for SQL Server}}"
-            + ";SERVER=tcp:"
-            + f"{server_name}.database.windows.net"
-            + ";PORT=1433;DATABASE="
-            + database_name
-            + ";UID="
-            + os.getenv("ADMINISTRATOR_LOGIN")
-            + ";PWD="
-            + os.getenv("ADMINISTRATOR_LOGIN_PASSWORD")
-        ) as conn:
-            with conn.cursor() as cursor:
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
                 cursor.execute(query)
 
     def create_external_data_source(
@@ -258,6 +474,7 @@ class Database:
         location = f"'https://{location}.blob.core.windows.net/{container_name}'"
 
         query = f"""
+          IF NOT EXISTS (SELECT * FROM sys.external_data_sources WHERE name = 'AzureBlob')
           CREATE EXTERNAL DATA SOURCE AzureBlob
               WITH ( 
                   TYPE       = BLOB_STORAGE,
@@ -266,19 +483,10 @@ class Database:
               );
           """
 
-        with pyodbc.connect(
-            "DRIVER="
-            + f"{{ODBC Driver {driver} for SQL Server}}"
-            + ";SERVER=tcp:"
-            + f"{server_name}.database.windows.net"
-            + ";PORT=1433;DATABASE="
-            + database_name
-            + ";UID="
-            + login_username
-            + ";PWD="
-            + login_password
+        with self.connection(
+            server_name, database_name, driver, login_username, login_password
         ) as conn:
-            with conn.cursor() as cursor:
+            with closing(conn.cursor()) as cursor:
                 cursor.execute(query)
 
     def create_table(
@@ -289,6 +497,8 @@ class Database:
         login_password: str = "please_God_just_make_this_work",
         driver: int = 17,
         table_name: str = "tlc_data",
+        drop_existing: bool = True,
+        partitioned: bool = False,
     ) -> None:
         """
         Creates a new table
@@ -299,50 +509,253 @@ class Database:
         :param login_password str: the password for the database which was set when creating the database.
         :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
         :param table_name str: the name for the table that is to be newly created inside the database
+        :param drop_existing bool: whether to drop the table if it already exists. If False, an existing table and the data loaded into it are kept.
+        :param partitioned bool: whether to create the table with a clustered columnstore index, partitioned by the month of the pick-up, instead of a heap. The months are then loaded with prepare_month and switch_month. The partitions are added as the months are loaded.
         """
+        function, scheme = f"pf_{table_name}_month", f"ps_{table_name}_month"
+        statements = []
+        if drop_existing:
+            statements.append(f"DROP TABLE IF EXISTS {table_name};")
+            if partitioned:
+                statements.append(
+                    f"""IF EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = '{scheme}')
+                            DROP PARTITION SCHEME {scheme};
+                        IF EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = '{function}')
+                            DROP PARTITION FUNCTION {function};"""
+                )
+            create = f"CREATE TABLE {table_name}"
+        else:
+            create = f"IF OBJECT_ID('{table_name}', 'U') IS NULL\n                        CREATE TABLE {table_name}"
+        if partitioned:
+            # the function starts without boundaries; prepare_month adds the two boundaries of every month it loads
+            statements.append(
+                f"""IF NOT EXISTS (SELECT 1 FROM sys.partition_functions WHERE name = '{function}')
+                            EXEC('CREATE PARTITION FUNCTION {function} (datetime) AS RANGE RIGHT FOR VALUES ()');
+                        IF NOT EXISTS (SELECT 1 FROM sys.partition_schemes WHERE name = '{scheme}')
+                            EXEC('CREATE PARTITION SCHEME {scheme} AS PARTITION {function} ALL TO ([PRIMARY])');"""
+            )
+            layout = f""",
+                            INDEX cci_{table_name} CLUSTERED COLUMNSTORE
+                        ) ON {scheme} ({PARTITION_COLUMN})"""
+        else:
+            layout = "\n                        )"
+        drop = "\n                        ".join(statements)
         query = f"""
-                        DROP TABLE IF EXISTS {table_name};
-
-                        CREATE TABLE {table_name} (
-                        VendorID int,
-                        tpep_pickup_datetime datetime,
-                        tpep_dropoff_datetime datetime,
-                        passenger_count int,
-                        trip_distance float,
-                        RatecodeID int,
-                        store_and_fwd_flag char,
-                        PULocationID int,
-                        DOLocationID int,
-                        payment_type int,
-                        fare_amount float,
-                        extra	float,
-                        mta_tax float,
-                        tip_amount float,
-                        tolls_amount float,
-                        improvement_surcharge float,
-                        total_amount float,
-                        congestion_surcharge float
-                        )
+                        {drop}
+
+                        {create} (
+{column_definitions("                        ")}{layout}
                         """
         print(f"Creating a table '{table_name}'...")
 
-        with pyodbc.connect(
-            "DRIVER="
-            + f"{{ODBC Driver {driver} for SQL Server}}"
-            + ";SERVER=tcp:"
-            + f"{server_name}.database.windows.net"
-            + ";PORT=1433;DATABASE="
-            + database_name
-            + ";UID="
-            + os.getenv("ADMINISTRATOR_LOGIN")
-            + ";PWD="
-            + os.getenv("ADMINISTRATOR_LOGIN_PASSWORD"),
-            fast_executemany=True,
-        ) as conn:
-            with conn.cursor() as cursor:
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
                 cursor.execute(query)
         print(f"Table '{table_name}' created successfully.")
 
+    def create_summary_tables(
+        self,
+        server_name: str = "sample-server",
+        database_name: str = "sample-database",
+        driver: int = 17,
+        table_name: str = "tlc_data",
+    ) -> None:
+        """
+        Creates the hourly and monthly summary tables ('<table_name>_hourly' and '<table_name>_monthly') next to the main table, unless they already exist.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database where the tables are going to be created.
+        :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
+        :param table_name str: the name of the main table.
+        :returns: None
+        :rtype: NoneType
+        """
+        print(f"Creating the summary tables of '{table_name}'...")
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
+                for suffix, schema in (
+                    ("hourly", HOURLY_SCHEMA),
+                    ("monthly", MONTHLY_SCHEMA),
+                ):
+                    cursor.execute(
+                        f"""
+                        IF OBJECT_ID('{table_name}_{suffix}', 'U') IS NULL
+                        CREATE TABLE {table_name}_{suffix} (
+{column_definitions("                        ", schema)}
+                        )
+                        """
+                    )
+
+    def replace_month(
+        self,
+        server_name: str = "sample-server",
+        database_name: str = "sample-database",
+        table_name: str = "tlc_data_monthly",
+        month: str = "2021-07-01",
+        columns: List[str] = (),
+        rows: List[tuple] = (),
+        driver: int = 17,
+        batch_size: int = 10_000,
+    ) -> None:
+        """
+        Replaces the rows of a single month in a table with a 'month' column, e.g. the summary tables. The old rows are deleted and the new ones inserted in a single transaction, so the other months are never touched and the readers never see a half-replaced month.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database with the table.
+        :param table_name str: the name of the table.
+        :param month str: the first day of the month to replace.
+        :param columns List[str]: the names of the columns of the rows.
+        :param rows List[tuple]: the new rows of the month.
+        :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
+        :param batch_size int: the number of rows sent in a single round trip.
+        :returns: None
+        :rtype: NoneType
+        """
+        query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
+                if hasattr(cursor, "fast_executemany"):
+                    cursor.fast_executemany = True
+                cursor.execute(f"DELETE FROM {table_name} WHERE month = ?", (month,))
+                for i in range(0, len(rows), batch_size):
+                    cursor.executemany(query, rows[i : i + batch_size])
+        print(f"{len(rows)} rows of {month} loaded into '{table_name}'.")
+
+    def prepare_month(
+        self,
+        server_name: str = "sample-server",
+        database_name: str = "sample-database",
+        table_name: str = "tlc_data",
+        month: str = "2021-07-01",
+        driver: int = 17,
+    ) -> str:
+        """
+        Gets a month ready to be loaded into a table created with partitioned=True: adds the partition of the month to the table if it is missing and creates an empty heap to load the file of the month into, e.g. with load_csv_to_db or load_shards_to_db. The table itself is not touched by the load, so the readers of the table are not blocked. Every loaded month has both of its boundaries and switch_month only keeps the rows of the month, so a new boundary always splits an empty partition, which only changes metadata.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database with the table.
+        :param table_name str: the name of the partitioned table.
+        :param month str: the first day of the month, e.g. '2021-07-01'.
+        :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
+        :returns: the name of the staging table to load the month into
+        :rtype: str
+        """
+        function, scheme = f"pf_{table_name}_month", f"ps_{table_name}_month"
+        next_month = _next_month(month)
+        staging = f"{table_name}_staging_{month[:7].replace('-', '')}"
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
+                # months loaded at the same time by other workers split the same function; the lock is held until the
+                # transaction ends, so the transaction is opened first, and a lock which is not granted raises
+                cursor.execute(
+                    f"""
+                        BEGIN TRANSACTION;
+                        DECLARE @result int;
+                        EXEC @result = sp_getapplock @Resource = '{function}', @LockMode = 'Exclusive',
+                            @LockOwner = 'Transaction', @LockTimeout = 600000;
+                        IF @result < 0
+                            THROW 50000, 'The partition function {function} could not be locked', 1;
+                        """
+                )
+                for boundary in (month, next_month):
+                    cursor.execute(
+                        f"""
+                        IF NOT EXISTS (
+                            SELECT 1 FROM sys.partition_range_values v
+                            JOIN sys.partition_functions f ON f.function_id = v.function_id
+                            WHERE f.name = '{function}' AND CAST(v.value AS datetime) = '{boundary}'
+                        )
+                        BEGIN
+                            ALTER PARTITION SCHEME {scheme} NEXT USED [PRIMARY];
+                            ALTER PARTITION FUNCTION {function}() SPLIT RANGE ('{boundary}');
+                        END
+                        """
+                    )
+                cursor.execute(
+                    f"""
+                        DROP TABLE IF EXISTS {staging};
+
+                        CREATE TABLE {staging} (
+{column_definitions("                        ")}
+                        );
+
+                        COMMIT TRANSACTION;
+                        """
+                )
+        print(f"Staging table '{staging}' created for {month}.")
+        return staging
+
+    def switch_month(
+        self,
+        server_name: str = "sample-server",
+        database_name: str = "sample-database",
+        table_name: str = "tlc_data",
+        month: str = "2021-07-01",
+        driver: int = 17,
+    ) -> int:
+        """
+        Moves a month loaded with prepare_month into its partition of the table. The rows whose pick-up is in the month are compressed into a columnstore table with the layout of the partition, the partition is emptied and the new table is switched in, in a single transaction: the switch only changes metadata, the readers see either the old or the new month, and the other months are never touched. The rows of the file whose pick-up is in another month are left out. The staging tables are dropped afterwards.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database with the table.
+        :param table_name str: the name of the partitioned table.
+        :param month str: the first day of the month, e.g. '2021-07-01'.
+        :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
+        :returns: the number of rows switched into the partition
+        :rtype: int
+        """
+        function = f"pf_{table_name}_month"
+        next_month = _next_month(month)
+        suffix = month[:7].replace("-", "")
+        staging, switch = (
+            f"{table_name}_staging_{suffix}",
+            f"{table_name}_switch_{suffix}",
+        )
+        columns = ", ".join(TLC_COLUMNS)
+
+        print(f"Switching {month} into '{table_name}'...")
+        with self.connection(server_name, database_name, driver) as conn:
+            with closing(conn.cursor()) as cursor:
+                # the check constraint proves to the server that every row belongs to the partition
+                cursor.execute(
+                    f"""
+                        DROP TABLE IF EXISTS {switch};
+
+                        CREATE TABLE {switch} (
+{column_definitions("                        ")},
+                            CONSTRAINT ck_{switch}_month CHECK (
+                                {PARTITION_COLUMN} IS NOT NULL
+                                AND {PARTITION_COLUMN} >= '{month}'
+                                AND {PARTITION_COLUMN} < '{next_month}'
+                            ),
+                            INDEX cci_{switch} CLUSTERED COLUMNSTORE
+                        ) ON [PRIMARY]
+                        """
+                )
+                with span("switch_stage", table=table_name, month=month):
+                    cursor.execute(
+                        f"""
+                        INSERT INTO {switch} WITH (TABLOCK) ({columns})
+                        SELECT {columns} FROM {staging}
+                        WHERE {PARTITION_COLUMN} >= '{month}' AND {PARTITION_COLUMN} < '{next_month}'
+                        """
+                    )
+                    rows = cursor.rowcount
+                cursor.execute(f"SELECT $PARTITION.{function}('{month}')")
+                partition = cursor.fetchone()[0]
+                cursor.execute(
+                    f"""
+                        TRUNCATE TABLE {table_name} WITH (PARTITIONS ({partition}));
+                        ALTER TABLE {switch} SWITCH TO {table_name} PARTITION {partition};
+                        DROP TABLE {switch};
+                        DROP TABLE {staging};
+                        """
+                )
+        print(
+            f"{rows} rows of {month} switched into partition {partition} of '{table_name}'."
+        )
+        return rows
+
     def load_csv_to_db(
         self,
         server_name: str = "sample-server",
@@ -353,16 +766,41 @@ class Database:
         table_name: str = "sample-table",
         file_name: str = "input.csv",
         data_source: str = "AzureBlob",
-    ) -> None:
+        batch_size: int = None,
+        tablock: bool = False,
+        max_errors: int = None,
+        error_file: str = None,
+    ) -> Optional[int]:
         """
+        Loads the file from the storage into the table with BULK INSERT. If the database throttles or fails with a transient error, the load is retried after a backoff (see retry.Endpoint), unless batch_size is given.
+
         :param server_name str: the name of the server that hosts the database to be encrypted.
         :param database_name str: the name of the database that is to be encrypted.
         :param login_username str: the login username for the database which was set when creating the database.
         :param login_password str: the password for the database which was set when creating the database.
         :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
         :param table_name str: the name for the table that is to be newly created inside the database
+        :param batch_size int: the number of rows committed as a single transaction (BATCHSIZE). By default the whole file is a single transaction.
+        :param tablock bool: whether to take a bulk update table lock (TABLOCK) for the duration of the load. On a heap, several loads with TABLOCK can still run at the same time.
+        :param max_errors int: the maximum number of rows that may fail before the load is cancelled (MAXERRORS).
+        :param error_file str: the blob which the rows that could not be loaded are written to (ERRORFILE).
+        :returns: the number of rows inserted, as reported by the server, or None if the driver does not report it
+        :rtype: Optional[int]
         """
 
+        options = ""
+        if batch_size is not None:
+            options += f",\n                            BATCHSIZE   = {batch_size}"
+        if tablock:
+            options += ",\n                            TABLOCK"
+        if max_errors is not None:
+            options += f",\n                            MAXERRORS   = {max_errors}"
+        if error_file is not None:
+            options += f",\n                            ERRORFILE   = '{error_file}'"
+            options += (
+                ",\n                            ERRORFILE_DATA_SOURCE = 'AzureBlob'"
+            )
+
         file_name = f"'{file_name}'"
         data_source = f"'{data_source}'"
         driver = 17
@@ -373,26 +811,203 @@ class Database:
                         WITH ( 
                             DATA_SOURCE = 'AzureBlob',
                             FORMAT      = 'CSV',
-                            FIRSTROW    = 2
+                            FIRSTROW    = 2{options}
                         );
                         """
 
         print(f"Inserting '{file_name}' into '{table_name}'...")
 
-        with pyodbc.connect(
-            "DRIVER="
-            + f"{{ODBC Driver {driver} for SQL Server}}"
-            + ";SERVER=tcp:"
-            + f"{server_name}.database.windows.net"
-            + ";PORT=1433;DATABASE="
-            + database_name
-            + ";UID="
-            + os.getenv("ADMINISTRATOR_LOGIN")
-            + ";PWD="
-            + os.getenv("ADMINISTRATOR_LOGIN_PASSWORD"),
-            fast_executemany=True,
-        ) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(query)
+        def bulk_insert() -> Optional[int]:
+            with self.connection(server_name, database_name, driver) as conn:
+                with closing(conn.cursor()) as cursor:
+                    with span("bulk_insert", file=file_name, table=table_name):
+                        cursor.execute(query)
+                    return cursor.rowcount if cursor.rowcount >= 0 else None
+
+        # a failed load is rolled back as a whole and can be retried; with BATCHSIZE the batches before the error
+        # stay committed and a retry would load them twice
+        if batch_size is None:
+            rows = endpoint(f"sql:{server_name}").call(bulk_insert)
+        else:
+            rows = bulk_insert()
+
+        count("rows", rows or 0, stage="load")
+        print(f"Bulk insert of '{file_name}' has been successful ({rows} rows).")
+        return rows
+
+    def load_shards_to_db(
+        self,
+        server_name: str = "sample-server",
+        database_name: str = "sample-database",
+        table_name: str = "sample-table",
+        shards: List[Tuple[str, int]] = (),
+        max_workers: int = 4,
+        batch_size: int = None,
+        tablock: bool = True,
+        max_errors: int = None,
+        error_file: str = None,
+    ) -> List[ShardResult]:
+        """
+        Loads the shards of a file (see file_manager.splitter.split_csv) with a separate BULK INSERT for every shard, running up to max_workers of them at the same time over separate connections. A failed shard does not stop the others; the error is recorded in its result instead.
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database with the table.
+        :param table_name str: the name of the table where the data is going to be inserted.
+        :param shards List[Tuple[str, int]]: the blob name of every shard and the number of rows in it.
+        :param max_workers int: the number of shards loaded at the same time. The pool of the Database object should allow at least as many connections.
+        :param batch_size int: see load_csv_to_db.
+        :param tablock bool: see load_csv_to_db.
+        :param max_errors int: see load_csv_to_db.
+        :param error_file str: see load_csv_to_db. The name of the shard is appended to it, so every shard gets its own error file.
+        :returns: one result per shard with the number of rows, the time it took and the number of rows the server reported as inserted
+        :rtype: List[ShardResult]
+        """
 
-        print(f"Bulk insert of '{file_name}' has been successful.")
+        def load(shard: Tuple[str, int]) -> ShardResult:
+            file_name, rows = shard
+            start = time.perf_counter()
+            try:
+                loaded_rows = self.load_csv_to_db(
+                    server_name=server_name,
+                    database_name=database_name,
+                    table_name=table_name,
+                    file_name=file_name,
+                    batch_size=batch_size,
+                    tablock=tablock,
+                    max_errors=max_errors,
+                    error_file=f"{error_file}.{file_name}" if error_file else None,
+                )
+                return ShardResult(
+                    file_name,
+                    rows,
+                    time.perf_counter() - start,
+                    loaded_rows=loaded_rows,
+                )
+            except Exception as e:
+                print(f"Failed to load {file_name}: {e}")
+                return ShardResult(
+                    file_name, rows, time.perf_counter() - start, repr(e)
+                )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(load, shards))
+
+        for result in results:
+            if result.error is None:
+                print(
+                    f"{result.file_name}: {result.rows} rows in {result.duration:.1f}s ({result.rows_per_second:.0f} rows/s)"
+                )
+        return results
+
+    def insert_csv(
+        self,
+        server_name: str = "sample-server",
+        database_name: str = "sample-database",
+        table_name: str = "tlc_data",
+        file_name: str = None,
+        chunks: Iterable[bytes] = None,
+        batch_size: int = 10_000,
+        schema: List[Tuple[str, str]] = TLC_SCHEMA,
+        placeholder: str = "?",
+        driver: int = 17,
+        rejected_file: str = None,
+    ) -> Tuple[int, int]:
+        """
+        Inserts a csv file into the table straight from this machine, without the storage: the rows are read one batch at a time, converted to the types of the schema, and sent with executemany over a single connection. With pyodbc, fast_executemany is turned on, so every batch goes to the server as one array of parameters in a single round trip. It needs no external data source, so it also works with a SQL Server outside of Azure (through the connection_factory of the Database object), and it skips the round trip through the storage for the small months. Any DB-API connection whose cursor has executemany works, e.g. sqlite3 for a benchmark. The whole file is inserted in a single transaction, so a failed insert leaves nothing behind; a file, unlike a stream, is inserted again if the database throttles or fails with a transient error (see retry.Endpoint).
+
+        :param server_name str: the name of the server that hosts the database.
+        :param database_name str: the name of the database with the table.
+        :param table_name str: the name of the table where the data is going to be inserted.
+        :param file_name str: the local csv file, with a header.
+        :param chunks Iterable[bytes]: the chunks of a csv file with a header, e.g. from Collector.stream_data, if no file_name is given.
+        :param batch_size int: the number of rows sent in a single round trip. Larger batches mean fewer round trips but more memory on both sides.
+        :param schema List[Tuple[str, str]]: the name and the SQL type of every column, in the order of the columns of the file.
+        :param placeholder str: the parameter marker of the driver, e.g. '?' for pyodbc and sqlite3 or '%s' for psycopg2.
+        :param driver int: ODBC driver version. The default version is ODBC Driver 17 for SQL Server.
+        :param rejected_file str: the local csv file to write the rows which do not fit the table to, as they were, with the reason as their last value: the number of their values if they do not have one for every column of the schema, or the columns whose values do not parse. They are left out either way; blank lines are skipped.
+        :returns: the number of rows inserted and the number of rows left out
+        :rtype: Tuple[int, int]
+        """
+        if (file_name is None) == (chunks is None):
+            raise ValueError("Either file_name or chunks has to be given")
+        columns = ", ".join(column for column, _ in schema)
+        query = f"INSERT INTO {table_name} ({columns}) VALUES ({', '.join([placeholder] * len(schema))})"
+        parsers = [PARSERS[sql_type] for _, sql_type in schema]
+        name = os.path.basename(file_name) if file_name else table_name
+
+        def typed(reader: Iterator[List[str]], rejected: list) -> Iterator[list]:
+            # zip would cut a longer row short and leave the missing values of a shorter one to the database; a value
+            # which does not parse fails its row instead of the whole insert
+            writer = None
+            if rejected_file is not None:
+                f = open(rejected_file, "w", newline="")
+                writer = csv.writer(f)
+            try:
+                for row in reader:
+                    if len(row) == len(schema):
+                        try:
+                            values = [
+                                None if value == "" else parse(value)
+                                for parse, value in zip(parsers, row)
+                            ]
+                        except (ValueError, OverflowError):
+                            reason = ";".join(
+                                column
+                                for (column, _), parse, value in zip(
+                                    schema, parsers, row
+                                )
+                                if value != "" and not _parses(parse, value)
+                            )
+                        else:
+                            yield values
+                            continue
+                    elif row:
+                        reason = f"{len(row)} fields instead of {len(schema)}"
+                    else:
+                        continue
+                    rejected.append(reason)
+                    if writer is not None:
+                        writer.writerow(row + [reason])
+            finally:
+                if writer is not None:
+                    f.close()
+
+        def insert(lines: Iterable[str]) -> Tuple[int, int]:
+            rows, rejected = 0, []
+            with self.connection(server_name, database_name, driver) as conn:
+                with closing(conn.cursor()) as cursor:
+                    if hasattr(cursor, "fast_executemany"):
+                        cursor.fast_executemany = True
+                    reader = csv.reader(lines)
+                    next(reader, None)
+                    reader = typed(reader, rejected)
+                    with span("insert", file=name, table=table_name):
+                        while True:
+                            batch = list(itertools.islice(reader, batch_size))
+                            if not batch:
+                                break
+                            cursor.executemany(query, batch)
+                            rows += len(batch)
+            return rows, len(rejected)
+
+        print(
+            f"Inserting '{name}' into '{table_name}' in batches of {batch_size} rows..."
+        )
+        start = time.perf_counter()
+        if file_name is not None:
+
+            def insert_file() -> Tuple[int, int]:
+                with open(file_name, newline="") as f:
+                    return insert(f)
+
+            rows, rejected = endpoint(f"sql:{server_name}").call(insert_file)
+        else:
+            rows, rejected = insert(_lines(chunks))
+        duration = time.perf_counter() - start
+        count("rows", rows, stage="load")
+        if rejected:
+            print(f"{rejected} rows of '{name}' do not fit the table and are left out.")
+        print(
+            f"{rows} rows of '{name}' inserted in {duration:.1f}s ({rows / duration if duration else 0:.0f} rows/s)."
+        )
+        return rows, rejected
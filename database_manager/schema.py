@@ -0,0 +1,86 @@
+from datetime import date, datetime
+from typing import Any, Callable, Dict, List, Tuple
+
+# the layout of the table created by Database.create_table, in the order of the columns in the csv files
+TLC_SCHEMA: List[Tuple[str, str]] = [
+    ("VendorID", "int"),
+    ("tpep_pickup_datetime", "datetime"),
+    ("tpep_dropoff_datetime", "datetime"),
+    ("passenger_count", "int"),
+    ("trip_distance", "float"),
+    ("RatecodeID", "int"),
+    ("store_and_fwd_flag", "char"),
+    ("PULocationID", "int"),
+    ("DOLocationID", "int"),
+    ("payment_type", "int"),
+    ("fare_amount", "float"),
+    ("extra", "float"),
+    ("mta_tax", "float"),
+    ("tip_amount", "float"),
+    ("tolls_amount", "float"),
+    ("improvement_surcharge", "float"),
+    ("total_amount", "float"),
+    ("congestion_surcharge", "float"),
+]
+
+TLC_COLUMNS: List[str] = [column for column, _ in TLC_SCHEMA]
+
+# the column the partitioned layout of the table is split by, one partition per month
+PARTITION_COLUMN = "tpep_pickup_datetime"
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+# the measures summed up by the aggregator for every hour or month and pick-up and drop-off zone
+MEASURES: List[str] = [
+    "passenger_count",
+    "trip_distance",
+    "fare_amount",
+    "tip_amount",
+    "total_amount",
+]
+
+# the layout of the summary tables created next to the main table by Database.create_summary_tables
+HOURLY_SCHEMA: List[Tuple[str, str]] = [
+    ("month", "date"),
+    ("pickup_hour", "datetime"),
+    ("PULocationID", "int"),
+    ("DOLocationID", "int"),
+    ("trip_count", "int"),
+] + [(measure, "float") for measure in MEASURES]
+
+MONTHLY_SCHEMA: List[Tuple[str, str]] = [
+    column for column in HOURLY_SCHEMA if column[0] != "pickup_hour"
+]
+
+
+def _int(value: str) -> int:
+    # some of the older files write the whole numbers with a decimal point, e.g. '1.0'
+    try:
+        return int(value)
+    except ValueError:
+        return int(float(value))
+
+
+# how the values of every SQL type of the schemas are read from the csv files; an empty value is always NULL
+PARSERS: Dict[str, Callable[[str], Any]] = {
+    "int": _int,
+    "float": float,
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "char": str,
+}
+
+
+def column_definitions(
+    indent: str = "", schema: List[Tuple[str, str]] = TLC_SCHEMA
+) -> str:
+    """
+    Formats the schema as the column definitions of a CREATE TABLE statement.
+
+    :param indent str: the whitespace put in front of every column.
+    :param schema List[Tuple[str, str]]: the name and the SQL type of every column.
+    :returns: the column definitions separated by commas and new lines
+    :rtype: str
+    """
+    return ",\n".join(f"{indent}{column} {sql_type}" for column, sql_type in schema)
@@ -0,0 +1,162 @@
+import os
+import re
+import time
+
+import humanize
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.parquet as pq
+
+from database_manager.schema import DATETIME_FORMAT, TLC_SCHEMA
+
+ARROW_TYPES = {
+    "int": pa.int32(),
+    "float": pa.float64(),
+    "datetime": pa.timestamp("s"),
+    "char": pa.string(),
+}
+
+
+class ParquetExporter:
+    def __init__(
+        self,
+        output_dir: str = "parquet",
+        compression: str = "zstd",
+        row_group_size: int = 1_000_000,
+        block_size: int = 16 * 1024 * 1024,
+    ) -> None:
+        """
+        Converts the monthly csv files into compressed Parquet files with typed columns, partitioned by year and month (e.g. 'parquet/year=2021/month=07/2021-07.parquet'). The min/max statistics of every row group are kept, so the readers can skip the row groups and the partitions outside of the dates they need.
+
+        :param output_dir str: the directory to write the partitions to.
+        :param compression str: the compression codec, e.g. 'zstd', 'snappy' or 'gzip'.
+        :param row_group_size int: the number of rows in a row group. The memory used depends on it and not on the size of the file.
+        :param block_size int: the number of bytes of the csv file parsed at a time.
+        """
+        self.output_dir = output_dir
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.block_size = block_size
+        self.schema = pa.schema(
+            [(column, ARROW_TYPES[sql_type]) for column, sql_type in TLC_SCHEMA]
+        )
+        # the integers are read as floats, as some of the files write them as e.g. '1.0'; they are truncated to
+        # integers as schema.PARSERS does before they are written
+        self.read_schema = pa.schema(
+            [
+                (field.name, pa.float64() if field.type == pa.int32() else field.type)
+                for field in self.schema
+            ]
+        )
+
+    def partition_path(
+        self, file_name: str, year: int = None, month: int = None
+    ) -> str:
+        """
+        Returns the path of the Parquet file for the month. The year and the month are taken from the file name (e.g. '2021-07.csv') unless they are given.
+
+        :param file_name str: the csv file of the month.
+        :param year int: the year of the month.
+        :param month int: the month.
+        :returns: the path of the Parquet file, relative to the current directory
+        :rtype: str
+        """
+        if year is None or month is None:
+            found = re.search(r"(\d{4})-(\d{2})", os.path.basename(file_name))
+            if found is None:
+                raise ValueError(f"Cannot tell the month of {file_name}")
+            year, month = int(found.group(1)), int(found.group(2))
+        stem = os.path.splitext(os.path.basename(file_name))[0]
+        return os.path.join(
+            self.output_dir, f"year={year}", f"month={month:02d}", f"{stem}.parquet"
+        )
+
+    def _typed(self, batch: pa.RecordBatch) -> pa.RecordBatch:
+        # casts the integer columns read as floats; a value which does not fit the column fails the cast
+        columns = [
+            pc.cast(pc.trunc(column), field.type)
+            if field.type == pa.int32()
+            else column
+            for column, field in zip(batch.columns, self.schema)
+        ]
+        return pa.RecordBatch.from_arrays(columns, schema=self.schema)
+
+    def export(
+        self,
+        file_name: str = "2021-07.csv",
+        year: int = None,
+        month: int = None,
+        fmanager=None,
+        container_name: str = "tlc-data",
+        output_file: str = None,
+    ) -> str:
+        """
+        Converts the csv file of the month into a Parquet file. The csv file is read in blocks and written one row group at a time, so only a single row group is held in memory. If a FileManager is given, the Parquet file is uploaded as well, under the same partition path.
+
+        :param file_name str: the csv file to convert. Its columns have to match the table created by Database.create_table.
+        :param year int: the year of the month. Taken from the file name if not given.
+        :param month int: the month. Taken from the file name if not given.
+        :param fmanager FileManager: the FileManager to upload the Parquet file with. If None, the file is only saved locally.
+        :param container_name str: the name of the container to upload the file to.
+        :param output_file str: the file to write to, e.g. in a Spool. The partition path is used if None; the file is uploaded under the partition path either way.
+        :returns: the path of the Parquet file
+        :rtype: str
+        """
+        start = time.perf_counter()
+        partition = self.partition_path(file_name, year, month)
+        path = output_file or partition
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        print(f"Converting {file_name} to {path}...")
+
+        reader = pv.open_csv(
+            file_name,
+            read_options=pv.ReadOptions(block_size=self.block_size),
+            convert_options=pv.ConvertOptions(
+                column_types=self.read_schema,
+                include_columns=self.schema.names,
+                timestamp_parsers=[DATETIME_FORMAT],
+                strings_can_be_null=True,
+            ),
+        )
+        rows = 0
+        batches, buffered = [], 0
+        with pq.ParquetWriter(
+            f"{path}.tmp", self.schema, compression=self.compression
+        ) as writer:
+
+            def flush(final: bool = False) -> int:
+                # writes the full row groups and keeps the rest for the next one
+                table = pa.Table.from_batches(batches, schema=self.schema)
+                full = len(table)
+                if not final:
+                    full -= full % self.row_group_size
+                writer.write_table(
+                    table.slice(0, full), row_group_size=self.row_group_size
+                )
+                batches.clear()
+                batches.extend(table.slice(full).to_batches())
+                return len(table) - full
+
+            for batch in reader:
+                batches.append(self._typed(batch))
+                buffered += batch.num_rows
+                rows += batch.num_rows
+                if buffered >= self.row_group_size:
+                    buffered = flush()
+            if buffered:
+                flush(final=True)
+        os.replace(f"{path}.tmp", path)
+
+        csv_size, parquet_size = os.path.getsize(file_name), os.path.getsize(path)
+        print(
+            f"{path}: {humanize.intcomma(rows)} rows, {humanize.naturalsize(csv_size)} -> {humanize.naturalsize(parquet_size)} in {time.perf_counter() - start:.1f}s"
+        )
+        if fmanager is not None:
+            fmanager.upload_file(
+                container_name,
+                path,
+                overwrite=True,
+                blob_name=partition.replace(os.sep, "/"),
+            )
+        return path
@@ -1,16 +1,82 @@
+import base64
+import hashlib
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional
+from urllib.parse import urlparse
 
-from azure.storage.blob import BlobServiceClient
+import humanize
+from azure.core.exceptions import ResourceExistsError
+from azure.storage.blob import (
+    BlobBlock,
+    BlobServiceClient,
+    ContainerClient,
+    ContentSettings,
+)
 from dotenv import find_dotenv, load_dotenv
 
-load_dotenv(find_dotenv())
+from metrics.metrics import count, span
+from retry.retry import endpoint
+
+
+@dataclass
+class UploadResult:
+    file_name: str
+    bytes: int = 0
+    duration: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        """
+        The average upload speed in bytes per second.
+        """
+        return self.bytes / self.duration if self.duration else 0.0
 
 
 class FileManager:
-    def __init__(self):
+    def __init__(self, blob_service_client: BlobServiceClient = None):
+        # the .env file is read when the object is created rather than when the module is imported
+        load_dotenv(find_dotenv())
         self.__storage_connection_string = os.getenv("STORAGE_CONNECTION_STRING")
+        self.__blob_service_client = blob_service_client
+        self.__container_clients = {}
+        self.__lock = threading.Lock()
         self.container_name = ""
 
+    def get_service_client(self) -> BlobServiceClient:
+        """
+        Returns the client for the storage account. The client is created from the connection string on the first call and reused afterwards, so all the uploads share its connection pool. If a client has been passed when creating the FileManager object (e.g. a local stand-in of the blob service), that client is used instead.
+
+        :returns: client for the storage account
+        :rtype: BlobServiceClient
+        """
+        with self.__lock:
+            if self.__blob_service_client is None:
+                self.__blob_service_client = BlobServiceClient.from_connection_string(
+                    self.__storage_connection_string
+                )
+            return self.__blob_service_client
+
+    def get_container_client(self, container_name: str) -> ContainerClient:
+        """
+        Returns the client for the given container, creating it on the first call and reusing it afterwards.
+
+        :param container_name str: the name of the container
+        :returns: client for the container
+        :rtype: ContainerClient
+        """
+        service_client = self.get_service_client()
+        with self.__lock:
+            if container_name not in self.__container_clients:
+                self.__container_clients[
+                    container_name
+                ] = service_client.get_container_client(container_name)
+            return self.__container_clients[container_name]
+
     def create_container(self, container_name: str = "unnamed") -> None:
         """
         Creates a new container inside Azure Storage.
@@ -20,33 +86,234 @@ class FileManager:
         :rtype: NoneType
         """
         self.container_name = container_name
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.__storage_connection_string
-        )
         print(f"Creating a new container '{container_name}'...\n")
-        container_client = blob_service_client.create_container(self.container_name)
+        try:
+            self.get_container_client(container_name).create_container()
+        except ResourceExistsError:
+            print(f"Container '{container_name}' already exists.\n")
+            return
         print(f"Container '{container_name}' created successfully.\n")
 
     def upload_file(
-        self, container_name: str = "tlc-data2", file_name: str = "unnamed"
+        self,
+        container_name: str = "tlc-data2",
+        file_name: str = "unnamed",
+        overwrite: bool = False,
+        max_concurrency: int = 1,
+        blob_name: str = None,
+        content_md5: str = None,
     ) -> None:
         """
         Uploads the file to Azure Storage as a blob. As it is referred to in Azure documentation, blobs are Azure-specific objects
-        that can hold text or binary data, including images, documents, etc.
+        that can hold text or binary data, including images, documents, etc. If the storage account throttles or fails with a transient error, the whole file is uploaded again after a backoff, see retry.Endpoint.
 
         :param file_name str: the name for the file (blob). This is the name that the file is going to be stored with in your storage account.
+        :param overwrite bool: whether to replace the blob if it already exists. If False, uploading a file that already exists raises ResourceExistsError.
+        :param max_concurrency int: the number of blocks uploaded at the same time.
+        :param blob_name str: the name to store the file with, if it should differ from file_name (e.g. a path inside a partitioned layout).
+        :param content_md5 str: the MD5 hash of the file as a hex string (e.g. DownloadResult.md5). It is stored as the Content-MD5 of the blob, which get_blob_md5 reads back for the consumers of the blob. It is not checked by the service; every request is checked against an MD5 hash of its own body instead (validate_content), so a block corrupted on the way is rejected and sent again.
         :returns: None
         :rtype: NoneType
         """
-        blob_service_client = BlobServiceClient.from_connection_string(
-            self.__storage_connection_string
-        )
-        blob_client = blob_service_client.get_blob_client(
-            container=container_name, blob=file_name
+        blob_client = self.get_container_client(container_name).get_blob_client(
+            blob_name or file_name
         )
         print("\nUploading to Azure Storage as blob:\n\t" + file_name + "\n")
 
-        with open(file_name, "rb") as data:
-            blob_client.upload_blob(data)
+        content_settings = None
+        if content_md5 is not None:
+            content_settings = ContentSettings(
+                content_md5=bytearray.fromhex(content_md5)
+            )
+
+        def upload() -> None:
+            with open(file_name, "rb") as data:
+                blob_client.upload_blob(
+                    data,
+                    overwrite=overwrite,
+                    max_concurrency=max_concurrency,
+                    content_settings=content_settings,
+                    validate_content=True,
+                )
+
+        with span("upload", blob=blob_name or file_name):
+            endpoint(urlparse(blob_client.url).netloc).call(upload)
+        count("bytes", os.path.getsize(file_name), stage="upload")
         print(f"\n{file_name} has been successfully uploaded.\n")
 
+    def upload_stream(
+        self,
+        container_name: str = "tlc-data2",
+        blob_name: str = "unnamed",
+        chunks: Iterable[bytes] = (),
+        max_concurrency: int = 4,
+        overwrite: bool = True,
+    ) -> int:
+        """
+        Uploads a stream of chunks (e.g. from Collector.stream_data) as a block blob without writing anything to disk. Every chunk is staged as a separate block, checked by the service against its MD5 hash, with up to max_concurrency blocks in flight, and the block list is committed once all of them have been staged. The next chunk is not read until a slot is free, so the memory used is bounded by the chunk size times max_concurrency. A block or a commit which is throttled or fails with a transient error is sent again after a backoff, see retry.Endpoint. The MD5 hash of the chunks is computed as they are read and committed as the Content-MD5 of the blob.
+
+        :param container_name str: the name of a container created prior to uploading the stream.
+        :param blob_name str: the name that the blob is going to be stored with in your storage account.
+        :param chunks Iterable[bytes]: the content of the blob, in order.
+        :param max_concurrency int: the number of blocks staged at the same time.
+        :param overwrite bool: whether to replace the blob if it already exists. If False, uploading a blob that already exists raises ResourceExistsError.
+        :returns: the number of bytes uploaded
+        :rtype: int
+        """
+        blob_client = self.get_container_client(container_name).get_blob_client(
+            blob_name
+        )
+        if not overwrite and blob_client.exists():
+            raise ResourceExistsError(f"The blob '{blob_name}' already exists.")
+        print("\nStreaming to Azure Storage as blob:\n\t" + blob_name + "\n")
+
+        start = time.perf_counter()
+        slots = threading.Semaphore(max_concurrency)
+        failed = threading.Event()
+        block_ids = []
+        futures = []
+        md5 = hashlib.md5()
+        total = 0
+
+        # staging a block again under the same id replaces it, so every block is retried on its own
+        calls = endpoint(urlparse(blob_client.url).netloc)
+
+        def stage(block_id: str, chunk: bytes) -> None:
+            try:
+                calls.call(
+                    blob_client.stage_block,
+                    block_id,
+                    chunk,
+                    length=len(chunk),
+                    validate_content=True,
+                )
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                slots.release()
+
+        chunks = iter(chunks)
+        with span("upload_stream", blob=blob_name):
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                while True:
+                    slots.acquire()
+                    chunk = None if failed.is_set() else next(chunks, None)
+                    if chunk is None:
+                        slots.release()
+                        break
+                    block_id = base64.b64encode(
+                        f"{len(block_ids):08d}".encode()
+                    ).decode()
+                    block_ids.append(block_id)
+                    md5.update(chunk)
+                    total += len(chunk)
+                    futures.append(executor.submit(stage, block_id, chunk))
+            for future in futures:
+                future.result()
+
+            calls.call(
+                blob_client.commit_block_list,
+                [BlobBlock(block_id=i) for i in block_ids],
+                content_settings=ContentSettings(content_md5=bytearray(md5.digest())),
+            )
+        count("bytes", total, stage="upload")
+        duration = time.perf_counter() - start
+        print(
+            f"\n{blob_name} has been successfully uploaded. Blob size: {humanize.naturalsize(total)} ({humanize.naturalsize(total / max(duration, 1e-9))}/s)\n"
+        )
+        return total
+
+    def get_blob_md5(
+        self, container_name: str = "tlc-data2", blob_name: str = "unnamed"
+    ) -> Optional[str]:
+        """
+        Reads the Content-MD5 stored with the blob, without downloading it.
+
+        :param container_name str: the name of the container with the blob.
+        :param blob_name str: the name of the blob.
+        :returns: the MD5 hash as a hex string, or None if the blob has been uploaded without one
+        :rtype: Optional[str]
+        """
+        properties = (
+            self.get_container_client(container_name)
+            .get_blob_client(blob_name)
+            .get_blob_properties()
+        )
+        content_md5 = properties.content_settings.content_md5
+        return bytes(content_md5).hex() if content_md5 else None
+
+    def get_blob_size(
+        self, container_name: str = "tlc-data2", blob_name: str = "unnamed"
+    ) -> int:
+        """
+        Reads the size of the blob, without downloading it. Unlike the Content-MD5, which is whatever the uploader has stored, the size is counted by the service, so comparing it with the size of the local file shows whether all of the file has arrived.
+
+        :param container_name str: the name of the container with the blob.
+        :param blob_name str: the name of the blob.
+        :returns: the size of the blob in bytes
+        :rtype: int
+        """
+        return (
+            self.get_container_client(container_name)
+            .get_blob_client(blob_name)
+            .get_blob_properties()
+            .size
+        )
+
+    def upload_files(
+        self,
+        paths: List[str],
+        container_name: str = "tlc-data2",
+        max_concurrency: int = 4,
+        block_size: int = 8 * 1024 * 1024,
+        max_files: int = 2,
+        overwrite: bool = False,
+    ) -> List[UploadResult]:
+        """
+        Uploads several files at once, each of them as block_size blocks staged in parallel with upload_stream. Every file is stored under its own name. A file that fails to upload does not stop the others; the error is recorded in its result instead. The throughput reported for every file can be used to tune block_size and max_concurrency.
+
+        :param paths List[str]: the files to upload.
+        :param container_name str: the name of a container created prior to uploading the files.
+        :param max_concurrency int: the number of blocks of a single file uploaded at the same time.
+        :param block_size int: the size of a single block in bytes.
+        :param max_files int: the number of files uploaded at the same time.
+        :param overwrite bool: whether to replace the blobs that already exist.
+        :returns: one result per file, in the same order as the paths
+        :rtype: List[UploadResult]
+        """
+
+        def read_blocks(path: str) -> Iterator[bytes]:
+            with open(path, "rb") as f:
+                while True:
+                    block = f.read(block_size)
+                    if not block:
+                        break
+                    yield block
+
+        def upload(path: str) -> UploadResult:
+            start = time.perf_counter()
+            try:
+                total = self.upload_stream(
+                    container_name,
+                    os.path.basename(path),
+                    read_blocks(path),
+                    max_concurrency=max_concurrency,
+                    overwrite=overwrite,
+                )
+                return UploadResult(path, total, time.perf_counter() - start)
+            except Exception as e:
+                print(f"Failed to upload {path}: {e}")
+                return UploadResult(
+                    path, duration=time.perf_counter() - start, error=repr(e)
+                )
+
+        with ThreadPoolExecutor(max_workers=max_files) as executor:
+            results = list(executor.map(upload, paths))
+
+        for result in results:
+            if result.error is None:
+                print(
+                    f"{result.file_name}: {humanize.naturalsize(result.bytes)} in {result.duration:.1f}s ({humanize.naturalsize(result.throughput)}/s)"
+                )
+        return results
@@ -0,0 +1,60 @@
+import os
+from typing import List, Tuple
+
+
+def split_csv(
+    file_name: str, shards: int = 4, output_dir: str = None
+) -> List[Tuple[str, int]]:
+    """
+    Splits a csv file into shards of roughly equal size. The file is only split at row boundaries: a line break inside a quoted field (which leaves an odd number of quotes on the line) does not end the row, so a quoted value is never cut in two. Every shard starts with the header of the original file, so each of them can be loaded on its own with FIRSTROW = 2. The file is read line by line, so the memory used does not depend on the size of the file.
+
+    :param file_name str: the csv file to split.
+    :param shards int: the number of shards. Fewer shards are written if the file has fewer rows.
+    :param output_dir str: the directory to write the shards to. Defaults to the directory of the file.
+    :returns: the name of every shard and the number of data rows in it
+    :rtype: List[Tuple[str, int]]
+    """
+    stem, extension = os.path.splitext(os.path.basename(file_name))
+    output_dir = output_dir or os.path.dirname(file_name)
+    target = os.path.getsize(file_name) / shards
+
+    def row_lines(f):
+        # group the physical lines into rows, keeping quoted line breaks inside the row
+        lines, in_quotes = [], False
+        for line in f:
+            lines.append(line)
+            if line.count(b'"') % 2:
+                in_quotes = not in_quotes
+            if not in_quotes:
+                yield b"".join(lines) if len(lines) > 1 else lines[0]
+                lines = []
+        if lines:
+            yield b"".join(lines)
+
+    result = []
+    with open(file_name, "rb") as src:
+        rows = row_lines(src)
+        header = next(rows, b"")
+        position = len(header)
+        out = None
+        for row in rows:
+            if not row.strip():
+                position += len(row)
+                continue
+            if out is None or (
+                position >= target * len(result) and len(result) < shards
+            ):
+                if out is not None:
+                    out.close()
+                shard_name = os.path.join(
+                    output_dir, f"{stem}.part{len(result):03d}{extension}"
+                )
+                out = open(shard_name, "wb")
+                out.write(header)
+                result.append([shard_name, 0])
+            out.write(row)
+            result[-1][1] += 1
+            position += len(row)
+        if out is not None:
+            out.close()
+    return [(shard_name, rows) for shard_name, rows in result]
@@ -0,0 +1,336 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+from collector.collector import Collector
+
+STAGES = ("download", "upload", "load")
+
+
+def file_checksum(file_name: str, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Computes the MD5 checksum of a local file.
+
+    :param file_name str: the path of the file.
+    :param chunk_size int: the number of bytes read at a time.
+    :returns: the checksum as a hex string
+    :rtype: str
+    """
+    md5 = hashlib.md5()
+    with open(file_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path: str = "manifest.db", directory: str = "") -> None:
+        """
+        A local state store which records the progress of every month through the pipeline, so that a rerun only does the work that is missing.
+
+        :param path str: the path of the SQLite file. It is created if it does not exist.
+        :param directory str: the directory the files of the months are saved in (e.g. the directory of a Spool). Defaults to the current directory.
+        """
+        self.path = path
+        self.directory = directory
+        self.__lock = threading.Lock()
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        self.__conn.row_factory = sqlite3.Row
+        with self.__conn:
+            self.__conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS months (
+                    url TEXT PRIMARY KEY,
+                    file_name TEXT NOT NULL,
+                    etag TEXT,
+                    content_length INTEGER,
+                    checksum TEXT,
+                    local_size INTEGER,
+                    download_status TEXT NOT NULL DEFAULT 'pending',
+                    upload_status TEXT NOT NULL DEFAULT 'pending',
+                    load_status TEXT NOT NULL DEFAULT 'pending',
+                    error TEXT,
+                    updated_at TEXT
+                )
+                """
+            )
+            # add the columns which manifests created by earlier versions do not have yet
+            existing = {
+                row["name"] for row in self.__conn.execute("PRAGMA table_info(months)")
+            }
+            for column, sql_type in (
+                ("local_size", "INTEGER"),
+                ("aggregate_status", "TEXT NOT NULL DEFAULT 'pending'"),
+                ("rows", "INTEGER"),
+                ("blob_md5", "TEXT"),
+                ("loaded_rows", "INTEGER"),
+                ("switched_rows", "INTEGER"),
+                ("blob_size", "INTEGER"),
+                ("parquet_status", "TEXT NOT NULL DEFAULT 'pending'"),
+                ("rejected_rows", "INTEGER"),
+            ):
+                if column not in existing:
+                    self.__conn.execute(
+                        f"ALTER TABLE months ADD COLUMN {column} {sql_type}"
+                    )
+            # the shards of a month loaded into the table one by one, so that a failed load only repeats the rest
+            self.__conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS shards (
+                    url TEXT NOT NULL,
+                    shard TEXT NOT NULL,
+                    shards INTEGER NOT NULL,
+                    loaded_rows INTEGER,
+                    PRIMARY KEY (url, shard)
+                )
+                """
+            )
+
+    def register(self, urls: List[str]) -> None:
+        """
+        Adds the months that are not in the manifest yet. The months that are already there keep their progress.
+
+        :param urls List[str]: the urls as returned by Collector.generate_urls.
+        :returns: None
+        :rtype: NoneType
+        """
+        with self.__lock, self.__conn:
+            self.__conn.executemany(
+                "INSERT OR IGNORE INTO months (url, file_name) VALUES (?, ?)",
+                [(url, Collector.file_name_of(url)) for url in urls],
+            )
+
+    def update_source(
+        self, url: str, etag: Optional[str], content_length: Optional[int]
+    ) -> bool:
+        """
+        Records the ETag and Content-Length of the source file. If either of them differs from what has been recorded before, the file has changed at the source and all the stages of the month are reset.
+
+        :param url str: the url of the month.
+        :param etag str: the ETag reported by the source.
+        :param content_length int: the Content-Length reported by the source.
+        :returns: True if the month has been reset
+        :rtype: bool
+        """
+        row = self.get(url)
+        changed = row["etag"] is not None and (
+            row["etag"] != etag or row["content_length"] != content_length
+        )
+        with self.__lock, self.__conn:
+            if changed:
+                self.__conn.execute(
+                    """
+                    UPDATE months SET checksum = NULL, download_status = 'pending',
+                    upload_status = 'pending', load_status = 'pending',
+                    aggregate_status = 'pending', parquet_status = 'pending'
+                    WHERE url = ?
+                    """,
+                    (url,),
+                )
+                self.__conn.execute("DELETE FROM shards WHERE url = ?", (url,))
+            self.__conn.execute(
+                "UPDATE months SET etag = ?, content_length = ?, updated_at = ? WHERE url = ?",
+                (etag, content_length, datetime.now().isoformat(), url),
+            )
+        return changed
+
+    def mark(
+        self, url: str, stage: str, status: str = "done", error: str = None, **fields
+    ) -> None:
+        """
+        Records the status of a stage of the month. If a download completes with a checksum that differs from the one recorded before, the upload and the load of the month are reset as well.
+
+        :param url str: the url of the month.
+        :param stage str: one of 'download', 'upload', 'load', 'aggregate' and 'parquet'.
+        :param status str: 'done', 'failed' or 'pending'.
+        :param error str: the error that made the stage fail.
+        :param fields: other columns to update, e.g. checksum, rows, blob_size or loaded_rows.
+        :returns: None
+        :rtype: NoneType
+        """
+        columns = {f"{stage}_status": status, "error": error, **fields}
+        columns["updated_at"] = datetime.now().isoformat()
+        previous = self.get(url)["checksum"]
+        if (
+            stage == "download"
+            and status == "done"
+            and previous
+            and fields.get("checksum") != previous
+        ):
+            columns["upload_status"] = "pending"
+            columns["load_status"] = "pending"
+            columns["aggregate_status"] = "pending"
+            columns["parquet_status"] = "pending"
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                f"UPDATE months SET {assignments} WHERE url = ?",
+                (*columns.values(), url),
+            )
+            if columns.get("load_status") == "pending":
+                self.__conn.execute("DELETE FROM shards WHERE url = ?", (url,))
+
+    def mark_shard(
+        self, url: str, shard: str, shards: int, loaded_rows: Optional[int]
+    ) -> None:
+        """
+        Records that a shard of the month has been loaded into the table. A shard is loaded in a single transaction, so it is either in the table as a whole or not at all.
+
+        :param url str: the url of the month.
+        :param shard str: the name of the shard, as returned by split_csv.
+        :param shards int: the number of shards the month has been split into.
+        :param loaded_rows int: the number of rows the server reported as inserted.
+        :returns: None
+        :rtype: NoneType
+        """
+        with self.__lock, self.__conn:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO shards (url, shard, shards, loaded_rows) VALUES (?, ?, ?, ?)",
+                (url, shard, shards, loaded_rows),
+            )
+
+    def loaded_shards(self, url: str) -> List[sqlite3.Row]:
+        """
+        Returns the shards of the month which have been loaded into the table. They are forgotten when the month is reset, e.g. because the file has changed at the source.
+
+        :param url str: the url of the month.
+        :returns: the name of every loaded shard, the number of shards of the month and the number of rows loaded
+        :rtype: List[sqlite3.Row]
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT * FROM shards WHERE url = ? ORDER BY shard", (url,)
+            ).fetchall()
+
+    def get(self, url: str) -> sqlite3.Row:
+        """
+        Returns the recorded state of the month.
+
+        :param url str: the url of the month.
+        :returns: the row of the month
+        :rtype: sqlite3.Row
+        """
+        with self.__lock:
+            return self.__conn.execute(
+                "SELECT * FROM months WHERE url = ?", (url,)
+            ).fetchone()
+
+    def is_done(self, url: str, stage: str) -> bool:
+        """
+        Checks whether the stage of the month has been completed. A download only counts as completed if the file is still in place with the size it had when the download was marked as done.
+
+        :param url str: the url of the month.
+        :param stage str: one of 'download', 'upload', 'load', 'aggregate' and 'parquet'.
+        :returns: True if the stage can be skipped
+        :rtype: bool
+        """
+        row = self.get(url)
+        if row is None or row[f"{stage}_status"] != "done":
+            return False
+        if stage == "download":
+            file_name = os.path.join(self.directory, row["file_name"])
+            return os.path.exists(file_name) and (
+                row["local_size"] is None
+                or os.path.getsize(file_name) == row["local_size"]
+            )
+        return True
+
+    def any_loaded(self) -> bool:
+        """
+        Checks whether any month, or any shard of a month, has been loaded into the database.
+
+        :returns: True if at least one month or shard has been loaded
+        :rtype: bool
+        """
+        with self.__lock:
+            return (
+                self.__conn.execute(
+                    """
+                    SELECT 1 FROM months WHERE load_status = 'done'
+                    UNION ALL SELECT 1 FROM shards
+                    LIMIT 1
+                    """
+                ).fetchone()
+                is not None
+            )
+
+    def reconcile(self) -> List[dict]:
+        """
+        Compares what has been recorded for every month along the way: the size of the blob as counted by the storage (blob_size) with the size of the local file (local_size), or with the Content-Length of the source (content_length) for a month streamed without a local file, and the number of data rows of the file (rows) with the number of rows the BULK INSERT reported (loaded_rows). A check is made only once both of its numbers have been recorded and the stage has completed, so it only reads the manifest and takes no time.
+
+        :returns: the file name of every month where the numbers disagree, with a description of every mismatch
+        :rtype: List[dict]
+        """
+        with self.__lock:
+            rows = self.__conn.execute(
+                "SELECT * FROM months ORDER BY file_name"
+            ).fetchall()
+        mismatches = []
+        for row in rows:
+            problems = []
+            size = row["local_size"]
+            if size is None:
+                size = row["content_length"]
+            if (
+                row["upload_status"] == "done"
+                and size is not None
+                and row["blob_size"] is not None
+                and size != row["blob_size"]
+            ):
+                problems.append(
+                    f"{size} bytes uploaded != {row['blob_size']} bytes in the blob"
+                )
+            # the rows left out of a direct insert are reported by dropped_rows
+            rejected = row["rejected_rows"] or 0
+            if (
+                row["load_status"] == "done"
+                and row["rows"] is not None
+                and row["loaded_rows"] is not None
+                and row["rows"] != row["loaded_rows"] + rejected
+            ):
+                problems.append(
+                    f"{row['rows']} rows downloaded != {row['loaded_rows'] + rejected} rows loaded or rejected"
+                )
+            if problems:
+                mismatches.append({"file_name": row["file_name"], "problems": problems})
+        return mismatches
+
+    def dropped_rows(self) -> List[dict]:
+        """
+        Finds the loaded months which have rows left out of the table: the rows which did not fit the table when the month was inserted directly (rejected_rows), and the rows whose pick-up is in another month, which are loaded into a staging table (loaded_rows) but left out when the month is switched into its partition (switched_rows). They are reported apart from the mismatches of reconcile.
+
+        :returns: the file name of every such month with the number of rows of another month (rows) and of rows which did not fit the table (rejected_rows)
+        :rtype: List[dict]
+        """
+        with self.__lock:
+            rows = self.__conn.execute(
+                """
+                SELECT file_name, COALESCE(loaded_rows - switched_rows, 0) AS rows,
+                COALESCE(rejected_rows, 0) AS rejected_rows FROM months
+                WHERE load_status = 'done' AND (loaded_rows > switched_rows OR rejected_rows > 0)
+                ORDER BY file_name
+                """
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self) -> dict:
+        """
+        Counts the months that have completed each of the stages.
+
+        :returns: the number of completed months per stage and the total number of months
+        :rtype: dict
+        """
+        with self.__lock:
+            row = self.__conn.execute(
+                """
+                SELECT COUNT(*),
+                SUM(download_status = 'done'),
+                SUM(upload_status = 'done'),
+                SUM(load_status = 'done')
+                FROM months
+                """
+            ).fetchone()
+        return dict(zip(("total",) + STAGES, (value or 0 for value in row)))
@@ -0,0 +1,222 @@
+import collections
+import itertools
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+
+def _key(name: str, labels: dict) -> Tuple[str, Tuple[Tuple[str, str], ...]]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    def __init__(self, prefix: str = "tlc", max_events: int = 100_000) -> None:
+        """
+        Collects timed spans, counters and gauges in memory and exports them as JSON lines (one event per span, for tracing a slow run) and as a Prometheus text file (the totals, e.g. for the textfile collector of the node exporter). Recording takes a lock and a few dict operations, so it is meant to be called once per file or per request rather than once per chunk; the hot loops add up their bytes locally and count them once.
+
+        :param prefix str: the prefix of the names of the Prometheus metrics.
+        :param max_events int: the maximum number of span events kept until they are exported; the oldest are dropped first.
+        """
+        self.prefix = prefix
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+        self.__ids = itertools.count(1)
+        self.__counters: Dict[tuple, float] = {}
+        self.__gauges: Dict[tuple, float] = {}
+        # the number of spans, their total and their longest duration, by name
+        self.__spans: Dict[str, List[float]] = {}
+        self.__events = collections.deque(maxlen=max_events)
+
+    @contextmanager
+    def span(self, name: str, **labels) -> Iterator[dict]:
+        """
+        Times the block. A span started inside another one on the same thread (e.g. the BULK INSERT inside the load of a month) records it as its parent, so the events can be put back together into a trace.
+
+        :param name str: the name of the span, e.g. 'download'.
+        :param labels: the details of the span, e.g. the file name. Further details can be added to the yielded dict inside the block.
+        :returns: a context manager which yields the labels of the span
+        """
+        stack = getattr(self.__local, "stack", None)
+        if stack is None:
+            stack = self.__local.stack = []
+        span_id = next(self.__ids)
+        parent_id = stack[-1] if stack else None
+        stack.append(span_id)
+        started_at = time.time()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield labels
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            event = {
+                "span": name,
+                "id": span_id,
+                "parent": parent_id,
+                "thread": threading.current_thread().name,
+                "start": started_at,
+                "duration": duration,
+                "error": error,
+                **labels,
+            }
+            with self.__lock:
+                totals = self.__spans.setdefault(name, [0, 0.0, 0.0])
+                totals[0] += 1
+                totals[1] += duration
+                totals[2] = max(totals[2], duration)
+                self.__events.append(event)
+
+    def count(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Adds to a counter, e.g. the bytes or the rows of a stage.
+
+        :param name str: the name of the counter, e.g. 'bytes'.
+        :param value float: the amount to add.
+        :param labels: the labels of the counter, e.g. stage='download'.
+        :returns: None
+        :rtype: NoneType
+        """
+        key = _key(name, labels)
+        with self.__lock:
+            self.__counters[key] = self.__counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        """
+        Sets a gauge, e.g. the depth of a queue or the number of busy workers.
+
+        :param name str: the name of the gauge, e.g. 'queue_depth'.
+        :param value float: the current value.
+        :param labels: the labels of the gauge, e.g. stage='upload'.
+        :returns: None
+        :rtype: NoneType
+        """
+        key = _key(name, labels)
+        with self.__lock:
+            self.__gauges[key] = value
+
+    def events(self) -> List[dict]:
+        """
+        Returns the span events which have not been exported yet.
+
+        :returns: the events, oldest first
+        :rtype: List[dict]
+        """
+        with self.__lock:
+            return list(self.__events)
+
+    def export_jsonl(self, path: str = "metrics.jsonl") -> int:
+        """
+        Appends the span events which have not been exported yet to a JSON lines file, followed by a snapshot of the counters and gauges.
+
+        :param path str: the file to append to.
+        :returns: the number of span events written
+        :rtype: int
+        """
+        with self.__lock:
+            events = list(self.__events)
+            self.__events.clear()
+            counters = dict(self.__counters)
+            gauges = dict(self.__gauges)
+        with open(path, "a") as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + "\n")
+            now = time.time()
+            for kind, values in (("counter", counters), ("gauge", gauges)):
+                for (name, labels), value in values.items():
+                    f.write(
+                        json.dumps(
+                            {kind: name, "time": now, "value": value, **dict(labels)}
+                        )
+                        + "\n"
+                    )
+        return len(events)
+
+    def _name(self, name: str) -> str:
+        return re.sub(r"[^a-zA-Z0-9_]", "_", f"{self.prefix}_{name}")
+
+    def export_prometheus(self, path: str = "metrics.prom") -> None:
+        """
+        Writes the totals in the Prometheus text format: a summary of the duration of every kind of span, the counters and the gauges. The file is replaced in one step, so a collector never reads half of it.
+
+        :param path str: the file to write.
+        :returns: None
+        :rtype: NoneType
+        """
+        with self.__lock:
+            spans = {name: list(totals) for name, totals in self.__spans.items()}
+            counters = dict(self.__counters)
+            gauges = dict(self.__gauges)
+
+        def series(name: str, labels, value: float) -> str:
+            text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+            return f"{name}{{{text}}} {value}" if text else f"{name} {value}"
+
+        name, longest_name = self._name("span_seconds"), self._name("span_seconds_max")
+        lines = [f"# TYPE {name} summary"]
+        for span_name, (number, total, _) in sorted(spans.items()):
+            lines.append(series(f"{name}_count", (("span", span_name),), number))
+            lines.append(series(f"{name}_sum", (("span", span_name),), total))
+        lines.append(f"# TYPE {longest_name} gauge")
+        for span_name, (_, _, longest) in sorted(spans.items()):
+            lines.append(series(longest_name, (("span", span_name),), longest))
+        for kind, values, suffix in (
+            ("counter", counters, "_total"),
+            ("gauge", gauges, ""),
+        ):
+            typed = set()
+            for (metric, labels), value in sorted(values.items()):
+                name = self._name(metric) + suffix
+                if name not in typed:
+                    lines.append(f"# TYPE {name} {kind}")
+                    typed.add(name)
+                lines.append(series(name, labels, value))
+
+        with open(f"{path}.tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """
+    Returns the Metrics object shared by the whole process, which the Collector, the FileManager, the Database and the Pipeline record into.
+
+    :returns: the shared Metrics object
+    :rtype: Metrics
+    """
+    return _metrics
+
+
+def span(name: str, **labels):
+    """
+    Times the block with the shared Metrics object, see Metrics.span.
+    """
+    return _metrics.span(name, **labels)
+
+
+def count(name: str, value: float = 1, **labels) -> None:
+    """
+    Adds to a counter of the shared Metrics object, see Metrics.count.
+    """
+    _metrics.count(name, value, **labels)
+
+
+def gauge(name: str, value: float, **labels) -> None:
+    """
+    Sets a gauge of the shared Metrics object, see Metrics.gauge.
+    """
+    _metrics.gauge(name, value, **labels)
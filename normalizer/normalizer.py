@@ -0,0 +1,310 @@
+import csv
+import io
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import humanize
+
+from database_manager.schema import TLC_COLUMNS
+
+VENDORS = {"cmt": "1", "vts": "2"}
+PAYMENT_TYPES = {
+    "credit": "1",
+    "cre": "1",
+    "crd": "1",
+    "cash": "2",
+    "cas": "2",
+    "csh": "2",
+    "no charge": "3",
+    "noc": "3",
+    "no": "3",
+    "dispute": "4",
+    "dis": "4",
+    "unknown": "5",
+    "unk": "5",
+    "voided trip": "6",
+}
+
+
+def _code(mapping: Dict[str, str]) -> Callable[[str], str]:
+    # numeric codes are kept, the names used by the older files are mapped to the codes of the current ones
+    def convert(value: str) -> str:
+        value = value.strip()
+        if not value or value.isdigit():
+            return value
+        return mapping.get(value.lower(), "")
+
+    return convert
+
+
+def _flag(value: str) -> str:
+    value = value.strip()
+    return {"0": "N", "1": "Y"}.get(value, value[:1].upper())
+
+
+def _same(value: str) -> str:
+    return value.strip()
+
+
+# for every version of the yellow taxi files: the source column (or None if the version does not have it) and how its
+# values are converted, for every column of the table in the order of TLC_COLUMNS
+SCHEMA_VERSIONS: Dict[str, List[Tuple[Optional[str], Callable[[str], str]]]] = {
+    # 2009
+    "2009": [
+        ("vendor_name", _code(VENDORS)),
+        ("trip_pickup_datetime", _same),
+        ("trip_dropoff_datetime", _same),
+        ("passenger_count", _same),
+        ("trip_distance", _same),
+        ("rate_code", _same),
+        ("store_and_forward", _flag),
+        (None, _same),
+        (None, _same),
+        ("payment_type", _code(PAYMENT_TYPES)),
+        ("fare_amt", _same),
+        ("surcharge", _same),
+        ("mta_tax", _same),
+        ("tip_amt", _same),
+        ("tolls_amt", _same),
+        (None, _same),
+        ("total_amt", _same),
+        (None, _same),
+    ],
+    # 2010 to 2014
+    "2010": [
+        ("vendor_id", _code(VENDORS)),
+        ("pickup_datetime", _same),
+        ("dropoff_datetime", _same),
+        ("passenger_count", _same),
+        ("trip_distance", _same),
+        ("rate_code", _same),
+        ("store_and_fwd_flag", _flag),
+        (None, _same),
+        (None, _same),
+        ("payment_type", _code(PAYMENT_TYPES)),
+        ("fare_amount", _same),
+        ("surcharge", _same),
+        ("mta_tax", _same),
+        ("tip_amount", _same),
+        ("tolls_amount", _same),
+        (None, _same),
+        ("total_amount", _same),
+        (None, _same),
+    ],
+    # 2015 to June 2016
+    "2015": [
+        ("vendorid", _same),
+        ("tpep_pickup_datetime", _same),
+        ("tpep_dropoff_datetime", _same),
+        ("passenger_count", _same),
+        ("trip_distance", _same),
+        ("ratecodeid", _same),
+        ("store_and_fwd_flag", _flag),
+        (None, _same),
+        (None, _same),
+        ("payment_type", _same),
+        ("fare_amount", _same),
+        ("extra", _same),
+        ("mta_tax", _same),
+        ("tip_amount", _same),
+        ("tolls_amount", _same),
+        ("improvement_surcharge", _same),
+        ("total_amount", _same),
+        (None, _same),
+    ],
+    # July 2016 to 2018
+    "2016": [
+        ("vendorid", _same),
+        ("tpep_pickup_datetime", _same),
+        ("tpep_dropoff_datetime", _same),
+        ("passenger_count", _same),
+        ("trip_distance", _same),
+        ("ratecodeid", _same),
+        ("store_and_fwd_flag", _flag),
+        ("pulocationid", _same),
+        ("dolocationid", _same),
+        ("payment_type", _same),
+        ("fare_amount", _same),
+        ("extra", _same),
+        ("mta_tax", _same),
+        ("tip_amount", _same),
+        ("tolls_amount", _same),
+        ("improvement_surcharge", _same),
+        ("total_amount", _same),
+        (None, _same),
+    ],
+}
+
+
+def _parse_header(line: bytes) -> List[str]:
+    header = next(csv.reader([line.decode("utf-8-sig")]))
+    return [column.strip().lower() for column in header]
+
+
+def _read_header(file_name: str) -> Tuple[List[str], int]:
+    with open(file_name, "rb") as f:
+        line = f.readline()
+    return _parse_header(line), len(line)
+
+
+def _normalize_range(
+    file_name: str, start: int, end: int, version: str, part_file: str
+) -> int:
+    # normalizes the rows between the two byte offsets; runs in the worker processes
+    header, _ = _read_header(file_name)
+    mapping = [
+        (header.index(source) if source else None, convert)
+        for source, convert in SCHEMA_VERSIONS[version]
+    ]
+    rows = 0
+    with open(file_name, "rb") as f, open(part_file, "w", newline="") as out:
+        f.seek(start)
+        text = io.TextIOWrapper(io.BytesIO(f.read(end - start)), newline="")
+        writer = csv.writer(out, lineterminator="\n")
+        for row in csv.reader(text):
+            if not row or not any(value.strip() for value in row):
+                continue
+            row += [""] * (len(header) - len(row))
+            writer.writerow(
+                [
+                    convert(row[index]) if index is not None else ""
+                    for index, convert in mapping
+                ]
+            )
+            rows += 1
+    return rows
+
+
+class Normalizer:
+    def __init__(self, processes: int = None, chunk_size: int = 64 * 1024 * 1024):
+        """
+        Maps the yellow taxi files of the older layouts (2009 to 2018) to the layout of the table created by Database.create_table. The layout of every file is detected from its header. Columns which the older files do not have (the zones of the pick-up and drop-off before July 2016, the improvement and congestion surcharges) are left empty and are loaded as NULL; the coordinates of the older files have no place in the table and are dropped.
+
+        :param processes int: the number of worker processes. Defaults to the number of cores.
+        :param chunk_size int: the number of bytes of the file given to a worker at a time.
+        """
+        self.processes = processes or os.cpu_count()
+        self.chunk_size = chunk_size
+
+    @staticmethod
+    def detect_version(file_name: str) -> Optional[str]:
+        """
+        Detects the layout of the file from its header.
+
+        :param file_name str: the csv file.
+        :returns: the version of the layout ('2009', '2010', '2015' or '2016'), or None if the file already has the layout of the table
+        :rtype: Optional[str]
+        """
+        with open(file_name, "rb") as f:
+            return Normalizer.detect_header_version(f.readline(), file_name)
+
+    @staticmethod
+    def detect_header_version(line: bytes, name: str = "the file") -> Optional[str]:
+        """
+        Detects the layout of a file from its first line, e.g. the first chunk of a stream which is never saved.
+
+        :param line bytes: the header of the file.
+        :param name str: the name of the file, for the error.
+        :returns: the version of the layout ('2009', '2010', '2015' or '2016'), or None if the file already has the layout of the table
+        :rtype: Optional[str]
+        """
+        header = _parse_header(line)
+        if header == [column.lower() for column in TLC_COLUMNS]:
+            return None
+        for version, mapping in SCHEMA_VERSIONS.items():
+            sources = {source for source, _ in mapping if source}
+            if sources.issubset(header) and (
+                version != "2015" or "pulocationid" not in header
+            ):
+                return version
+        raise ValueError(f"Unknown layout of {name}: {header}")
+
+    def _ranges(self, file_name: str, header_size: int) -> List[Tuple[int, int]]:
+        # splits the file into chunks at line breaks; the files of the older layouts do not quote their values,
+        # so every line break ends a row
+        size = os.path.getsize(file_name)
+        offsets = [header_size]
+        with open(file_name, "rb") as f:
+            while offsets[-1] + self.chunk_size < size:
+                f.seek(offsets[-1] + self.chunk_size)
+                f.readline()
+                if f.tell() >= size:
+                    break
+                offsets.append(f.tell())
+        offsets.append(size)
+        return list(zip(offsets[:-1], offsets[1:]))
+
+    def normalize(
+        self, file_name: str = "2010-01.csv", output_file: str = None
+    ) -> Optional[int]:
+        """
+        Writes the rows of the file in the layout of the table. The file is split into chunks at row boundaries which are normalized by a pool of processes and put back together in their original order, so the output is the same as if it was normalized by a single process.
+
+        :param file_name str: the csv file to normalize.
+        :param output_file str: the csv file to write to. Defaults to replacing file_name.
+        :returns: the number of rows written, or None if the file already has the layout of the table
+        :rtype: Optional[int]
+        """
+        version = self.detect_version(file_name)
+        output_file = output_file or file_name
+        if version is None:
+            if output_file != file_name:
+                shutil.copyfile(file_name, output_file)
+            return None
+
+        start = time.perf_counter()
+        _, header_size = _read_header(file_name)
+        ranges = self._ranges(file_name, header_size)
+        print(
+            f"Normalizing {file_name} ({version} layout) in {len(ranges)} chunks with {self.processes} processes..."
+        )
+        work_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_file)))
+        parts = [os.path.join(work_dir, f"{i:05d}.csv") for i in range(len(ranges))]
+        try:
+            if self.processes > 1 and len(ranges) > 1:
+                # the pipeline calls this from one of its threads; a forked child would inherit the locks those
+                # threads hold (e.g. of the logging and HTTP pools) and could hang on them
+                context = multiprocessing.get_context(
+                    "forkserver"
+                    if "forkserver" in multiprocessing.get_all_start_methods()
+                    else "spawn"
+                )
+                with ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=context
+                ) as executor:
+                    futures = [
+                        executor.submit(
+                            _normalize_range, file_name, first, last, version, part
+                        )
+                        for (first, last), part in zip(ranges, parts)
+                    ]
+                    rows = sum(future.result() for future in futures)
+            else:
+                rows = sum(
+                    _normalize_range(file_name, first, last, version, part)
+                    for (first, last), part in zip(ranges, parts)
+                )
+
+            # every part is removed once it has been copied, so the merge takes up at most one chunk more than
+            # the parts
+            merged = os.path.join(work_dir, "merged.csv")
+            with open(merged, "wb") as out:
+                out.write((",".join(TLC_COLUMNS) + "\n").encode())
+                for part in parts:
+                    with open(part, "rb") as f:
+                        shutil.copyfileobj(f, out)
+                    os.remove(part)
+            os.replace(merged, output_file)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        duration = time.perf_counter() - start
+        print(
+            f"{file_name}: {humanize.intcomma(rows)} rows normalized ({rows / max(duration, 1e-9):.0f} rows/s)"
+        )
+        return rows
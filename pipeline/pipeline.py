@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from metrics.metrics import gauge, span
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    function: Callable[[Any], Any]
+    workers: int = 1
+
+
+@dataclass
+class PipelineResult:
+    item: Any
+    value: Any = None
+    durations: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+    failed_stage: Optional[str] = None
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], queue_size: int = 2) -> None:
+        """
+        Runs the items through a sequence of stages where every stage has its own pool of workers and the stages are connected by bounded queues. Different items are in different stages at the same time, e.g. while month N+1 is downloading, month N is uploading and month N-1 is loading, so the total time approaches the time of the slowest stage rather than the sum of all of them.
+
+        :param stages List[Stage]: the stages in the order they are to be run. Each stage gets the value returned by the previous one; the first stage gets the item itself.
+        :param queue_size int: the maximum number of items waiting between two stages. It bounds the work (e.g. the downloaded files) piling up in front of a slow stage.
+        """
+        self.stages = stages
+        self.queue_size = queue_size
+
+    def run(
+        self,
+        items: Iterable[Any],
+        callback: Callable[[PipelineResult], None] = None,
+    ) -> List[PipelineResult]:
+        """
+        Runs all the items through the stages. An item that fails in one of the stages skips the rest of them; the error and the name of the stage are recorded in its result and the other items are not affected.
+
+        :param items Iterable[Any]: the items to process, e.g. the urls of the months. A generator is only advanced when the first stage has room for the next item. If it raises, the items it has produced so far still go through the stages and the error is raised once they have left the last one.
+        :param callback Callable[[PipelineResult], None]: called with the result of every item once it has left the last stage, e.g. to update a progress bar.
+        :returns: one result per item with the value returned by the last stage and the time spent in every stage, in the same order as the items
+        :rtype: List[PipelineResult]
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        queues.append(queue.Queue())
+        remaining = [stage.workers for stage in self.stages]
+        busy = [0 for _ in self.stages]
+        lock = threading.Lock()
+
+        def work(index: int) -> None:
+            stage = self.stages[index]
+            while True:
+                record = queues[index].get()
+                if record is _DONE:
+                    break
+                if record.error is None:
+                    # how many items wait in front of the stage and how many of its workers are busy tell the
+                    # bottleneck apart from the stages starved by it
+                    with lock:
+                        busy[index] += 1
+                        gauge("busy_workers", busy[index], stage=stage.name)
+                    gauge("queue_depth", queues[index].qsize(), stage=stage.name)
+                    start = time.perf_counter()
+                    try:
+                        with span(f"stage:{stage.name}", item=str(record.item)):
+                            record.value = stage.function(record.value)
+                    except Exception as e:
+                        print(f"{stage.name} failed for {record.item}: {e}")
+                        record.error = repr(e)
+                        record.failed_stage = stage.name
+                    record.durations[stage.name] = time.perf_counter() - start
+                    with lock:
+                        busy[index] -= 1
+                        gauge("busy_workers", busy[index], stage=stage.name)
+                queues[index + 1].put(record)
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last:
+                following = (
+                    self.stages[index + 1].workers
+                    if index + 1 < len(self.stages)
+                    else 1
+                )
+                for _ in range(following):
+                    queues[index + 1].put(_DONE)
+
+        threads = [
+            threading.Thread(target=work, args=(index,), daemon=True)
+            for index, stage in enumerate(self.stages)
+            for _ in range(stage.workers)
+        ]
+        for thread in threads:
+            thread.start()
+
+        positions = {}
+        failures = []
+
+        def feed() -> None:
+            try:
+                for position, item in enumerate(items):
+                    record = PipelineResult(item, item)
+                    positions[id(record)] = position
+                    queues[0].put(record)
+            except Exception as e:
+                # e.g. the store of a worker cannot be reached; the items fed so far still finish their stages
+                failures.append(e)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        results = []
+        while True:
+            record = queues[-1].get()
+            if record is _DONE:
+                break
+            results.append(record)
+            if callback is not None:
+                callback(record)
+        for thread in threads:
+            thread.join()
+        feeder.join()
+        if failures:
+            raise failures[0]
+
+        return sorted(results, key=lambda record: positions[id(record)])
@@ -0,0 +1,130 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Tuple
+
+
+def wait_until(
+    check: Callable[[], bool],
+    description: str = "the resource to become ready",
+    timeout: float = 300.0,
+    initial_delay: float = 1.0,
+    max_delay: float = 30.0,
+    factor: float = 2.0,
+) -> None:
+    """
+    Polls until the check succeeds, waiting longer after every failed attempt (1s, 2s, 4s... up to max_delay). A check that raises counts as not ready yet. This replaces fixed sleeps: a resource that is ready straight away costs a single check, and one that takes longer is still waited for.
+
+    :param check Callable[[], bool]: returns True once the resource is ready.
+    :param description str: what is being waited for, used in the messages.
+    :param timeout float: the number of seconds after which a TimeoutError is raised.
+    :param initial_delay float: the number of seconds to wait after the first failed check.
+    :param max_delay float: the longest wait between two checks.
+    :param factor float: how much the wait grows after every failed check.
+    :returns: None
+    :rtype: NoneType
+    """
+    deadline = time.monotonic() + timeout
+    delay = initial_delay
+    while True:
+        try:
+            if check():
+                return
+            reason = "not ready"
+        except Exception as e:
+            reason = str(e).splitlines()[0] if str(e) else repr(e)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(
+                f"Timed out after {timeout:.0f}s waiting for {description}: {reason}"
+            )
+        print(f"Waiting for {description} ({reason}), retrying in {delay:.1f}s...")
+        time.sleep(min(delay, remaining))
+        delay = min(delay * factor, max_delay)
+
+
+class Provisioner:
+    def __init__(self, max_workers: int = 4) -> None:
+        """
+        Runs the provisioning steps in the order given by their dependencies, running the steps which do not depend on each other (e.g. the container, the server and the firewall rule) at the same time. The steps themselves are expected to check what is already in place and skip it, so a warm start only pays for the checks.
+
+        :param max_workers int: the maximum number of steps run at the same time.
+        """
+        self.max_workers = max_workers
+        self.steps: Dict[str, Tuple[Callable[[], None], Tuple[str, ...]]] = {}
+
+    def add(
+        self, name: str, function: Callable[[], None], depends_on: Iterable[str] = ()
+    ) -> None:
+        """
+        Adds a step.
+
+        :param name str: the name of the step.
+        :param function Callable[[], None]: the function which runs the step.
+        :param depends_on Iterable[str]: the names of the steps which have to complete before this one starts.
+        :returns: None
+        :rtype: NoneType
+        """
+        self.steps[name] = (function, tuple(depends_on))
+
+    def run(self) -> Dict[str, float]:
+        """
+        Runs all the steps. If a step fails, the steps which depend on it, directly or through other steps, are not started, the steps which do not are still completed, and the first error is raised at the end.
+
+        :returns: the number of seconds every completed step took
+        :rtype: Dict[str, float]
+        """
+        for name, (_, depends_on) in self.steps.items():
+            for dependency in depends_on:
+                if dependency not in self.steps:
+                    raise ValueError(f"Step '{name}' depends on unknown '{dependency}'")
+
+        durations: Dict[str, float] = {}
+        failed: List[Tuple[str, BaseException]] = []
+        pending = dict(self.steps)
+        running = {}
+
+        def timed(name: str, function: Callable[[], None]) -> float:
+            start = time.perf_counter()
+            function()
+            return time.perf_counter() - start
+
+        circular: List[str] = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # a skipped step blocks the steps which depend on it in turn, so the skipping is repeated until the
+                # whole chain below a failed step has been skipped
+                skipped = True
+                while skipped:
+                    skipped = False
+                    blocked = {name for name, _ in failed}
+                    for name, (_, depends_on) in list(pending.items()):
+                        if any(dependency in blocked for dependency in depends_on):
+                            print(
+                                f"Skipping '{name}' as a step it depends on has failed."
+                            )
+                            failed.append((name, None))
+                            del pending[name]
+                            skipped = True
+                for name, (function, depends_on) in list(pending.items()):
+                    if all(dependency in durations for dependency in depends_on):
+                        running[executor.submit(timed, name, function)] = name
+                        del pending[name]
+                if not running:
+                    # none of the steps left has a failed step above it, so they wait for each other
+                    circular = sorted(pending)
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    if future.exception() is not None:
+                        print(f"Step '{name}' failed: {future.exception()}")
+                        failed.append((name, future.exception()))
+                    else:
+                        durations[name] = future.result()
+
+        errors = [error for _, error in failed if error is not None]
+        if errors:
+            raise errors[0]
+        if circular:
+            raise ValueError(f"Steps {circular} have circular dependencies")
+        return durations
@@ -0,0 +1,232 @@
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+from metrics.metrics import gauge
+
+# the status codes which mean that the endpoint is overloaded (e.g. S3 SlowDown is a 503) and the ones which
+# usually go away on their own
+THROTTLE_STATUSES = {429, 503}
+TRANSIENT_STATUSES = {408, 500, 502, 504}
+
+# the error numbers of Azure SQL Database which mean that the database is busy or hit a resource limit, and the
+# ones which mean that it is briefly unavailable, e.g. during a failover
+SQL_THROTTLE_ERRORS = {10928, 10929, 40501, 49918, 49919, 49920}
+SQL_TRANSIENT_ERRORS = {
+    64,
+    233,
+    4060,
+    4221,
+    10053,
+    10054,
+    10060,
+    40143,
+    40197,
+    40540,
+    40613,
+    42108,
+    42109,
+}
+SQL_TRANSIENT_STATES = {"08001", "08S01", "HYT00", "HYT01"}
+
+
+def classify(error: BaseException) -> Optional[str]:
+    """
+    Tells whether a failed call is worth retrying. The errors of requests, of the Azure SDK and of pyodbc are recognised by their status code, SQL error number or SQLSTATE, so neither the Azure SDK nor pyodbc has to be imported.
+
+    :param error BaseException: the error raised by the call.
+    :returns: 'throttle' if the endpoint asked to slow down, 'transient' if the error is likely to go away on a retry, None otherwise
+    :rtype: Optional[str]
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return "transient"
+    if isinstance(error, requests.exceptions.ChunkedEncodingError):
+        return "transient"
+
+    # requests.HTTPError has the status on its response, the Azure SDK errors have it on the error itself
+    response = getattr(error, "response", None)
+    status = getattr(error, "status_code", None) or getattr(
+        response, "status_code", None
+    )
+    if status in THROTTLE_STATUSES:
+        return "throttle"
+    if status in TRANSIENT_STATUSES:
+        return "transient"
+    if type(error).__name__ in ("ServiceRequestError", "ServiceResponseError"):
+        return "transient"
+
+    # pyodbc errors carry the SQLSTATE and a message which ends with the error number, e.g. '... (40613)'
+    if type(error).__module__ == "pyodbc" and error.args:
+        numbers = {int(n) for n in re.findall(r"\((\d+)\)", str(error.args[-1]))}
+        if numbers & SQL_THROTTLE_ERRORS:
+            return "throttle"
+        if numbers & SQL_TRANSIENT_ERRORS or error.args[0] in SQL_TRANSIENT_STATES:
+            return "transient"
+    return None
+
+
+class Endpoint:
+    def __init__(
+        self,
+        name: str,
+        limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        attempts: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        classifier: Callable[[BaseException], Optional[str]] = classify,
+    ) -> None:
+        """
+        Retries the calls to a single endpoint (e.g. the S3 bucket, the storage account or the SQL server) with a jittered exponential backoff, and limits the number of calls in flight with an AIMD limit: the limit grows by one after every `limit` successful calls and is halved when the endpoint throttles, so the parallelism settles just below what the endpoint can take. The calls, retries, throttles and latencies are counted for the report.
+
+        :param name str: the name of the endpoint, used in the messages and the report.
+        :param limit int: the number of calls allowed in flight at the start.
+        :param min_limit int: the lowest the limit is cut to.
+        :param max_limit int: the highest the limit grows to.
+        :param attempts int: the number of times a call is made before its error is raised.
+        :param base_delay float: the longest wait before the first retry. The longest wait doubles after every retry and the actual wait is drawn at random below it, so the callers which failed together do not retry together.
+        :param max_delay float: the longest wait before a retry.
+        :param classifier Callable[[BaseException], Optional[str]]: tells the errors worth retrying from the others, see classify.
+        """
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.classifier = classifier
+        self.__condition = threading.Condition()
+        self.__limit = float(max(min_limit, min(limit, max_limit)))
+        self.__in_flight = 0
+        self.__last_decrease = 0.0
+        self.__stats = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "throttles": 0,
+            "latency_total": 0.0,
+            "latency_max": 0.0,
+        }
+
+    @property
+    def limit(self) -> int:
+        """
+        The number of calls currently allowed in flight.
+        """
+        with self.__condition:
+            return int(self.__limit)
+
+    def _acquire(self) -> None:
+        with self.__condition:
+            while self.__in_flight >= int(self.__limit):
+                self.__condition.wait()
+            self.__in_flight += 1
+            gauge("in_flight", self.__in_flight, endpoint=self.name)
+
+    def _release(self, outcome: Optional[str], latency: float) -> None:
+        with self.__condition:
+            self.__in_flight -= 1
+            now = time.monotonic()
+            if outcome == "success":
+                self.__limit = min(self.__limit + 1 / self.__limit, self.max_limit)
+                self.__stats["successes"] += 1
+            elif outcome == "throttle":
+                self.__stats["throttles"] += 1
+                # the calls in flight when the endpoint started throttling fail together; the limit is only cut
+                # once for all of them
+                if now - self.__last_decrease > latency:
+                    self.__limit = max(self.__limit / 2, self.min_limit)
+                    self.__last_decrease = now
+            self.__stats["latency_total"] += latency
+            self.__stats["latency_max"] = max(self.__stats["latency_max"], latency)
+            gauge("in_flight", self.__in_flight, endpoint=self.name)
+            gauge("concurrency_limit", int(self.__limit), endpoint=self.name)
+            self.__condition.notify_all()
+
+    def call(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls the function once a slot is free and retries it while it fails with an error the classifier deems worth retrying. The function has to be safe to call again after a failure, e.g. a download which rewrites its file from the start.
+
+        :param function Callable: the function to call.
+        :param args: the positional arguments of the function.
+        :param kwargs: the keyword arguments of the function.
+        :returns: what the function returns
+        :rtype: Any
+        """
+        for attempt in range(self.attempts):
+            self._acquire()
+            start = time.perf_counter()
+            try:
+                with self.__condition:
+                    self.__stats["calls"] += 1
+                result = function(*args, **kwargs)
+            except Exception as e:
+                kind = self.classifier(e)
+                self._release(kind, time.perf_counter() - start)
+                if kind is None or attempt == self.attempts - 1:
+                    with self.__condition:
+                        self.__stats["failures"] += 1
+                    raise
+                delay = random.uniform(
+                    0, min(self.max_delay, self.base_delay * 2**attempt)
+                )
+                with self.__condition:
+                    self.__stats["retries"] += 1
+                print(
+                    f"{self.name}: {kind} error ({str(e).splitlines()[0] if str(e) else repr(e)}), retrying in {delay:.1f}s (limit {self.limit})..."
+                )
+                time.sleep(delay)
+            else:
+                self._release("success", time.perf_counter() - start)
+                return result
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Returns the counters of the endpoint.
+
+        :returns: the number of calls, successes, failures, retries and throttles, the average and the longest latency in seconds and the current limit
+        :rtype: Dict[str, float]
+        """
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats["limit"] = int(self.__limit)
+        latency_total = stats.pop("latency_total")
+        stats["latency_avg"] = latency_total / stats["calls"] if stats["calls"] else 0.0
+        return stats
+
+
+_endpoints: Dict[str, Endpoint] = {}
+_endpoints_lock = threading.Lock()
+
+
+def endpoint(name: str, **kwargs) -> Endpoint:
+    """
+    Returns the Endpoint with the given name, creating it on the first call, so all the clients which talk to the same endpoint share its limit and its counters.
+
+    :param name str: the name of the endpoint, e.g. the host name.
+    :param kwargs: the arguments of Endpoint, used only when it is created.
+    :returns: the endpoint
+    :rtype: Endpoint
+    """
+    with _endpoints_lock:
+        if name not in _endpoints:
+            _endpoints[name] = Endpoint(name, **kwargs)
+        return _endpoints[name]
+
+
+def endpoint_stats() -> Dict[str, Dict[str, float]]:
+    """
+    Returns the counters of every endpoint created so far.
+
+    :returns: the counters (see Endpoint.stats) by the name of the endpoint
+    :rtype: Dict[str, Dict[str, float]]
+    """
+    with _endpoints_lock:
+        endpoints = list(_endpoints.values())
+    return {e.name: e.stats() for e in endpoints}
@@ -0,0 +1,151 @@
+import os
+import threading
+import time
+from typing import Dict
+
+import humanize
+
+
+class Spool:
+    def __init__(
+        self,
+        directory: str = "downloads",
+        quota: int = 20 * 1024**3,
+        keep: bool = False,
+    ) -> None:
+        """
+        A directory for the local copies of the months with a limit on the bytes they take up. Space is reserved before a file is written, and a reservation that does not fit waits until enough space has been freed, so the disk used never grows beyond the quota however many months are ingested. A file that is still being worked on is pinned; once it is released it is deleted, or kept for later runs and evicted least recently used first when the space is needed.
+
+        :param directory str: the directory to keep the files in. It is created if it does not exist; the files already in it are picked up as kept files.
+        :param quota int: the maximum number of bytes taken up by the files, including the space reserved for the ones being written.
+        :param keep bool: whether to keep the released files until their space is needed, so a rerun can use them instead of downloading them again.
+        """
+        self.directory = directory
+        self.quota = quota
+        self.keep = keep
+        self.__condition = threading.Condition()
+        # the size, the time of the last use and whether the file is pinned, for every file in the spool
+        self.__entries: Dict[str, list] = {}
+        os.makedirs(directory, exist_ok=True)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                self.__entries[name] = [
+                    os.path.getsize(path),
+                    os.path.getmtime(path),
+                    False,
+                ]
+
+    def path(self, file_name: str) -> str:
+        """
+        Returns the path of the file inside the spool.
+
+        :param file_name str: the name of the file, e.g. '2021-07.csv'.
+        :returns: the path of the file
+        :rtype: str
+        """
+        return os.path.join(self.directory, os.path.basename(file_name))
+
+    @property
+    def used(self) -> int:
+        """
+        The number of bytes taken up by the files and reserved for the ones being written.
+        """
+        with self.__condition:
+            return sum(size for size, _, _ in self.__entries.values())
+
+    def _evict(self, name: str) -> None:
+        # called with the condition held
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+        del self.__entries[name]
+
+    def acquire(self, file_name: str) -> bool:
+        """
+        Pins the file if it is in the spool, so it is not evicted while it is being worked on.
+
+        :param file_name str: the name of the file.
+        :returns: True if the file is in the spool and does not have to be downloaded again
+        :rtype: bool
+        """
+        name = os.path.basename(file_name)
+        path = self.path(name)
+        with self.__condition:
+            if not os.path.isfile(path):
+                self.__entries.pop(name, None)
+                return False
+            self.__entries[name] = [os.path.getsize(path), time.time(), True]
+            return True
+
+    def reserve(self, file_name: str, size: int, timeout: float = None) -> str:
+        """
+        Reserves space for a file which is about to be written and pins it. The released files are evicted, least recently used first, until the reservation fits; if it still does not, the call blocks until other files are released.
+
+        :param file_name str: the name of the file.
+        :param size int: the number of bytes to reserve, e.g. the Content-Length of the source. If 0, only the completed file counts towards the quota.
+        :param timeout float: the number of seconds to wait for the space. Waits for as long as it takes if None.
+        :returns: the path to write the file to
+        :rtype: str
+        """
+        name = os.path.basename(file_name)
+        if size > self.quota:
+            raise ValueError(
+                f"{name} needs {humanize.naturalsize(size)}, more than the quota of {humanize.naturalsize(self.quota)}"
+            )
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.__condition:
+            # the space of an earlier copy of the file is reused
+            if name in self.__entries:
+                self._evict(name)
+            while True:
+                used = sum(entry[0] for entry in self.__entries.values())
+                if used + size <= self.quota:
+                    break
+                released = [n for n, entry in self.__entries.items() if not entry[2]]
+                if released:
+                    self._evict(min(released, key=lambda n: self.__entries[n][1]))
+                    continue
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out waiting for {humanize.naturalsize(size)} of space for {name}"
+                    )
+                print(f"The spool is full, {name} is waiting for space...")
+                self.__condition.wait(remaining)
+            self.__entries[name] = [size, time.time(), True]
+        return self.path(name)
+
+    def commit(self, file_name: str) -> None:
+        """
+        Replaces the reservation of the file with the size it has on disk once it has been written.
+
+        :param file_name str: the name of the file.
+        :returns: None
+        :rtype: NoneType
+        """
+        name = os.path.basename(file_name)
+        with self.__condition:
+            if name in self.__entries:
+                self.__entries[name][0] = os.path.getsize(self.path(name))
+            self.__condition.notify_all()
+
+    def release(self, file_name: str) -> None:
+        """
+        Unpins the file once nothing needs it anymore. It is deleted straight away, or kept until its space is needed if the spool keeps its files.
+
+        :param file_name str: the name of the file.
+        :returns: None
+        :rtype: NoneType
+        """
+        name = os.path.basename(file_name)
+        with self.__condition:
+            if name in self.__entries:
+                if self.keep and os.path.isfile(self.path(name)):
+                    self.__entries[name][0] = os.path.getsize(self.path(name))
+                    self.__entries[name][1] = time.time()
+                    self.__entries[name][2] = False
+                else:
+                    self._evict(name)
+            self.__condition.notify_all()
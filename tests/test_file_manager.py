@@ -0,0 +1,34 @@
+from benchmark.fakes import FakeBlobClient, FakeBlobServiceClient
+from file_manager.file_manager import FileManager
+
+
+class ServerBusy(Exception):
+    # what the Azure SDK raises for a 503, as far as retry.classify is concerned
+    status_code = 503
+
+
+def fail_once(monkeypatch, name: str, calls: list) -> None:
+    method = getattr(FakeBlobClient, name)
+
+    def flaky(self, *args, **kwargs):
+        calls.append(name)
+        if calls.count(name) == 1:
+            raise ServerBusy("The server is busy.")
+        return method(self, *args, **kwargs)
+
+    monkeypatch.setattr(FakeBlobClient, name, flaky)
+
+
+def test_blocks_and_commit_are_sent_again_after_a_503(tmp_path, monkeypatch):
+    calls = []
+    fail_once(monkeypatch, "stage_block", calls)
+    fail_once(monkeypatch, "commit_block_list", calls)
+    fmanager = FileManager(FakeBlobServiceClient(str(tmp_path)))
+    chunks = [b"VendorID,fare_amount\n", b"1,2.5\n", b"2,7.0\n"]
+
+    uploaded = fmanager.upload_stream("tlc-data", "2021-07.csv", chunks)
+
+    assert uploaded == sum(len(chunk) for chunk in chunks)
+    assert calls.count("stage_block") == len(chunks) + 1
+    assert calls.count("commit_block_list") == 2
+    assert (tmp_path / "tlc-data" / "2021-07.csv").read_bytes() == b"".join(chunks)
@@ -0,0 +1,36 @@
+from normalizer.normalizer import Normalizer
+
+HEADER = "vendor_id,pickup_datetime,dropoff_datetime,passenger_count,trip_distance,pickup_longitude,pickup_latitude,rate_code,store_and_fwd_flag,dropoff_longitude,dropoff_latitude,payment_type,fare_amount,surcharge,mta_tax,tip_amount,tolls_amount,total_amount\n"
+
+
+def write_month(path, rows: int) -> None:
+    with open(path, "w", newline="") as f:
+        f.write(HEADER)
+        for i in range(rows):
+            f.write(
+                f"{('VTS', 'CMT')[i % 2]},2010-01-{i % 28 + 1:02d} 10:{i % 60:02d}:00,2010-01-{i % 28 + 1:02d} 11:{i % 60:02d}:00,"
+                f"{i % 5 + 1},{i % 17}.5,-73.98,40.75,1,{('', 'N', 'Y')[i % 3]},-73.99,40.76,{('CSH', 'CRD')[i % 2]},"
+                f"{i % 40}.25,0.5,0.5,{i % 7},0,{i % 50}.75\n"
+            )
+
+
+def test_processes_write_the_same_file_as_a_single_process(tmp_path):
+    source = tmp_path / "2010-01.csv"
+    write_month(source, 5000)
+    single, pooled = tmp_path / "single.csv", tmp_path / "pooled.csv"
+
+    rows = Normalizer(processes=1, chunk_size=16 * 1024).normalize(
+        str(source), str(single)
+    )
+    pooled_rows = Normalizer(processes=3, chunk_size=16 * 1024).normalize(
+        str(source), str(pooled)
+    )
+
+    assert rows == pooled_rows == 5000
+    assert single.read_bytes() == pooled.read_bytes()
+    # the parts are removed as they are merged, so nothing is left next to the output
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "2010-01.csv",
+        "pooled.csv",
+        "single.csv",
+    ]
@@ -0,0 +1,30 @@
+import pytest
+
+from provisioner.provisioner import Provisioner
+
+
+def fail() -> None:
+    raise RuntimeError("the server could not be created")
+
+
+def test_failure_skips_the_whole_chain_below_it():
+    ran = []
+    provisioner = Provisioner()
+    provisioner.add("server", fail)
+    provisioner.add("database", lambda: ran.append("database"), ["server"])
+    provisioner.add("ready", lambda: ran.append("ready"), ["database"])
+    provisioner.add("table", lambda: ran.append("table"), ["ready"])
+    provisioner.add("container", lambda: ran.append("container"))
+
+    with pytest.raises(RuntimeError, match="the server could not be created"):
+        provisioner.run()
+    assert ran == ["container"]
+
+
+def test_circular_dependencies_are_reported():
+    provisioner = Provisioner()
+    provisioner.add("a", lambda: None, ["b"])
+    provisioner.add("b", lambda: None, ["a"])
+
+    with pytest.raises(ValueError, match="circular"):
+        provisioner.run()
@@ -0,0 +1,43 @@
+import csv
+
+from database_manager.schema import TLC_COLUMNS
+from validator.validator import Validator
+
+HEADER = ",".join(TLC_COLUMNS) + "\n"
+ROW = "2,2021-07-19 16:50:35,2021-07-19 17:43:19,3,6.63,1,N,208,156,2,19.07,0.5,0.5,0.0,0,0.3,22.87,2.5\n"
+
+
+def test_header_only_input_keeps_the_header(tmp_path):
+    source, output = tmp_path / "2021-07.csv", tmp_path / "2021-07.clean.csv"
+    source.write_text(HEADER)
+
+    result = Validator().validate(str(source), str(output))
+
+    assert (result.rows, result.bad_rows) == (0, 0)
+    assert output.read_text() == HEADER
+
+
+def test_rows_are_kept_rewritten_or_rejected(tmp_path):
+    source = tmp_path / "2021-07.csv"
+    output, rejected = tmp_path / "2021-07.clean.csv", tmp_path / "2021-07.rejected.csv"
+    source.write_text(
+        HEADER
+        + ROW
+        + ROW.replace("2,2021", "2.0,2021", 1)
+        + ROW.replace("2021-07-19 16", "2021-02-30 16")
+        + ROW.replace("6.63", "abc")
+        + "1,2,3\n"
+    )
+
+    result = Validator(chunk_size=2).validate(str(source), str(output), str(rejected))
+
+    assert (result.rows, result.bad_rows) == (5, 3)
+    assert output.read_text() == HEADER + ROW + ROW
+    with open(rejected, newline="") as f:
+        reasons = [row[-1] for row in csv.reader(f)]
+    assert reasons == [
+        "reason",
+        "tpep_pickup_datetime",
+        "trip_distance",
+        "3 fields instead of 18",
+    ]
@@ -0,0 +1,268 @@
+import csv
+import io
+import itertools
+import time
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Callable, Dict, Iterator, List, TextIO, Tuple
+
+import humanize
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+
+from database_manager.schema import DATETIME_FORMAT, PARSERS, TLC_COLUMNS, TLC_SCHEMA
+
+# the range of the int and datetime types of SQL Server
+INT_MIN, INT_MAX = -(2**31), 2**31 - 1
+DATETIME_MIN = datetime(1753, 1, 1)
+
+# the values every type of the table takes as they are written in the csv files; nine digits always fit an int and
+# the years before 1753 do not match. An empty value matches too and is loaded as NULL
+PATTERNS: Dict[str, str] = {
+    "int": r"-?\d{1,9}",
+    "float": r"-?\d+(\.\d+)?",
+    "datetime": r"(17[5-9]\d|1[89]\d\d|[2-9]\d{3})-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01]) ([01]\d|2[0-3]):[0-5]\d:[0-5]\d",
+    "char": r"[^\s\"]",
+}
+
+
+def _check_int(value: str) -> str:
+    number = PARSERS["int"](value)
+    if str(number) != value and float(value) != number:
+        raise ValueError(f"{value} is not a whole number")
+    if not INT_MIN <= number <= INT_MAX:
+        raise ValueError(f"{value} is out of range")
+    return str(number)
+
+
+def _check_float(value: str) -> str:
+    number = PARSERS["float"](value)
+    if number != number or number in (float("inf"), float("-inf")):
+        raise ValueError(f"{value} is not a number")
+    return value
+
+
+def _check_datetime(value: str) -> str:
+    moment = PARSERS["datetime"](value)
+    if moment.tzinfo is not None or moment < DATETIME_MIN:
+        raise ValueError(f"{value} cannot be stored")
+    if len(value) == 19 and value[10] == " ":
+        return value
+    return moment.strftime(DATETIME_FORMAT)
+
+
+def _check_char(value: str) -> str:
+    if len(value) > 1:
+        raise ValueError(f"{value} is longer than one character")
+    return value
+
+
+# how a value of every type of the table is checked when it does not match its pattern; a check returns the value as
+# it is written to the clean file, e.g. '1' for '1.0' in an int column, and raises a ValueError if it does not fit
+CHECKS: Dict[str, Callable[[str], str]] = {
+    "int": _check_int,
+    "float": _check_float,
+    "datetime": _check_datetime,
+    "char": _check_char,
+}
+
+
+def _is_date(value: str) -> bool:
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+
+@dataclass
+class ValidationResult:
+    file_name: str
+    rows: int = 0
+    bad_rows: int = 0
+    duration: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        """
+        The average validation speed in rows per second.
+        """
+        return self.rows / self.duration if self.duration else 0.0
+
+
+def _records(f: TextIO) -> Iterator[Tuple[str, bool]]:
+    # the text of every row of a csv file and whether its quotes are closed; a line break inside a quoted value does
+    # not end the row
+    lines, quotes = [], 0
+    for line in f:
+        if not lines and '"' not in line:
+            yield line, True
+            continue
+        lines.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        yield "".join(lines), True
+        lines, quotes = [], 0
+    if lines:
+        yield "".join(lines), False
+
+
+def _values(text: str) -> List[str]:
+    if '"' not in text:
+        return text.rstrip("\r\n").split(",")
+    return next(csv.reader([text]), [])
+
+
+class Validator:
+    def __init__(self, chunk_size: int = 200_000) -> None:
+        """
+        Checks the csv files against the schema of the table created by Database.create_table before they are uploaded, so a malformed value is caught on the local machine instead of failing the BULK INSERT minutes into the load.
+
+        :param chunk_size int: the number of rows checked at a time. The memory used depends on it and not on the size of the file.
+        """
+        self.chunk_size = chunk_size
+        self.checks: List[Tuple[str, Callable[[str], str]]] = [
+            (column, CHECKS[sql_type]) for column, sql_type in TLC_SCHEMA
+        ]
+
+    @staticmethod
+    def _plain(lines: List[str]) -> List[bool]:
+        # which of the lines, all of them without quotes and with a value for every column, only have values in the
+        # form the table takes; every column is matched against the pattern of its type at once, so only the other
+        # lines are checked value by value
+        if not lines:
+            return []
+        table = pv.read_csv(
+            io.BytesIO("".join(lines).encode()),
+            read_options=pv.ReadOptions(column_names=TLC_COLUMNS),
+            convert_options=pv.ConvertOptions(
+                column_types={column: pa.string() for column in TLC_COLUMNS},
+                strings_can_be_null=False,
+            ),
+        )
+        plain = None
+        for column, sql_type in TLC_SCHEMA:
+            values = table[column]
+            fits = pc.match_substring_regex(values, f"^({PATTERNS[sql_type]})?$")
+            if sql_type == "datetime":
+                # the pattern lets through the days a month does not have, e.g. 2021-02-30
+                days = pc.utf8_slice_codeunits(values, 0, 10)
+                wrong = [
+                    day
+                    for day in pc.unique(pc.filter(days, fits)).to_pylist()
+                    if day and not _is_date(day)
+                ]
+                if wrong:
+                    fits = pc.and_(fits, pc.invert(pc.is_in(days, pa.array(wrong))))
+            plain = fits if plain is None else pc.and_(plain, fits)
+        return plain.to_pylist()
+
+    def _check_row(self, values: List[str]) -> Tuple[List[str], str]:
+        # returns the values as they are written to the clean file and the columns which do not fit the table
+        clean, bad = [], []
+        for value, (column, check) in zip(values, self.checks):
+            value = value.strip()
+            if value:
+                try:
+                    value = check(value)
+                except ValueError:
+                    bad.append(column)
+            clean.append(value)
+        return clean, ";".join(bad)
+
+    def validate(
+        self,
+        file_name: str = "2021-07.csv",
+        output_file: str = "2021-07.clean.csv",
+        quarantine_file: str = None,
+    ) -> ValidationResult:
+        """
+        Reads the file in chunks of rows and writes the rows which fit the schema of the table to output_file, as they were unless a value has to be rewritten for the table (e.g. '1.0' in an int column). Every column of a chunk is matched at once against the form its type takes; only the values which do not match are checked one by one with the parser of their type (schema.PARSERS). A row with a value that does not fit (e.g. a letter in an int column or a date SQL Server cannot store) is dropped, or written to quarantine_file as it was, with the names of the offending columns in an extra 'reason' column. A row with more or fewer values than the table has columns is dropped the same way, with the number of its values as the reason, rather than being padded with NULLs. Empty values are kept and loaded as NULL. The output always starts with the header, even if no row fits.
+
+        :param file_name str: the csv file to validate. Its header has to match the columns of the table.
+        :param output_file str: the csv file to write the clean rows to.
+        :param quarantine_file str: the csv file to write the bad rows to. If None, the bad rows are only counted.
+        :returns: the number of rows, the number of bad rows and the time it took
+        :rtype: ValidationResult
+        """
+        start = time.perf_counter()
+        result = ValidationResult(file_name)
+        separators = len(TLC_COLUMNS) - 1
+        with open(file_name, newline="") as f:
+            header = [name.strip() for name in _values(f.readline())]
+            if header != TLC_COLUMNS:
+                raise ValueError(
+                    f"The columns of {file_name} do not match the table: {header}"
+                )
+
+            print(f"Validating {file_name}...")
+            with open(output_file, "w", newline="") as out:
+                quarantine = (
+                    open(quarantine_file, "w", newline="") if quarantine_file else None
+                )
+                try:
+                    if quarantine is not None:
+                        rejects = csv.writer(quarantine)
+                        rejects.writerow(TLC_COLUMNS + ["reason"])
+                    out.write(",".join(TLC_COLUMNS) + "\n")
+                    writer = csv.writer(out, lineterminator="\n")
+                    records = _records(f)
+                    while True:
+                        chunk = list(itertools.islice(records, self.chunk_size))
+                        if not chunk:
+                            break
+                        # the lines without quotes and with the right number of values, i.e. nearly all of them
+                        simple = [
+                            index
+                            for index, (text, closed) in enumerate(chunk)
+                            if closed
+                            and text.count(",") == separators
+                            and '"' not in text
+                        ]
+                        plain = dict.fromkeys(
+                            itertools.compress(
+                                simple, self._plain([chunk[i][0] for i in simple])
+                            )
+                        )
+
+                        lines = []
+                        for index, (text, closed) in enumerate(chunk):
+                            if index in plain:
+                                lines.append(
+                                    text if text.endswith("\n") else f"{text}\n"
+                                )
+                                result.rows += 1
+                                continue
+                            if not text.strip():
+                                continue
+                            result.rows += 1
+                            values = _values(text)
+                            if not closed:
+                                clean, reason = values, "unclosed quote"
+                            elif len(values) != len(TLC_COLUMNS):
+                                clean = values
+                                reason = f"{len(values)} fields instead of {len(TLC_COLUMNS)}"
+                            else:
+                                clean, reason = self._check_row(values)
+                            if reason:
+                                result.bad_rows += 1
+                                if quarantine is not None:
+                                    rejects.writerow(values + [reason])
+                            elif '"' not in text:
+                                lines.append(",".join(clean) + "\n")
+                            else:
+                                out.writelines(lines)
+                                lines.clear()
+                                writer.writerow(clean)
+                        out.writelines(lines)
+                finally:
+                    if quarantine is not None:
+                        quarantine.close()
+
+        result.duration = time.perf_counter() - start
+        print(
+            f"{file_name}: {humanize.intcomma(result.rows)} rows, {humanize.intcomma(result.bad_rows)} bad ({result.rows_per_second:.0f} rows/s)"
+        )
+        return result